@@ -0,0 +1,70 @@
+""" Benchmark: memory used per wire and per net of a synthesized design.
+
+    This measures (with tracemalloc) how many bytes each wire and each net of a
+    synthesized tree multiplier take up, including their entries in the block.
+    The nets are measured both in a Block and in a CompactBlock.  Run it with a
+    bitwidth as its argument to measure a bigger multiplier, for example:
+
+        python examples/benchmark-memory.py 32
+"""
+
+import gc
+import sys
+import pyrtl
+from pyrtl.rtllib import multipliers
+
+try:
+    import tracemalloc
+except ImportError:  # before python 3.4
+    print('this benchmark needs tracemalloc (python 3.4 or later)')
+    sys.exit(0)
+
+
+def measure(build):
+    """ Return the bytes still allocated after calling build(), and its result. """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0], result
+    finally:
+        tracemalloc.stop()
+
+
+def copy_wires(wires):
+    block = pyrtl.Block()
+    copies = []
+    for w in wires:
+        if isinstance(w, pyrtl.Const):
+            copies.append(pyrtl.Const(w.val, bitwidth=w.bitwidth, block=block))
+        else:
+            copies.append(type(w)(w.bitwidth, name=w.name, block=block))
+        copies[-1].bitmask  # which is computed when first used
+    return block, copies
+
+
+def copy_nets(block_type, nets):
+    # new tuples are built, so that they are counted for a Block
+    block = block_type()
+    for net in nets:
+        block.logic.add(pyrtl.LogicNet(net.op, net.op_param, tuple(list(net.args)),
+                                       tuple(list(net.dests))))
+    return block
+
+
+bitwidth = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+a, b = pyrtl.Input(bitwidth, 'a'), pyrtl.Input(bitwidth, 'b')
+product = pyrtl.Output(2 * bitwidth, 'product')
+product <<= multipliers.tree_multiplier(a, b)
+synth_block = pyrtl.synthesize()
+wires = sorted(synth_block.wirevector_set, key=lambda w: w.name)
+nets = list(synth_block.logic)
+print('synthesized %dx%d tree_multiplier: %d wires, %d nets'
+      % (bitwidth, bitwidth, len(wires), len(nets)))
+
+size, _ = measure(lambda: copy_wires(wires))
+print('  %6.1f bytes/wire' % (size / len(wires)))
+for block_type in (pyrtl.Block, pyrtl.CompactBlock):
+    size, _ = measure(lambda: copy_nets(block_type, nets))
+    print('  %6.1f bytes/net in a %s' % (size / len(nets), block_type.__name__))
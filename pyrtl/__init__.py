@@ -7,6 +7,8 @@ from .pyrtlexceptions import PyrtlInternalError
 from .core import LogicNet
 from .core import Block
 from .core import PostSynthBlock
+from .core import CompactBlock
+from .core import CompactPostSynthBlock
 from .core import working_block
 from .core import reset_working_block
 from .core import set_working_block
@@ -47,7 +49,12 @@ from .conditional import ConditionalUpdate  # eliminated, now just throws useful
 # block simulation support
 from .simulation import Simulation
 from .simulation import FastSimulation
+from .simulation import ParallelSimulation
+from .simulation import CompiledSimulation
+from .simulation import set_fastsim_code_cache
+from .simulation import run_parallel
 from .simulation import SimulationTrace
+from .simulation import StreamingVCDTrace
 
 # input and output to file format routines
 from .inputoutput import input_from_blif
@@ -64,6 +71,7 @@ from .passes import synthesize
 from .passes import nand_synth
 from .passes import and_inverter_synth
 from .passes import optimize
+from .passes import simplify
 
 
 from .transform import net_transform, wire_transform, replace_wire, copy_block, clone_wire
@@ -7,8 +7,10 @@ working_block -- the "current" Block to which, by default, all created nets are
 modes -- access methods for "modes" such as debug
 """
 from __future__ import print_function, unicode_literals
+import array
 import collections
 import re
+import six
 
 from .pyrtlexceptions import PyrtlError, PyrtlInternalError
 
@@ -159,31 +161,161 @@ class Block(object):
     defined operations, but it can be useful in certain cases to only allow a
     subset of operations (such as when transforms are being done that are "lowering"
     the blocks to more primitive ops.
+
+    Finally, if the member structural_hashing is set to True, the operators which
+    build combinational logic (such as "&", "+", selection, concat and select) return
+    the existing result wire when an identical net, with the same op, op_param and
+    args, is already in the block rather than building another one.  It is off by
+    default, since with it on the same wire can be returned more than once (and so
+    renaming a result can rename the result of another operation too).
     """
 
     def __init__(self):
         """Creates an empty hardware block."""
+        self._version = 0  # count of structural changes, used to invalidate self._cache
+        self._cache = {}  # {name: (version key, value)} of values derived from the structure
+        self._checked_index = None  # the index at the last successful sanity_check
+        self._dirty_nets = set()  # nets and wires changed since then
+        self._dirty_wires = set()
         self.logic = set()  # set of nets, each is a LogicNet named tuple
         self.wirevector_set = set()  # set of all wirevectors
         self.wirevector_by_name = {}  # map from name->wirevector, used for performance
         # pre-synthesis wirevectors to post-synthesis vectors
         self.legal_ops = set('w~&|^n+-*<>=xcsrm@')  # set of legal OPS
         self.rtl_assert_dict = {}   # map from wirevectors -> exceptions, used by rtl_assert
+        self.structural_hashing = False  # reuse identical combinational nets when building
 
     def __str__(self):
         """String form has one LogicNet per line."""
         return '\n'.join(str(l) for l in self)
 
+    @property
+    def logic(self):
+        return self._logic
+
+    @logic.setter
+    def logic(self, nets):
+        self._logic = _TrackedSet(nets, self)
+        self._changed()
+
+    @property
+    def wirevector_set(self):
+        return self._wirevector_set
+
+    @wirevector_set.setter
+    def wirevector_set(self, wires):
+        self._wirevector_set = _TrackedSet(wires, self)
+        self._changed()
+
+    def _changed(self):
+        """ Record a change to the structure of the block.
+
+        This invalidates everything cached about the structure (such as the net
+        connections and the topological order).  It is called whenever logic or
+        wirevector_set is replaced or changed in place (see _TrackedSet).
+        """
+        self._version += 1
+
+    def _cache_key(self):
+        return self._version
+
+    def _current(self, name):
+        """ Return the cached value called name if it is up to date, else None. """
+        entry = self._cache.get(name)
+        if entry is None or entry[0] != self._cache_key():
+            return None
+        return entry[1]
+
+    def _keep(self, name, value):
+        """ Cache value as up to date with the current block. """
+        self._cache[name] = (self._cache_key(), value)
+
+    def _cached(self, name, compute):
+        """ Return the value of compute(), cached until the block next changes. """
+        value = self._current(name)
+        if value is None:
+            value = compute()
+            self._keep(name, value)
+        return value
+
+    def _index(self):
+        """ Return the index of the block, built if it is not up to date.
+
+        The index is ({wire type: set of wires}, {op: set of nets}, {wire: set of nets
+        driving it}, {wire: set of nets reading it}).  Adding and removing wires and nets
+        through the methods of the block updates the index in place; any other change
+        causes it to be rebuilt when next used.
+        """
+        return self._cached('index', self._compute_index)
+
+    def _compute_index(self):
+        wires_by_type = {}
+        for w in self.wirevector_set:
+            wires_by_type.setdefault(type(w), set()).add(w)
+        nets_by_op, drivers, readers = {}, {}, {}
+        for net in self.logic:
+            self._index_net(net, (wires_by_type, nets_by_op, drivers, readers))
+        return wires_by_type, nets_by_op, drivers, readers
+
+    @staticmethod
+    def _index_net(net, index):
+        wires_by_type, nets_by_op, drivers, readers = index
+        nets_by_op.setdefault(net.op, set()).add(net)
+        for w in net.dests:
+            drivers.setdefault(w, set()).add(net)
+        for w in net.args:
+            readers.setdefault(w, set()).add(net)
+
+    @staticmethod
+    def _unindex_net(net, index):
+        wires_by_type, nets_by_op, drivers, readers = index
+        nets_by_op[net.op].discard(net)
+        for w in net.dests:
+            drivers[w].discard(net)
+        for w in net.args:
+            readers[w].discard(net)
+
+    def _tracking(self, index):
+        """ True if changes should be recorded for the next incremental sanity_check.
+
+        That is only the case while the index is still the one which was checked;
+        otherwise the next check will be a full one anyway.
+        """
+        return index is not None and index is self._checked_index
+
     def add_wirevector(self, wirevector):
         """ Add a wirevector object to the block."""
         self.sanity_check_wirevector(wirevector)
+        index = self._current('index')
+        if self._tracking(index):
+            previous = self.wirevector_by_name.get(wirevector.name)
+            if previous is not None and previous is not wirevector:
+                self._dirty_wires.add(previous)  # so that the duplicate name is noticed
+            self._dirty_wires.add(wirevector)
+        structural = self._current('structural')
         self.wirevector_set.add(wirevector)
         self.wirevector_by_name[wirevector.name] = wirevector
+        if index is not None:
+            index[0].setdefault(type(wirevector), set()).add(wirevector)
+            self._keep('index', index)
+        if structural is not None:  # which only depends on the nets
+            self._keep('structural', structural)
 
     def remove_wirevector(self, wirevector):
         """ Remove a wirevector object to the block."""
+        index = self._current('index')
+        structural = self._current('structural')
         self.wirevector_set.remove(wirevector)
         del self.wirevector_by_name[wirevector.name]
+        if structural is not None:
+            self._keep('structural', structural)
+        if index is not None:
+            index[0][type(wirevector)].discard(wirevector)
+            if self._tracking(index):
+                # any net still connected to the wire is now broken
+                self._dirty_nets.update(index[2].get(wirevector, ()),
+                                        index[3].get(wirevector, ()))
+            self._keep('index', index)
 
     def add_net(self, net):
         """ Add a net to the logic of the block.
@@ -193,7 +325,55 @@ class Block(object):
         added seperately with add_wirevector."""
 
         self.sanity_check_net(net)
+        index = self._current('index')
+        if self._tracking(index):
+            self._dirty_nets.add(net)
+            self._dirty_wires.update(net.args, net.dests)
+        structural = self._current('structural')
         self.logic.add(net)
+        if index is not None:
+            self._index_net(net, index)
+            self._keep('index', index)
+        if structural is not None:
+            if net.op in _hashed_ops and len(net.dests) == 1:
+                structural.setdefault(_net_structural_key(*net[:3]), net)
+            self._keep('structural', structural)
+
+    def remove_net(self, net):
+        """ Remove a net from the logic of the block.
+
+        The wires of the net stay in the block, they can be removed separately
+        with remove_wirevector."""
+        index = self._current('index')
+        if self._tracking(index):
+            self._dirty_wires.update(net.args, net.dests)
+        structural = self._current('structural')
+        self.logic.remove(net)
+        if index is not None:
+            self._unindex_net(net, index)
+            self._keep('index', index)
+        if structural is not None:
+            if net.op in _hashed_ops:
+                key = _net_structural_key(*net[:3])
+                if structural.get(key) == net:
+                    del structural[key]
+            self._keep('structural', structural)
+
+    def _existing_result(self, op, op_param, args):
+        """ With structural_hashing on, the dest of a net in the block computing
+        op with op_param on args, if there is one.  Otherwise None. """
+        if not self.structural_hashing or op not in _hashed_ops:
+            return None
+        net = self._cached('structural', self._compute_structural).get(
+            _net_structural_key(op, op_param, args))
+        return None if net is None else net.dests[0]
+
+    def _compute_structural(self):
+        structural = {}  # {structural key: net}
+        for net in self.logic:
+            if net.op in _hashed_ops and len(net.dests) == 1:
+                structural.setdefault(_net_structural_key(*net[:3]), net)
+        return structural
 
     def wirevector_subset(self, cls=None, exclude=tuple()):
         """Return set of wirevectors, filtered by the type or tuple of types provided as cls.
@@ -201,25 +381,26 @@ class Block(object):
         If no cls is specified, the full set of wirevectors associated with the Block are
         returned.  If cls is a single type, or a tuple of types, only those wirevectors of
         the matching types will be returned.  This is helpful for getting all inputs, outputs,
-        or registers of a block for example."""
-        if cls is None:
-            initial_set = self.wirevector_set
-        else:
-            initial_set = (x for x in self.wirevector_set if isinstance(x, cls))
-        if exclude == tuple():
-            return set(initial_set)
-        else:
-            return set(x for x in initial_set if not isinstance(x, exclude))
+        or registers of a block for example.  The result is a new set, built from an
+        index of the wires by type in time proportional to its size."""
+        if cls is None and not exclude:
+            return set(self.wirevector_set)
+        wires_by_type = self._index()[0]
+        types = [t for t in wires_by_type if (cls is None or issubclass(t, cls)) and
+                 not issubclass(t, exclude)]
+        return set().union(*[wires_by_type[t] for t in types])
 
     def logic_subset(self, op=None):
         """Return set of logicnets, filtered by the type(s) of logic op provided as op.
 
         If no op is specified, the full set of logicnets associated with the Block are
-        returned.  This is helpful for getting all memories of a block for example."""
+        returned.  This is helpful for getting all memories of a block for example.
+        A filtered result is a new set, built from an index of the nets by op in time
+        proportional to its size."""
         if op is None:
             return self.logic
-        else:
-            return set(x for x in self.logic if x.op in op)
+        nets_by_op = self._index()[1]
+        return set().union(*[nets_by_op[o] for o in set(op) if o in nets_by_op])
 
     def get_wirevector_by_name(self, name, strict=False):
         """Return the wirevector matching name.
@@ -252,13 +433,32 @@ class Block(object):
         Look at input_output.net_graph for one such graph that uses the information
         from this function
         """
+        src_list, dst_list = self._net_connections()
+        src_list = dict(src_list)
+        dst_list = {w: list(nets) for w, nets in dst_list.items()}
+
+        if include_virtual_nodes:
+            from .wire import Input, Output, Const
+            for wire in self.wirevector_subset((Input, Const)):
+                if wire in src_list:
+                    raise _multiple_drivers_error(wire)
+                src_list[wire] = wire
+
+            for wire in self.wirevector_subset(Output):
+                dst_list.setdefault(wire, []).insert(0, wire)
+        return src_list, dst_list
+
+    def _net_connections(self):
+        """ The cached result of net_connections(), which must not be modified. """
+        return self._cached('net_connections', self._compute_net_connections)
+
+    def _compute_net_connections(self):
         src_list = {}
         dst_list = {}
 
         def add_wire_src(edge, node):
             if edge in src_list:
-                raise PyrtlError('Wire "{}" has multiple drivers (check for multiple assignments '
-                                 'with "<<=" or accidental mixing of "|=" and "<<=")'.format(edge))
+                raise _multiple_drivers_error(edge)
             src_list[edge] = node
 
         def add_wire_dst(edge, node):
@@ -269,14 +469,6 @@ class Block(object):
             else:
                 dst_list[edge] = [node]
 
-        if include_virtual_nodes:
-            from .wire import Input, Output, Const
-            for wire in self.wirevector_subset((Input, Const)):
-                add_wire_src(wire, wire)
-
-            for wire in self.wirevector_subset(Output):
-                add_wire_dst(wire, wire)
-
         for net in self.logic:
             for arg in set(net.args):  # prevents unexpected duplicates when doing b <<= a & a
                 add_wire_dst(arg, net)
@@ -297,12 +489,16 @@ class Block(object):
         Note: this method will throw an error if there are loops in the
         logic that do not involve registers
         Also, the order of the nets is not guaranteed to be the the same
-        over multiple iterations"""
+        over multiple iterations (although it is computed only once, and then
+        reused until the block is changed)"""
+        return iter(self._cached('topological_order', self._topological_order))
+
+    def _topological_order(self):
         from .wire import Input, Const, Register
-        src_dict, dest_dict = self.net_connections()
+        src_dict, dest_dict = self._net_connections()
         to_clear = self.wirevector_subset((Input, Const, Register))
         cleared = set()
-        remaining = self.logic.copy()
+        order = []
         try:
             while len(to_clear):
                 wire_to_check = to_clear.pop()
@@ -310,25 +506,43 @@ class Block(object):
                 if wire_to_check in dest_dict:
                     for gate in dest_dict[wire_to_check]:  # loop over logicnets not yet returned
                         if all(arg in cleared for arg in gate.args):  # if all args ready
-                            yield gate
-                            remaining.remove(gate)
+                            order.append(gate)
                             if gate.op != 'r':
                                 to_clear.update(gate.dests)
         except KeyError as e:
             import six
             six.raise_from(PyrtlError("Cannot Iterate through malformed block"), e)
 
-        if len(remaining) is not 0:
-            from pyrtl.helperfuncs import find_and_print_loop
-            find_and_print_loop(self)
-            raise PyrtlError("Failure in Block Iterator due to non-register loops")
+        if len(order) != len(self.logic):
+            self._loop_error()
+        return tuple(order)
 
-    def sanity_check(self):
+    def _loop_error(self):
+        from pyrtl.helperfuncs import find_and_print_loop
+        find_and_print_loop(self)
+        raise PyrtlError("Failure in Block Iterator due to non-register loops")
+
+    def sanity_check(self, full=False):
         """ Check block and throw PyrtlError or PyrtlInternalError if there is an issue.
 
+        :param full: if True, check the entire block.  Otherwise only the nets and wires
+          added or removed since the last successful check, and the wires and nets
+          around them, are checked (which finds the same problems).  Everything is
+          checked anyway the first time, and after any change not made through
+          add_net, remove_net, add_wirevector, or remove_wirevector.
+
         Should not modify anything, only check data structures to make sure they have been
         built according to the assumptions stated in the Block comments."""
+        index = self._index()
+        if full or index is not self._checked_index:
+            self._full_sanity_check()
+        else:
+            self._incremental_sanity_check(index)
+        self._checked_index = index
+        self._dirty_nets.clear()
+        self._dirty_wires.clear()
 
+    def _full_sanity_check(self):
         # TODO: check that the wirevector_by_name is sane
         from .wire import Input, Const, Output
         from .helperfuncs import get_stack, get_stacks
@@ -355,7 +569,7 @@ class Block(object):
         all_input_and_consts = self.wirevector_subset((Input, Const))
 
         # The following line also checks for duplicate wire drivers
-        wire_src_dict, wire_dst_dict = self.net_connections()
+        wire_src_dict, wire_dst_dict = self._net_connections()
         dest_set = set(wire_src_dict.keys())
         arg_set = set(wire_dst_dict.keys())
         full_set = dest_set | arg_set
@@ -393,6 +607,61 @@ class Block(object):
                 print('Warning: Wires driven but never used { %s } ' % names)
                 print(get_stacks(*unused))
 
+    def _incremental_sanity_check(self, index):
+        """ The checks of _full_sanity_check, limited to the dirty nets and wires. """
+        from .wire import Input, Const, Output
+        from .helperfuncs import get_stack, get_stacks
+        wires_by_type, nets_by_op, drivers, readers = index
+
+        nets = [net for net in self._dirty_nets if net in self.logic]
+        for net in nets:
+            self.sanity_check_net(net)
+        wires = set(w for w in self._dirty_wires if w in self.wirevector_set)
+        for net in nets:
+            wires.update(net.args, net.dests)
+
+        for w in wires:
+            if w.bitwidth is None:
+                raise PyrtlError(
+                    'error, missing bitwidth for WireVector "%s" \n\n %s' % (w.name, get_stack(w)))
+
+        duplicates = []
+        for w in wires:
+            other = self.wirevector_by_name.get(w.name)
+            if other is not None and other is not w and other in self.wirevector_set:
+                duplicates.append(w.name)
+        if duplicates:
+            raise PyrtlError('Duplicate wire names found for the following '
+                             'different signals: %s' % repr(duplicates))
+
+        for w in wires:
+            if len(drivers.get(w, ())) > 1:
+                raise _multiple_drivers_error(w)
+
+        unconnected = [w for w in wires if not drivers.get(w) and not readers.get(w) and
+                       not isinstance(w, (Input, Const))]
+        if unconnected:
+            bad_wire_names = '\n    '.join(str(x) for x in unconnected)
+            raise PyrtlError('Wires declared but not connected:\n %s \n\n %s' % (bad_wire_names,
+                             get_stacks(*unconnected)))
+
+        undriven = [w for w in wires if readers.get(w) and not drivers.get(w) and
+                    not isinstance(w, (Input, Const))]
+        if undriven:
+            raise PyrtlError('Wires used but never driven: %s \n\n %s' %
+                             ([w.name for w in undriven], get_stacks(*undriven)))
+
+        if nets:
+            self.sanity_check_memory_sync()
+
+        if debug_mode:
+            unused = [w for w in wires if drivers.get(w) and not readers.get(w) and
+                      not isinstance(w, Output)]
+            if len(unused) > 0:
+                names = [w.name for w in unused]
+                print('Warning: Wires driven but never used { %s } ' % names)
+                print(get_stacks(*unused))
+
     def sanity_check_memory_sync(self, wire_src_dict=None):
         """ Check that all memories are synchronous unless explicitly specified as async.
 
@@ -407,7 +676,12 @@ class Block(object):
             return  # nothing to check here
 
         if wire_src_dict is None:
-            wire_src_dict, wdd = self.net_connections()
+            drivers = self._index()[2]
+
+            def source(wire):
+                return next(iter(drivers[wire]))
+        else:
+            source = wire_src_dict.__getitem__
 
         from .wire import Input, Const
         sync_src = 'r'
@@ -418,7 +692,7 @@ class Block(object):
                 wire = wires_to_check.pop()
                 if isinstance(wire, (Input, Const)):
                     continue
-                src_net = wire_src_dict[wire]
+                src_net = source(wire)
                 if src_net.op == sync_src:
                     continue
                 elif src_net.op in sync_prop:
@@ -531,6 +805,64 @@ class Block(object):
             raise PyrtlInternalError('error, mem write dest should be empty tuple')
 
 
+# the ops whose result depends only on op, op_param and args ('w' is left out since
+# its dest is given rather than built, and memories since they hold state)
+_hashed_ops = frozenset('~&|^n+-*<>=xcs')
+_commutative_ops = frozenset('&|^n+*=')
+
+
+def _net_structural_key(op, op_param, args):
+    """ A hashable key which is the same for nets computing the same value.
+
+    The args are identified by id, since comparing wirevectors with "==" builds logic,
+    and put in a fixed order for the commutative ops.  The key is only meaningful
+    while the args are alive (for example while a net holding them is in a block).
+    """
+    ids = tuple(id(a) for a in args)
+    if op in _commutative_ops:
+        ids = tuple(sorted(ids))
+    return op, op_param, ids
+
+
+def _multiple_drivers_error(wire):
+    return PyrtlError('Wire "{}" has multiple drivers (check for multiple assignments '
+                      'with "<<=" or accidental mixing of "|=" and "<<=")'.format(wire))
+
+
+class _TrackedSet(set):
+    """ A set which tells its block whenever it is changed in place.
+
+    The logic and wirevector_set of a Block are kept in these, so that the values
+    cached about the structure of the block are dropped however the sets are edited.
+    """
+
+    # the sets built by copy and the set operators (which are _TrackedSets in python 2,
+    # without __init__ being called) belong to no block
+    _block = None
+
+    def __init__(self, items=(), block=None):
+        super(_TrackedSet, self).__init__(items)
+        self._block = block
+
+
+def _tracked(name):
+    change = getattr(set, name)
+
+    def tracked_change(self, *args):
+        result = change(self, *args)
+        if self._block is not None:
+            self._block._changed()
+        return result
+    tracked_change.__name__ = str(name)
+    return tracked_change
+
+
+for _name in ('add', 'discard', 'remove', 'pop', 'clear', 'update', 'difference_update',
+              'intersection_update', 'symmetric_difference_update',
+              '__ior__', '__iand__', '__isub__', '__ixor__'):
+    setattr(_TrackedSet, _name, _tracked(_name))
+
+
 class PostSynthBlock(Block):
     """ This is a block with extra metadata required to maintain the
     pre synthesis interface post synthesis
@@ -542,6 +874,288 @@ class PostSynthBlock(Block):
         self.mem_map = {}
 
 
+class CompactBlock(Block):
+    """ A Block which stores its logic compactly, for very large netlists.
+
+    Rather than as a set of LogicNet tuples, the nets are kept in arrays of op codes
+    and of the numbers of the wires they connect, using a few tens of bytes per net
+    instead of a few hundred.  The logic of a CompactBlock still acts as a set of
+    LogicNets (each net is built when it is used) and a CompactBlock can be used
+    anywhere a Block can.  The topological order is found on the arrays.
+
+    As in Block, the nets built by iterating over the block are kept for later
+    iterations until the block changes, which takes about as much memory again as
+    the arrays while they are kept.  If keep_built_nets is set to False, the nets
+    are built again on each iteration instead, which takes several times as long.
+    """
+
+    keep_built_nets = True
+
+    def _set_logic(self, nets):
+        if not isinstance(nets, _CompactNets) or nets._block is not None:
+            nets = _CompactNets(nets)
+        nets._block = self
+        self._logic = nets
+        self._changed()
+
+    logic = property(Block.logic.fget, _set_logic)
+
+    def __iter__(self):
+        if self.keep_built_nets:
+            return super(CompactBlock, self).__iter__()
+        return self.logic._nets(self._cached('topological_slots', self._topological_slots))
+
+    def _topological_order(self):
+        return list(self.logic._nets(self._topological_slots()))
+
+    def _topological_slots(self):
+        """ The slots of the nets in topological order, found as in Block. """
+        from .wire import Input, Const, Register
+        nets = self.logic
+        ops, arg_ends, args, dests = nets._ops, nets._arg_ends, nets._args, nets._dests
+
+        # the nets reading wire w are readers[first[w]:first[w + 1]]
+        first = array.array('l', [0]) * (len(nets._wires) + 1)
+        waiting = array.array('l', [0]) * len(ops)  # count of args not yet cleared
+        start = 0
+        for slot, end in enumerate(arg_ends):
+            if ops[slot]:
+                unique = set(args[start:end])
+                waiting[slot] = len(unique)
+                for w in unique:
+                    first[w + 1] += 1
+            start = end
+        for w in range(len(nets._wires)):
+            first[w + 1] += first[w]
+        readers = array.array('l', [0]) * first[-1]
+        filled = first[:-1]
+        start = 0
+        for slot, end in enumerate(arg_ends):
+            if ops[slot]:
+                for w in set(args[start:end]):
+                    readers[filled[w]] = slot
+                    filled[w] += 1
+            start = end
+
+        to_clear = [nets._wire_numbers[w] for w in self.wirevector_set
+                    if isinstance(w, (Input, Const, Register)) and w in nets._wire_numbers]
+        cleared = bytearray(len(nets._wires))
+        order = array.array('l')
+        register = ord('r')
+        while to_clear:
+            w = to_clear.pop()
+            if cleared[w]:
+                continue
+            cleared[w] = 1
+            for slot in readers[first[w]:first[w + 1]]:
+                waiting[slot] -= 1
+                if not waiting[slot]:  # if all args ready
+                    order.append(slot)
+                    if ops[slot] != register:
+                        if dests[slot] >= 0:
+                            to_clear.append(dests[slot])
+                        else:
+                            to_clear.extend(nets._number(d) for d in nets._odd_dests[slot])
+
+        if len(order) != len(nets):
+            self._loop_error()
+        return order
+
+
+# the op of each op code byte stored by _CompactNets
+_op_chars = [six.unichr(code) for code in range(256)]
+
+
+class _CompactNets(collections.MutableSet):
+    """ A set of LogicNets stored as columns of integers.
+
+    Each net added takes the next slot.  Its op is the byte _ops[slot] (0 once the
+    net is removed), its args are the wire numbers _args[_arg_ends[slot - 1]:
+    _arg_ends[slot]], and its dest is the wire number _dests[slot], or -1 with the
+    dests in _odd_dests for the nets without exactly one.  Op params are only stored
+    for the nets which have them.  A net is found again through _drivers, the slot of
+    a net driving each wire, except for the few (such as memory writes) kept in _others.
+    """
+
+    def __init__(self, nets=()):
+        self._wires = []  # wire number -> wire
+        self._wire_numbers = {}  # wire -> wire number
+        self._drivers = array.array('i')  # wire number -> slot of a net driving it, or -1
+        self._ops = array.array('B')
+        self._params = {}
+        self._arg_ends = array.array('I')
+        self._args = array.array('i')
+        self._dests = array.array('i')
+        self._odd_dests = {}
+        self._others = {}  # net -> slot
+        self._size = 0
+        self._block = None  # the CompactBlock told of each change, as with _TrackedSet
+        for net in nets:
+            self.add(net)
+
+    @classmethod
+    def _from_iterable(cls, nets):
+        # the results of set operations are plain sets
+        return set(nets)
+
+    def copy(self):
+        return set(self)
+
+    def union(self, *others):
+        return set(self).union(*others)
+
+    def difference(self, *others):
+        return set(self).difference(*others)
+
+    def intersection(self, *others):
+        return set(self).intersection(*others)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, net):
+        return self._find(net) is not None
+
+    def __iter__(self):
+        return self._nets(slot for slot, op in enumerate(self._ops) if op)
+
+    def _net(self, slot):
+        """ Build the LogicNet in slot. """
+        return next(self._nets((slot,)))
+
+    def _nets(self, slots):
+        """ Build the LogicNets in each of slots in turn. """
+        ops, params, arg_ends, args, dests = (self._ops, self._params, self._arg_ends,
+                                              self._args, self._dests)
+        wire, odd_dests = self._wires.__getitem__, self._odd_dests
+        new, op_chars, get_param = tuple.__new__, _op_chars, params.get
+        for slot in slots:
+            dest = dests[slot]
+            yield new(LogicNet, (op_chars[ops[slot]], get_param(slot),
+                                 tuple(map(wire, args[arg_ends[slot - 1] if slot else 0:
+                                                      arg_ends[slot]])),
+                                 (wire(dest),) if dest >= 0 else odd_dests[slot]))
+
+    def _number(self, wire):
+        """ Return the number of the wire, giving it the next one if it has none. """
+        number = self._wire_numbers.get(wire)
+        if number is None:
+            number = self._wire_numbers[wire] = len(self._wires)
+            self._wires.append(wire)
+            self._drivers.append(-1)
+        return number
+
+    def _find(self, net):
+        """ Return the slot of net, or None if it is not in the set. """
+        if not isinstance(net, LogicNet):
+            return None
+        if len(net.dests) == 1:
+            number = self._wire_numbers.get(net.dests[0])
+            if number is not None:
+                slot = self._drivers[number]
+                if slot >= 0 and self._net(slot) == net:
+                    return slot
+        return self._others.get(net)
+
+    def add(self, net):
+        try:
+            op = ord(net.op)
+        except (AttributeError, TypeError):
+            raise PyrtlError('error, cannot store "%s" in a CompactBlock' % str(net))
+        if self._find(net) is not None:
+            return
+        slot = len(self._ops)
+        self._ops.append(op)
+        if net.op_param is not None:
+            self._params[slot] = net.op_param
+        self._args.extend(self._number(w) for w in net.args)
+        self._arg_ends.append(len(self._args))
+        if len(net.dests) == 1:
+            number = self._number(net.dests[0])
+            self._dests.append(number)
+            if self._drivers[number] < 0:
+                self._drivers[number] = slot
+            else:
+                self._others[net] = slot
+        else:
+            self._dests.append(-1)
+            self._odd_dests[slot] = net.dests
+            self._others[net] = slot
+        self._size += 1
+        if self._block is not None:
+            self._block._changed()
+
+    def discard(self, net):
+        slot = self._find(net)
+        if slot is None:
+            return
+        if self._others.get(net) == slot:
+            del self._others[net]
+        else:
+            number = self._dests[slot]
+            self._drivers[number] = -1
+            for other, other_slot in self._others.items():
+                if self._dests[other_slot] == number:  # another driver of the same wire
+                    del self._others[other]
+                    self._drivers[number] = other_slot
+                    break
+        self._ops[slot] = 0
+        self._params.pop(slot, None)
+        self._odd_dests.pop(slot, None)
+        self._size -= 1
+        if len(self._ops) > 1024 and self._size < len(self._ops) // 2:
+            self._compact()
+        if self._block is not None:
+            self._block._changed()
+
+    def _compact(self):
+        """ Drop the slots of removed nets, moving the rest down.
+
+        The wires are numbered again too, so that the wires no longer connected to
+        any net give up their numbers (and are no longer kept alive by the set).
+        """
+        ops, arg_ends, args, dests = [array.array(a.typecode) for a in
+                                      (self._ops, self._arg_ends, self._args, self._dests)]
+        params, odd_dests, moved = {}, {}, {}
+        wires, renumbered = [], {}
+
+        def renumber(number):
+            new_number = renumbered.get(number)
+            if new_number is None:
+                new_number = renumbered[number] = len(wires)
+                wires.append(self._wires[number])
+            return new_number
+
+        start = 0
+        for slot, end in enumerate(self._arg_ends):
+            if self._ops[slot]:
+                moved[slot] = len(ops)
+                ops.append(self._ops[slot])
+                args.extend(renumber(w) for w in self._args[start:end])
+                arg_ends.append(len(args))
+                dest = self._dests[slot]
+                dests.append(renumber(dest) if dest >= 0 else dest)
+                if slot in self._params:
+                    params[len(ops) - 1] = self._params[slot]
+                if slot in self._odd_dests:
+                    odd_dests[len(ops) - 1] = self._odd_dests[slot]
+            start = end
+        self._ops, self._arg_ends, self._args, self._dests = ops, arg_ends, args, dests
+        self._params, self._odd_dests = params, odd_dests
+        self._others = {net: moved[slot] for net, slot in self._others.items()}
+        drivers = array.array('i', [-1]) * len(wires)
+        for number, new_number in renumbered.items():
+            if self._drivers[number] >= 0:
+                drivers[new_number] = moved[self._drivers[number]]
+        self._wires, self._drivers = wires, drivers
+        self._wire_numbers = {w: number for number, w in enumerate(wires)}
+
+
+class CompactPostSynthBlock(CompactBlock, PostSynthBlock):
+    """ A PostSynthBlock which stores its logic like a CompactBlock. """
+    pass
+
+
 # -----------------------------------------------------------------------
 #          __   __               __      __        __   __
 #    |  | /  \ |__) |__/ | |\ | / _`    |__) |    /  \ /  ` |__/
@@ -234,6 +234,9 @@ def select(sel, truecase, falsecase):
     """
     sel, f, t = (as_wires(w) for w in (sel, falsecase, truecase))
     f, t = match_bitwidth(f, t)
+    existing = working_block()._existing_result('x', None, (sel, f, t))
+    if existing is not None:
+        return existing
     outwire = WireVector(bitwidth=len(f))
 
     net = LogicNet(op='x', op_param=None, args=(sel, f, t), dests=(outwire,))
@@ -259,6 +262,9 @@ def concat(*args):
 
     arg_wirevectors = tuple(as_wires(arg) for arg in args)
     final_width = sum(len(arg) for arg in arg_wirevectors)
+    existing = working_block()._existing_result('c', None, arg_wirevectors)
+    if existing is not None:
+        return existing
     outwire = WireVector(bitwidth=final_width)
     net = LogicNet(
         op='c',
@@ -38,6 +38,8 @@ class _MemIndexed(WireVector):
     but if you try to *set* the value with <<= or |= then it will generate a
     _MemAssignment object rather than the normal wire assignment. """
 
+    __slots__ = ('mem', 'index')
+
     def __init__(self, mem, index):
         self.mem = mem
         self.index = index
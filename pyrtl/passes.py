@@ -7,13 +7,14 @@ transformation passes over blocks.
 from __future__ import print_function, unicode_literals
 
 from .core import working_block, set_working_block, debug_mode, LogicNet, PostSynthBlock
+from .core import CompactPostSynthBlock
 from .helperfuncs import as_wires
 from .corecircuits import (_basic_mult, _basic_add, _basic_sub, _basic_eq,
                            _basic_lt, _basic_gt, _basic_select, concat_list)
 from .memory import MemBlock
 from .pyrtlexceptions import PyrtlError, PyrtlInternalError
-from .wire import WireVector, Input, Output, Const, Register
-from .transform import net_transform, _get_new_block_mem_instance, copy_block, replace_wires
+from .wire import WireVector, Input, Output, Const
+from .transform import net_transform, _get_new_block_mem_instance, copy_block
 
 
 # --------------------------------------------------------------------
@@ -23,11 +24,16 @@ from .transform import net_transform, _get_new_block_mem_instance, copy_block, r
 #
 
 
-def optimize(update_working_block=True, block=None, skip_sanity_check=False):
+def optimize(update_working_block=True, block=None, skip_sanity_check=False,
+             remove_duplicate_nets=False, remove_unobserved_registers=True):
     """ Return an optimized version of a synthesized hardware block.
 
         :param update_working_block: Don't copy the block and optimize the
         new block
+        :param remove_duplicate_nets: also merge the nets which compute the same
+        value (common subexpression elimination)
+        :param remove_unobserved_registers: remove the registers whose values never
+        reach an Output (the default, as always); if False they are all kept
     """
     block = working_block(block)
     if not update_working_block:
@@ -42,7 +48,12 @@ def optimize(update_working_block=True, block=None, skip_sanity_check=False):
         _constant_propagation(block)
         if debug_mode:
             block.sanity_check()
-        _remove_unlistened_nets(block)
+        if remove_duplicate_nets:
+            removed = _remove_duplicate_nets(block)
+            if debug_mode:
+                print('Removed %d duplicate nets' % removed)
+                block.sanity_check()
+        _remove_unlistened_nets(block, remove_unobserved_registers)
         if (not skip_sanity_check) or debug_mode:
             block.sanity_check()
     return block
@@ -92,8 +103,7 @@ def _remove_wire_nets(block):
     # now update the block with the new logic and remove wirevectors
     block.logic = new_logic
     for dead_wirevector in wire_removal_set:
-        del block.wirevector_by_name[dead_wirevector.name]
-        block.wirevector_set.remove(dead_wirevector)
+        block.remove_wirevector(dead_wirevector)
 
     block.sanity_check()
 
@@ -105,16 +115,11 @@ def _constant_propagation(block, silence_unexpected_net_warnings=False):
     The output of the block can have wirevectors that are driven but not
     listened to. This is to be expected. These are to be removed by the
     _remove_unlistened_nets function
-    """
-
-    current_nets = 0
-    while len(block.logic) != current_nets:
-        current_nets = len(block.logic)
-        _constant_prop_pass(block, silence_unexpected_net_warnings)
-
 
-def _constant_prop_pass(block, silence_unexpected_net_warnings=False):
-    """ Does one constant propagation pass """
+    Each net is checked once, and then again only when one of its args is
+    replaced (through the readers index of the block), so a constant is
+    propagated through the whole block in one go.
+    """
     valid_net_ops = '~&|^nrwcsm@'
     no_optimization_ops = 'wcsm@'
     one_var_ops = {
@@ -128,18 +133,21 @@ def _constant_prop_pass(block, silence_unexpected_net_warnings=False):
         'n': lambda l, r: 1-(l & r),
     }
 
+    readers = block._index()[3]
+    worklist = []
+
     def _constant_prop_error(net, error_str):
         if not silence_unexpected_net_warnings:
             raise PyrtlError("Unexpected net, {}, has {}".format(net, error_str))
 
     def constant_prop_check(net_checking):
         def replace_net(new_net):
-            nets_to_remove.add(net_checking)
-            nets_to_add.add(new_net)
+            block.remove_net(net_checking)
+            block.add_net(new_net)
+            worklist.append(new_net)
 
         def replace_net_with_const(const_val):
             new_const_wire = Const(bitwidth=1, val=const_val, block=block)
-            wire_add_set.add(new_const_wire)
             replace_net_with_wire(new_const_wire)
 
         def replace_net_with_wire(new_wire):
@@ -147,16 +155,12 @@ def _constant_prop_pass(block, silence_unexpected_net_warnings=False):
                 replace_net(LogicNet('w', None, args=(new_wire,),
                                      dests=net_checking.dests))
             else:
-                nets_to_remove.add(net_checking)
-                new_wire_src[net_checking.dests[0]] = new_wire
-
-        if net_checking.op not in valid_net_ops:
-            _constant_prop_error(net_checking, "has a net not handled by constant_propagation")
-            return  # skip if we are ignoring unoptimizable ops
+                block.remove_net(net_checking)
+                _rewire(block, readers, net_checking.dests[0], new_wire, worklist)
 
         num_constants = sum((isinstance(arg, Const) for arg in net_checking.args))
 
-        if num_constants is 0 or net_checking.op in no_optimization_ops:
+        if num_constants == 0 or net_checking.op in no_optimization_ops:
             return  # assuming wire nets are already optimized
 
         if any(len(wire) != 1 for wire in net_checking.args + net_checking.dests):
@@ -164,7 +168,7 @@ def _constant_prop_pass(block, silence_unexpected_net_warnings=False):
                           len(wire) != 1]
             _constant_prop_error(net_checking, "has wire(s) {} with bitwidths that are not 1"
                                  .format(long_wires))
-            return  # skip if we are ignoring unoptimizable ops
+            return  # the net is left alone when the error is silenced
 
         if (net_checking.op in two_var_ops) and num_constants == 1:
             # special case
@@ -191,94 +195,109 @@ def _constant_prop_pass(block, silence_unexpected_net_warnings=False):
                 output = one_var_ops[net_checking.op](net_checking.args[0].val)
             replace_net_with_const(output)
 
-    new_wire_src = _ProducerList()
-    wire_add_set = set()
-    nets_to_add = set()
-    nets_to_remove = set()
-
     for a_net in block.logic:
-        constant_prop_check(a_net)
-    # second full pass to cleanup
-
-    new_logic = set()
-    for net in block.logic.union(nets_to_add) - nets_to_remove:
-        new_args = tuple(new_wire_src.find_producer(x) for x in net.args)
-        new_net = LogicNet(net.op, net.op_param, new_args, net.dests)
-        new_logic.add(new_net)
+        if a_net.op not in valid_net_ops:
+            # skip if we are ignoring unoptimizable ops
+            _constant_prop_error(a_net, "has a net not handled by constant_propagation")
+        else:
+            worklist.append(a_net)
 
-    block.logic = new_logic
-    for new_wirevector in wire_add_set:
-        block.add_wirevector(new_wirevector)
+    while worklist:
+        a_net = worklist.pop()
+        if a_net in block.logic:  # else it was replaced since being added
+            constant_prop_check(a_net)
 
     _remove_unused_wires(block)
 
 
 def _remove_duplicate_nets(block):
-    raise PyrtlInternalError("NOT WORKING!!!!!!")
+    """ Merge the combinational nets which compute the same value, returning how
+    many nets were removed.
+
+    Two nets are the same if they have the same op, op_param and args (in any order
+    for commutative ops), and Consts of the same value and bitwidth count as the
+    same arg.  The readers of a removed net's dest are rewired to the dest of the
+    net that is kept, which can make them duplicates in turn, so they are checked
+    again until nothing changes.
+    """
+    from .core import _net_structural_key, _hashed_ops
     block = working_block(block)
-
-    net_table = {}  # {net (without dest) : [net, ...]
-    duplicate_nets = False
-    t = tuple()
-    for net in block.logic:
-        net_sub = LogicNet(net[0], net[1], net[2], t)  # don't care about dests
-        if len(net.dests) == 1 and net.dests[0].name == 'tmp22157':
-            t = t  # place for a breakpoint
-        if net_sub in net_table:
-            duplicate_nets = True
-            net_table[net_sub].append(net)
+    readers = block._index()[3]
+    visible = set(block.rtl_assert_dict)  # dests which must stay, along with Outputs
+    worklist = []
+
+    consts = {}  # {(val, bitwidth): const}
+    for const in block.wirevector_subset(Const):
+        kept = consts.setdefault((const.val, const.bitwidth), const)
+        if kept is not const:
+            _rewire(block, readers, const, kept, worklist)
+
+    removed = 0
+    table = {}  # {structural key: net}
+    worklist.extend(block.logic)
+    while worklist:
+        net = worklist.pop()
+        if net.op not in _hashed_ops or len(net.dests) != 1 or net not in block.logic:
+            continue
+        key = _net_structural_key(*net[:3])
+        kept = table.get(key)
+        if kept is None or kept not in block.logic:
+            table[key] = net
+            continue
+        if kept == net:
+            continue
+        dest = net.dests[0]
+        block.remove_net(net)
+        if isinstance(dest, Output) or dest in visible:
+            block.add_net(LogicNet('w', None, args=kept.dests, dests=(dest,)))
         else:
-            net_table[net_sub] = [net]
-
-    if not duplicate_nets:
-        return
-
-    wire_map = {}
-    unnecessary_nets = []
-    for nets in net_table.values():
-        if len(nets) > 1:
-            net_to_keep = nets[0]
-            nets_to_discard = nets[1:]
-            dest_w = net_to_keep.dests[0]  # should be safe
-            for net in nets_to_discard:
-                old_dst = net.dests[0]
-                if isinstance(old_dst, (Register, Output)):
-                    continue
-                # assert(old_dst is not dest_w)
-                wire_map[old_dst] = dest_w
-                # block.remove_wirevector(old_dst)
-                unnecessary_nets.append(net)
-
-    block.logic.difference_update(unnecessary_nets)
-    replace_wires(wire_map, block)
+            _rewire(block, readers, dest, kept.dests[0], worklist)
+            removed += 1
+    return removed
 
-    block.sanity_check()
 
+def _rewire(block, readers, old, new, worklist):
+    """ Make the nets reading wire old read wire new instead, and remove old.
 
-def _remove_unlistened_nets(block):
-    """ Removes all nets that are not connected to an output wirevector
+    The rewritten nets are added to worklist.  readers is the {wire: nets reading it}
+    index of the block, which is kept up to date by add_net and remove_net.
     """
+    for net in list(readers.get(old, ())):
+        new_args = tuple(new if a is old else a for a in net.args)
+        new_net = LogicNet(net.op, net.op_param, new_args, net.dests)
+        block.remove_net(net)
+        block.add_net(new_net)
+        worklist.append(new_net)
+    block.remove_wirevector(old)
 
-    listened_nets = set()
-    listened_wires = set()
-    prev_listened_net_count = 0
 
-    def add_to_listened(net):
-        listened_nets.add(net)
-        listened_wires.update(net.args)
+def _remove_unlistened_nets(block, remove_unobserved_registers=False):
+    """ Removes all nets that are not connected to an output wirevector
 
-    for a_net in block.logic:
-        if a_net.op == '@':
-            add_to_listened(a_net)
-        elif any(isinstance(destW, Output) for destW in a_net.dests):
-            add_to_listened(a_net)
+    :param remove_unobserved_registers: if True, registers are only kept if their
+      values reach an Output (or a memory write or rtl_assert) like any other net.
+      Otherwise all of the registers, and the logic feeding them, are kept.
+
+    The nets kept are found by walking back from those nets through the nets
+    driving their args, so each net is visited at most once.
+    """
+    drivers = block._index()[2]
+    observed = set(block.rtl_assert_dict)
 
-    while len(listened_nets) > prev_listened_net_count:
-        prev_listened_net_count = len(listened_nets)
+    to_check = []
+    for a_net in block.logic:
+        if a_net.op == '@' or (a_net.op == 'r' and not remove_unobserved_registers):
+            to_check.append(a_net)
+        elif any(isinstance(destW, Output) or destW in observed for destW in a_net.dests):
+            to_check.append(a_net)
 
-        for net in block.logic - listened_nets:
-            if any((destWire in listened_wires) for destWire in net.dests):
-                add_to_listened(net)
+    listened_nets = set()
+    while to_check:
+        net = to_check.pop()
+        if net not in listened_nets:
+            listened_nets.add(net)
+            for arg in net.args:
+                to_check.extend(drivers.get(arg, ()))
 
     block.logic = listened_nets
     _remove_unused_wires(block)
@@ -304,6 +323,223 @@ def _remove_unused_wires(block, keep_inputs=True):
 
     block.wirevector_set = valid_wires
 
+
+def simplify(update_working_block=True, block=None):
+    """ Return a version of the block with its constants folded and its logic simplified.
+
+    :param update_working_block: Don't copy the block and simplify the
+      new block
+    :param block: the block to simplify (defaults to the working block)
+
+    Unlike optimize, this works on blocks before synthesis, with nets of any width.
+    Nets with only constant args become constants, and nets such as "x + 0",
+    "x * 4", "x & x", "~~x", muxes with a constant select, and selections from
+    concats or from other selections are replaced with simpler ones.  Wire nets
+    are removed (except for those driving Outputs), and so is the logic left
+    unused by these changes.  Registers and memories are left as they are.
+    """
+    block = working_block(block)
+    if not update_working_block:
+        block = copy_block(block)
+
+    with set_working_block(block, no_sanity_check=True):
+        _simplify_nets(block)
+        if debug_mode:
+            block.sanity_check()
+    return block
+
+
+def _simplify_nets(block):
+    """ Simplify the nets of block until none can be simplified further. """
+    index = block._index()
+    drivers, readers = index[2], index[3]
+    visible = set(block.rtl_assert_dict)  # dests which must stay, along with Outputs
+    worklist = list(block.logic)
+    unread = []  # wires which may have lost their last reader
+
+    def driver(wire):
+        nets = drivers.get(wire)
+        return next(iter(nets)) if nets and len(nets) == 1 else None
+
+    while worklist or unread:
+        while worklist:
+            net = worklist.pop()
+            if net not in block.logic:
+                continue
+            dest = net.dests[0] if net.dests else None
+            if net.op == 'w' and not isinstance(dest, Output) and dest not in visible:
+                block.remove_net(net)
+                _rewire(block, readers, dest, net.args[0], worklist)
+                continue
+            new_net = _simpler_net(net, driver, block)
+            if new_net is not None:
+                block.remove_net(net)
+                block.add_net(new_net)
+                worklist.append(new_net)
+                # the readers may be simpler now that they read the new net
+                worklist.extend(readers.get(dest, ()))
+                unread.extend(net.args)
+
+        while unread:
+            wire = unread.pop()
+            if readers.get(wire) or wire not in block.wirevector_set:
+                continue
+            if isinstance(wire, Const):
+                block.remove_wirevector(wire)
+                continue
+            net = driver(wire)
+            if net is None or net.op not in '~&|^n+-*<>=xcsw' or \
+                    isinstance(wire, Output) or wire in visible:
+                continue
+            block.remove_net(net)
+            block.remove_wirevector(wire)
+            unread.extend(net.args)
+
+
+def _simpler_net(net, driver, block):
+    """ Return a simpler net driving the same dest as net, or None if there is none.
+
+    driver maps a wire to the net driving it (or None).
+    """
+    op, args = net.op, net.args
+    if op not in '~&|^n+-*<>=xcs':
+        return None
+    width = net.dests[0].bitwidth
+    mask = (1 << width) - 1
+
+    def const(val, bitwidth=width):
+        return Const(val & ((1 << bitwidth) - 1), bitwidth=bitwidth, block=block)
+
+    def new(new_op, new_args, op_param=None):
+        return LogicNet(new_op, op_param, tuple(new_args), net.dests)
+
+    def value(val):
+        return new('w', (const(val),))
+
+    def extended(wire):
+        if len(wire) == width:
+            return new('w', (wire,))
+        return new('c', (const(0, width - len(wire)), wire))
+
+    if all(isinstance(a, Const) for a in args):
+        return value(_evaluate_net(net))
+
+    if op == '~':
+        inner = driver(args[0])
+        if inner is not None and inner.op == '~':
+            return new('w', inner.args)
+
+    elif op in '&|^n':
+        a, b = args
+        if a is b:
+            if op in '&|':
+                return extended(a)
+            return value(0) if op == '^' else new('~', (a,))
+        if isinstance(a, Const):
+            a, b = b, a
+        if isinstance(b, Const) and b.val in (0, mask):
+            ones = b.val == mask
+            if op == '&':
+                return extended(a) if ones else value(0)
+            elif op == '|':
+                return value(mask) if ones else extended(a)
+            elif op == '^':
+                return new('~', (a,)) if ones else extended(a)
+            else:
+                return new('~', (a,)) if ones else value(mask)
+
+    elif op in '+-':
+        a, b = args
+        if op == '-' and a is b:
+            return value(0)
+        if op == '+' and isinstance(a, Const) and a.val == 0:
+            return extended(b)
+        if isinstance(b, Const) and b.val == 0:
+            return extended(a)
+
+    elif op == '*':
+        a, b = args
+        if isinstance(a, Const):
+            a, b = b, a
+        if isinstance(b, Const) and b.val & (b.val - 1) == 0:  # zero or a power of two
+            if b.val == 0:
+                return value(0)
+            shift = b.val.bit_length() - 1
+            if shift == 0:
+                return extended(a)
+            top = width - len(a) - shift
+            return new('c', ((const(0, top),) if top else ()) + (a, const(0, shift)))
+
+    elif op in '<>=':
+        a, b = args
+        if a is b:
+            return value(int(op == '='))
+        if op == '<' and isinstance(b, Const) and b.val == 0:
+            return value(0)
+        if op == '>' and isinstance(a, Const) and a.val == 0:
+            return value(0)
+        if op == '=' and len(a) == 1:
+            if isinstance(a, Const):
+                a, b = b, a
+            if isinstance(b, Const):
+                return new('w', (a,)) if b.val else new('~', (a,))
+
+    elif op == 'x':
+        sel, f, t = args
+        if isinstance(sel, Const):
+            return new('w', (t if sel.val else f,))
+        if f is t:
+            return new('w', (f,))
+
+    elif op == 'c':
+        if len(args) == 1:
+            return new('w', args)
+        merged = []
+        for a in args:
+            if merged and isinstance(a, Const) and isinstance(merged[-1], Const):
+                previous = merged.pop()
+                a = const((previous.val << len(a)) | a.val, len(previous) + len(a))
+            merged.append(a)
+        if len(merged) < len(args):
+            return new('c', merged)
+
+    elif op == 's':
+        a, = args
+        bits = net.op_param
+        if bits == tuple(range(len(a))):
+            return new('w', (a,))
+        inner = driver(a)
+        if inner is None:
+            return None
+        if inner.op == 's':
+            return new('s', inner.args, tuple(inner.op_param[b] for b in bits))
+        if inner.op == 'c':
+            sources = []  # the (arg, bit) for each bit of the concat, lsb first
+            for arg in reversed(inner.args):
+                sources.extend((arg, i) for i in range(len(arg)))
+            picked = [sources[b] for b in bits]
+            if all(arg is picked[0][0] for arg, i in picked):
+                return new('s', (picked[0][0],), tuple(i for arg, i in picked))
+            if all(isinstance(arg, Const) for arg, i in picked):
+                return value(sum(((arg.val >> i) & 1) << n for n, (arg, i) in enumerate(picked)))
+    return None
+
+
+def _evaluate_net(net):
+    """ The value of the dest of a net which has only Consts as args. """
+    from .simulation import Simulation
+    vals = [a.val for a in net.args]
+    if net.op == 'c':
+        result = 0
+        for a in net.args:
+            result = (result << len(a)) | a.val
+    elif net.op == 's':
+        result = sum(((vals[0] >> b) & 1) << n for n, b in enumerate(net.op_param))
+    else:
+        result = Simulation.simple_func[net.op](*vals)
+    return result & ((1 << net.dests[0].bitwidth) - 1)
+
+
 # --------------------------------------------------------------------
 #    __           ___       ___  __     __
 #   /__` \ / |\ |  |  |__| |__  /__` | /__`
@@ -311,11 +547,13 @@ def _remove_unused_wires(block, keep_inputs=True):
 #
 
 
-def synthesize(update_working_block=True, block=None):
+def synthesize(update_working_block=True, block=None, compact=False):
     """ Lower the design to just single-bit "and", "or", and "not" gates.
 
     :param update_working_block: Boolean specifying if working block update
     :param block: The block you want to synthesize
+    :param compact: if True, the result is a CompactPostSynthBlock, which stores
+      its (many) nets in far less memory
     :return: The newly synthesized block (of type PostSynthesisBlock).
 
     Takes as input a block (default to working block) and creates a new
@@ -342,9 +580,10 @@ def synthesize(update_working_block=True, block=None):
     block_pre.sanity_check()  # before going further, make sure that pressynth is valid
     block_in = copy_block(block_pre, update_working_block=False)
 
-    block_out = PostSynthBlock()
+    block_out = CompactPostSynthBlock() if compact else PostSynthBlock()
     # resulting block should only have one of a restricted set of net ops
     block_out.legal_ops = set('~&|^nrwcsm@')
+    block_out.structural_hashing = block_pre.structural_hashing
     wirevector_map = {}  # map from (vector,index) -> new_wire
 
     with set_working_block(block_out, no_sanity_check=True):
@@ -3,9 +3,28 @@
 from __future__ import print_function, unicode_literals
 
 import sys
+import os
+import io
 import re
 import numbers
 import collections
+import itertools
+import hashlib
+import marshal
+import heapq
+import array
+import pickle
+import multiprocessing
+import struct
+import mmap
+import binascii
+import tempfile
+import ctypes
+import shlex
+import shutil
+import subprocess
+
+import six
 
 from .pyrtlexceptions import PyrtlError, PyrtlInternalError
 from .core import working_block, PostSynthBlock
@@ -13,6 +32,41 @@ from .wire import Input, Register, Const, Output, WireVector
 from .memory import RomBlock, _MemReadBase
 from .helperfuncs import check_rtl_assertions, _currently_in_ipython, PythonSanitizer
 
+# ----------------------------------------------------------------
+#         __        ___     __        __  ___  __
+#  \  / /\  |    |  | |__     /__` |    /  \  |  /__`
+#   \/ /~~\ |___ \__/ |___    .__/ |___ \__/  |  .__/
+#
+
+try:
+    _NARROW_TYPECODE = 'Q'
+    array.array(_NARROW_TYPECODE)
+except ValueError:  # no unsigned long long arrays before python 3.3
+    _NARROW_TYPECODE = 'L'
+_NARROW_BITS = 8 * array.array(_NARROW_TYPECODE).itemsize
+
+
+def _wire_slots(wires):
+    """ Assign each wire a dense index into one of two flat value stores.
+
+    :param wires: the wirevectors to assign slots to
+    :return: ({wire: (store, index)}, (narrow store, wide store))
+
+    Wires which fit in a machine word get a slot in an unsigned integer array, while
+    wider wires fall back to a slot in a list of python ints.  Store 0 is the array
+    and store 1 the list.  Slots are assigned in name order, so the same block always
+    gets the same assignment.
+    """
+    counts = [0, 0]
+    slots = {}
+    for w in sorted(wires, key=lambda w: w.name):
+        store = 0 if w.bitwidth <= _NARROW_BITS else 1
+        slots[w] = (store, counts[store])
+        counts[store] += 1
+    stores = (array.array(_NARROW_TYPECODE, [0]) * counts[0], [0] * counts[1])
+    return slots, stores
+
+
 # ----------------------------------------------------------------
 #    __                         ___    __
 #   /__` |  |\/| |  | |     /\   |  | /  \ |\ |
@@ -41,7 +95,7 @@ class Simulation(object):
 
     def __init__(
             self, tracer=None, register_value_map=None, memory_value_map=None,
-            default_value=0, block=None):
+            default_value=0, block=None, event_driven=False):
         """ Creates a new circuit simulator
 
         :param tracer: an instance of SimulationTrace used to store execution results.
@@ -51,6 +105,9 @@ class Simulation(object):
          default to. If no default_value is specified, it will use the value stored in the
          object (default to 0)
         :param block: the hardware block to be traced (which might be of type PostSynthesisBlock).
+        :param event_driven: if True, each step only re-evaluates the nets whose arguments
+         changed since the previous cycle (see activity_stats). This is much faster for
+         designs where most of the logic is idle in any given cycle.
         """
 
         """ Creates object and initializes it with self._initialize.
@@ -65,6 +122,10 @@ class Simulation(object):
         self.block = block
         self.default_value = default_value
         self.tracer = tracer
+        self.event_driven = event_driven
+        self.cycle = 0  # the number of steps taken so far
+        self._loaded_regs = None  # register values from load_state for the next step
+        self._inputs_by_name = {w.name: w for w in block.wirevector_subset(Input)}
         self._initialize(register_value_map, memory_value_map)
 
     def _initialize(self, register_value_map=None, memory_value_map=None, default_value=None):
@@ -129,57 +190,166 @@ class Simulation(object):
             if w not in self.value:
                 self.value[w] = default_value
 
+        # from here on the values live in flat stores, with each wire at a fixed slot
+        self._wire_index, self._stores = _wire_slots(self.value)
+        for w, (store, i) in self._wire_index.items():
+            self._stores[store][i] = self.value[w] & w.bitmask
+        self.value = _WireValues(self._wire_index, self._stores)
+
         self.ordered_nets = tuple((i for i in self.block))
         self.edge_update_nets = tuple((self.block.logic_subset('r@')))
+        self._net_funcs = tuple(self._lower_net(net) for net in self.ordered_nets)
+        self._comb_funcs = tuple(f for f in self._net_funcs if f is not None)
+        self._reg_updates = tuple(
+            self._slot(net.args[0]) + (self._wire_index[net.dests[0]], net.dests[0].bitmask)
+            for net in self.edge_update_nets if net.op == 'r')
+        self._mem_writes = tuple(
+            (net.op_param[0],) + sum((self._slot(arg) for arg in net.args), ())
+            for net in self.edge_update_nets if net.op == '@')
+        if self.event_driven:
+            self._initialize_events()
+
+    def _initialize_events(self):
+        """ Build the fanout tables used by the event-driven step.
+
+        Nets are identified by their position in self.ordered_nets so that a heap of
+        positions always evaluates a net after everything it depends on.
+        """
+        position = {net: i for i, net in enumerate(self.ordered_nets)}
+        src_map, dst_map = self.block._net_connections()
+        self._fanout = {}
+        for w, nets in dst_map.items():
+            readers = sorted(position[n] for n in nets if n.op not in 'r@')
+            if readers:
+                self._fanout[self._wire_index[w]] = tuple(readers)
+        self._net_dests = tuple(self._wire_index[net.dests[0]] if net.dests else None
+                                for net in self.ordered_nets)
+        self._mem_readers = {}
+        for net in self.ordered_nets:
+            if net.op == 'm':
+                self._mem_readers.setdefault(net.op_param[0], []).append(position[net])
+        self._mems_written = set()
+        self._evaluate_all = True  # nothing has been computed yet
+        self._activity_cycles = 0
+        self._activity_evaluations = 0
+
+    def activity_stats(self):
+        """ Report how much work the event-driven mode has done so far.
+
+        :return: a dict with the number of 'cycles' simulated, the number of net
+          'evaluations' performed, the number of 'nets' in the design, and the
+          'activity' factor (evaluations / (cycles * nets))
+
+        Only available when the simulation was created with event_driven=True.
+        """
+        if not self.event_driven:
+            raise PyrtlError('activity_stats requires a Simulation with event_driven=True')
+        possible = self._activity_cycles * len(self.ordered_nets)
+        return {
+            'cycles': self._activity_cycles,
+            'evaluations': self._activity_evaluations,
+            'nets': len(self.ordered_nets),
+            'activity': float(self._activity_evaluations) / possible if possible else 0.0}
+
+    def _execute_events(self, changed):
+        """ Evaluate only the nets downstream of the wire slots in changed. """
+        net_funcs, net_dests = self._net_funcs, self._net_dests
+        stores = self._stores
+        fanout = self._fanout
+        if self._evaluate_all:
+            self._evaluate_all = False
+            pending = [i for i, f in enumerate(net_funcs) if f is not None]
+            queued = set(pending)
+        else:
+            # a net reading several of the changed wires is still queued only once
+            queued = set()
+            for w in changed:
+                queued.update(fanout.get(w, ()))
+            for memid in self._mems_written:
+                queued.update(self._mem_readers.get(memid, ()))
+            pending = list(queued)
+            heapq.heapify(pending)
+        self._mems_written.clear()
+
+        evaluations = 0
+        while pending:
+            position = heapq.heappop(pending)
+            dest = net_dests[position]
+            store, i = stores[dest[0]], dest[1]
+            old = store[i]
+            net_funcs[position]()
+            evaluations += 1
+            if store[i] != old:
+                for reader in fanout.get(dest, ()):
+                    if reader not in queued:
+                        queued.add(reader)
+                        heapq.heappush(pending, reader)
+        self._activity_cycles += 1
+        self._activity_evaluations += evaluations
 
     def step(self, provided_inputs):
         """ Take the simulation forward one cycle
 
         :param provided_inputs: a dictionary mapping wirevectors to their values for this step
         """
+        self._step_inputs(_check_step_inputs(self._inputs_by_name, provided_inputs))
 
-        # To avoid weird loops, we need a copy of the old values which
-        # we can then use to make our updates from
-        prior_value = self.value.copy()
-
-        # Check that all Input have a corresponding provided_input
-        input_set = self.block.wirevector_subset(Input)
-        supplied_inputs = set()
-        for i in provided_inputs:
-            if isinstance(i, WireVector):
-                name = i.name
-            else:
-                name = i
-            sim_wire = self.block.wirevector_by_name[name]
-            if sim_wire not in input_set:
-                raise PyrtlError(
-                    'step provided a value for input for "%s" which is '
-                    'not a known input ' % name)
-            if not isinstance(provided_inputs[i], numbers.Integral) or provided_inputs[i] < 0:
-                raise PyrtlError(
-                    'step provided an input "%s" which is not a valid '
-                    'positive integer' % provided_inputs[i])
-            if len(bin(provided_inputs[i]))-2 > sim_wire.bitwidth:
-                raise PyrtlError(
-                    'the bitwidth for "%s" is %d, but the provided input '
-                    '%d requires %d bits to represent'
-                    % (name, sim_wire.bitwidth,
-                       provided_inputs[i], len(bin(provided_inputs[i]))-2))
-
-            self.value[sim_wire] = provided_inputs[i]
-            supplied_inputs.add(sim_wire)
+    def run(self, stimulus, outputs=None, nsteps=None):
+        """ Simulate a whole stimulus, recording the values of the outputs in every cycle.
 
-        # Check that only inputs are specified, and set the values
-        if input_set != supplied_inputs:
-            for i in input_set.difference(supplied_inputs):
-                raise PyrtlError('Input "%s" has no input value specified' % i.name)
+        :param stimulus: either a map from each input (wirevector or name) to the
+          sequence of its values (such as a list, array.array, or NumPy array), or an
+          iterable (such as a generator) of maps from input to value, one per cycle
+        :param outputs: the wirevectors (or names) to record, by default every Output
+        :param nsteps: the number of cycles to run (defaults to the whole stimulus)
+        :return: a map from the name of each recorded wire to the sequence of its values
 
-        # Do all of the clock-edge triggered operations based off of the priors
-        for net in self.edge_update_nets:
-            self._edge_update(net, prior_value)
-
-        for net in self.ordered_nets:
-            self._execute(net)
+        The input wires are resolved only once, and sequences of values are checked
+        all at once (NumPy arrays with vectorized operations), so this avoids most of
+        the per-cycle overhead of calling step in a loop.
+        """
+        return _run_stimulus(self, stimulus, outputs, nsteps)
+
+    def _step_inputs(self, new_inputs):
+        """ Take the simulation forward one cycle with the checked {Input: value} map. """
+        # Do all of the clock-edge triggered operations based off of the values
+        # from the last cycle.  Only the new register values need to be buffered
+        # (so that registers reading other registers see the old value); nothing
+        # else is overwritten until the combinational logic is re-evaluated.
+        reg_values = [store[i] & mask for store, i, dest, mask in self._reg_updates]
+        if self._loaded_regs is None:
+            for memid, addr_store, addr, data_store, data, enable_store, enable \
+                    in self._mem_writes:
+                if enable_store[enable]:
+                    self.memvalue[memid][addr_store[addr]] = data_store[data]
+                    if self.event_driven:
+                        self._mems_written.add(memid)
+        else:
+            # the state from load_state already includes the last cycle's updates
+            reg_values = [self._loaded_regs.get(dest, value) for (src_store, src, dest, mask),
+                          value in zip(self._reg_updates, reg_values)]
+            self._loaded_regs = None
+
+        stores = self._stores
+        changed = []
+        for (src_store, src, dest, mask), value in zip(self._reg_updates, reg_values):
+            store = stores[dest[0]]
+            if store[dest[1]] != value:
+                store[dest[1]] = value
+                changed.append(dest)
+        for wire, value in new_inputs.items():
+            dest = self._wire_index[wire]
+            store = stores[dest[0]]
+            if store[dest[1]] != value:
+                store[dest[1]] = value
+                changed.append(dest)
+
+        if self.event_driven:
+            self._execute_events(changed)
+        else:
+            for func in self._comb_funcs:
+                func()
+        self.cycle += 1
 
         # at the end of the step, record the values to the trace
         # print self.value # Helpful Debug Print
@@ -190,6 +360,26 @@ class Simulation(object):
         # raise the appropriate exceptions
         check_rtl_assertions(self)
 
+    def step_multiple(self, provided_inputs, nsteps=None):
+        """ Take the simulation forward many cycles
+
+        :param provided_inputs: a dictionary mapping each input (wirevector or name)
+          to a list of its values, one per cycle
+        :param nsteps: the number of cycles to run (defaults to the length of the
+          lists in provided_inputs, which must then all be the same)
+
+        If an rtl_assert fails, that cycle is traced and counted and then its exception
+        is raised, without running the cycles after it (just as with step).
+        """
+        if nsteps is None:
+            lengths = set(len(values) for values in provided_inputs.values())
+            if len(lengths) > 1:
+                raise PyrtlError('step_multiple requires the same number of values for '
+                                 'every input when nsteps is not given')
+            nsteps = lengths.pop() if lengths else 0
+        for cycle in range(nsteps):
+            self.step({i: values[cycle] for i, values in provided_inputs.items()})
+
     def inspect(self, w):
         """ Get the value of a wirevector in the current simulation cycle.
 
@@ -198,7 +388,8 @@ class Simulation(object):
 
         Will throw KeyError if w does not exist in the simulation.
         """
-        return self.value[w]
+        store, i = self._wire_index[w]
+        return self._stores[store][i]
 
     def inspect_mem(self, mem):
         """ Get the values in a map during the current simulation cycle.
@@ -211,74 +402,673 @@ class Simulation(object):
         """
         return self.memvalue[mem.id]
 
-    @staticmethod
-    def _sanitize(val, wirevector):
-        """Return a modified version of val that would fit in wirevector.
+    def save_state(self, path):
+        """ Save the registers, memories and cycle count of the simulation to a file.
 
-        This function should be applied to every primitive call, and it's
-        default behavior is to mask the upper bits of value and return that
-        new value.
-        """
-        return val & wirevector.bitmask
+        :param path: the file to write the checkpoint to
 
-    def _execute(self, net):
-        """Handle the combinational logic update rules for the given net.
-
-        This function, along with edge_update, defined the semantics
-        of the primitive ops.  Function updates self.value accordingly.
+        The saved registers hold the values they take on in the next cycle, and the
+        memories include the writes of the last cycle, so a simulation of the same
+        design restored with load_state (in Simulation or FastSimulation) continues
+        exactly where this one left off.
+        """
+        regs = {}
+        for net in self.edge_update_nets:
+            if net.op == 'r':
+                reg = net.dests[0]
+                key = self._wire_index[reg]
+                if self._loaded_regs is not None and key in self._loaded_regs:
+                    regs[reg.name] = self._loaded_regs[key]
+                else:
+                    regs[reg.name] = self.inspect(net.args[0]) & reg.bitmask
+
+        mems = {}
+        pending = self._pending_mem_writes()
+        for mem in _state_memories(self.block):
+            contents = self.memvalue[mem.id]
+            if mem in pending:
+                contents = dict(contents)
+                contents.update(pending[mem])
+            mems[mem] = contents
+        _write_state(path, self.cycle, regs, mems)
+
+    def _pending_mem_writes(self):
+        """ Return {memory: {address: value}} of the writes of the last cycle.
+
+        These only reach memvalue at the start of the next step (and there are none
+        right after load_state, whose memories already include them).
+        """
+        pending = {}
+        if self._loaded_regs is None:
+            for net in self.edge_update_nets:
+                if net.op == '@' and self.inspect(net.args[2]):
+                    pending.setdefault(net.op_param[1], {})[
+                        self.inspect(net.args[0])] = self.inspect(net.args[1])
+        return pending
+
+    def load_state(self, path):
+        """ Restore the registers, memories and cycle count from a save_state file.
+
+        :param path: the checkpoint file to read
+
+        Registers and memories are matched by name; those of this design that are not
+        in the checkpoint keep their current state, including any update made in the
+        last cycle.  The restored state takes effect with the next call to step.
+
+        The checkpoint is memory mapped and its memories are decoded only as they are
+        used: those this design does not have are skipped without being read, but the
+        ones it does have are decoded in full, since the simulation keeps every memory
+        as a dict (so a large memory costs as much to load as it does to simulate).
+        """
+        cycle, regs, mems = _read_state(path)
+        loaded = {}
+        for w in self.block.wirevector_subset(Register):
+            if w.name in regs:
+                loaded[self._wire_index[w]] = _check_state_value(w, regs[w.name])
+        pending = self._pending_mem_writes()
+        for mem in _state_memories(self.block):
+            contents = self.memvalue[mem.id]
+            if mem.name in mems:
+                contents.clear()
+                contents.update(_check_state_memory(mem, mems[mem.name]).items())
+            else:
+                # the next step skips the writes of the last cycle, so make them now
+                contents.update(pending.get(mem, {}))
+        self._loaded_regs = loaded
+        self.cycle = cycle
+        if self.event_driven:
+            self._evaluate_all = True
+
+    def _slot(self, w):
+        """ Return the (store, index) holding the value of wirevector w. """
+        store, i = self._wire_index[w]
+        return self._stores[store], i
+
+    def _lower_net(self, net):
+        """Turn the given net into a function which updates the value list.
+
+        This function, along with the edge updates in step, defines the
+        semantics of the primitive ops.  Each net is lowered once, when the
+        simulation is initialized, into a closure over the wire indices of its
+        arguments and destination so that evaluating it does no op dispatch and
+        no dictionary lookups.  Registers and memory write ports have no logic
+        function, and None is returned for them.
         """
         if net.op in 'r@':
-            return  # registers and memory write ports have no logic function
+            return None
+
+        slot = self._slot
+        dest_store, dest = slot(net.dests[0])
+        mask = net.dests[0].bitmask
+
+        if net.op == 'w':
+            a_store, a = slot(net.args[0])
+
+            def execute():
+                dest_store[dest] = a_store[a] & mask
+        elif net.op == '~':
+            a_store, a = slot(net.args[0])
+
+            def execute():
+                dest_store[dest] = ~a_store[a] & mask
+        elif net.op == 'x':
+            sel_store, sel = slot(net.args[0])
+            f_store, f = slot(net.args[1])
+            t_store, t = slot(net.args[2])
+
+            def execute():
+                dest_store[dest] = (t_store[t] if sel_store[sel] else f_store[f]) & mask
         elif net.op in self.simple_func:
-            argvals = (self.value[arg] for arg in net.args)
-            result = self.simple_func[net.op](*argvals)
+            func = self.simple_func[net.op]
+            a_store, a = slot(net.args[0])
+            b_store, b = slot(net.args[1])
+
+            def execute():
+                dest_store[dest] = func(a_store[a], b_store[b]) & mask
         elif net.op == 'c':
-            result = 0
-            for arg in net.args:
-                result = result << len(arg)
-                result = result | self.value[arg]
+            shifts = []
+            shift = 0
+            for arg in reversed(net.args):
+                shifts.append(slot(arg) + (shift,))
+                shift += len(arg)
+            shifts = tuple(shifts)
+
+            def execute():
+                result = 0
+                for a_store, a, shift in shifts:
+                    result |= a_store[a] << shift
+                dest_store[dest] = result & mask
         elif net.op == 's':
-            result = 0
-            source = self.value[net.args[0]]
-            for b in net.op_param[::-1]:
-                result = (result << 1) | (0x1 & (source >> b))
+            a_store, a = slot(net.args[0])
+            bits = tuple(net.op_param)
+            low = bits[0]
+            if bits == tuple(range(low, low + len(bits))):
+                # a contiguous slice is a shift and a mask
+                def execute():
+                    dest_store[dest] = (a_store[a] >> low) & mask
+            else:
+                def execute():
+                    result = 0
+                    source = a_store[a]
+                    for b in bits[::-1]:
+                        result = (result << 1) | (0x1 & (source >> b))
+                    dest_store[dest] = result & mask
         elif net.op == 'm':
             # memories act async for reads
             memid = net.op_param[0]
-            read_addr = self.value[net.args[0]]
-            result = self.memvalue[memid].get(read_addr, self.default_value)
+            a_store, a = slot(net.args[0])
+            memvalue = self.memvalue
+            default_value = self.default_value
+
+            def execute():
+                dest_store[dest] = memvalue[memid].get(a_store[a], default_value) & mask
         else:
             raise PyrtlInternalError('error, unknown op type')
 
-        self.value[net.dests[0]] = self._sanitize(result, net.dests[0])
+        return execute
+
+    def _print_values(self):
+        print(' '.join([str(v) for _, v in sorted(self.value.items())]))
+
+
+def _check_step_inputs(inputs_by_name, provided_inputs):
+    """ Check the values given to a single step.
+
+    :param inputs_by_name: {name: Input} for every input of the block
+    :param provided_inputs: {input (wirevector or name): value}
+    :return: {Input: value}
+    """
+    new_inputs = {}
+    for i, value in provided_inputs.items():
+        name = i.name if isinstance(i, WireVector) else i
+        sim_wire = inputs_by_name.get(name)
+        if sim_wire is None:
+            raise PyrtlError(
+                'step provided a value for input for "%s" which is '
+                'not a known input ' % name)
+        if not isinstance(value, numbers.Integral) or value < 0:
+            raise PyrtlError(
+                'step provided an input "%s" which is not a valid '
+                'positive integer' % value)
+        if value > sim_wire.bitmask:
+            raise PyrtlError(
+                'the bitwidth for "%s" is %d, but the provided input '
+                '%d requires %d bits to represent'
+                % (name, sim_wire.bitwidth, value, len(bin(value))-2))
+        new_inputs[sim_wire] = value
+
+    # Check that only inputs are specified
+    if len(new_inputs) != len(inputs_by_name):
+        for i in set(inputs_by_name.values()).difference(new_inputs):
+            raise PyrtlError('Input "%s" has no input value specified' % i.name)
+    return new_inputs
+
+
+def _check_stimulus_column(wire, values):
+    """ Check every value given for one input to run, returning them as a list. """
+    if hasattr(values, 'dtype'):  # a NumPy array, which can be checked all at once
+        if values.dtype.kind not in 'biu':
+            raise PyrtlError('run provided values of type %s for input "%s", which are '
+                             'not integers' % (values.dtype, wire.name))
+        bad = len(values) and (values.min() < 0 or values.max() > wire.bitmask)
+        values = values.tolist()
+    else:
+        values = list(values)
+        for t in set(map(type, values)):
+            if not issubclass(t, numbers.Integral):
+                raise PyrtlError('run provided a value of type %s for input "%s", which '
+                                 'is not an integer' % (t.__name__, wire.name))
+        bad = values and (min(values) < 0 or max(values) > wire.bitmask)
+    if bad:
+        raise PyrtlError('run provided a value for input "%s" which cannot be '
+                         'represented using its bitwidth of %d' % (wire.name, wire.bitwidth))
+    return values
+
+
+def _stimulus_steps(inputs_by_name, stimulus, nsteps):
+    """ Yield the checked {Input: value} map for each cycle of a stimulus given to run. """
+    if not isinstance(stimulus, collections.Mapping):
+        for provided_inputs in itertools.islice(stimulus, nsteps):
+            yield _check_step_inputs(inputs_by_name, provided_inputs)
+        return
+
+    columns, nsteps = _stimulus_columns(inputs_by_name, stimulus, nsteps)
+    if not columns:
+        for cycle in range(nsteps):
+            yield {}
+        return
+    wires = list(columns)
+    for values in six.moves.zip(*[columns[w][:nsteps] for w in wires]):
+        yield dict(six.moves.zip(wires, values))
+
+
+def _stimulus_columns(inputs_by_name, stimulus, nsteps):
+    """ Check a map from each input to its values given to run.
+
+    :return: ({Input: list of values}, the number of cycles to run)
+    """
+    wires, columns = [], []
+    for i, values in stimulus.items():
+        name = i.name if isinstance(i, WireVector) else i
+        if name not in inputs_by_name:
+            raise PyrtlError('run provided values for "%s" which is not a known input' % name)
+        wires.append(inputs_by_name[name])
+        columns.append(_check_stimulus_column(inputs_by_name[name], values))
+    for name in sorted(set(inputs_by_name).difference(w.name for w in wires)):
+        raise PyrtlError('Input "%s" has no input value specified' % name)
+
+    lengths = set(len(values) for values in columns)
+    if nsteps is None:
+        if len(lengths) > 1:
+            raise PyrtlError('run requires the same number of values for every input '
+                             'when nsteps is not given')
+        nsteps = lengths.pop() if lengths else 0
+    elif lengths and min(lengths) < nsteps:
+        raise PyrtlError('run needs at least %d values for every input' % nsteps)
+    return dict(six.moves.zip(wires, columns)), nsteps
+
+
+def _run_stimulus(sim, stimulus, outputs, nsteps):
+    """ The implementation of run for all of the simulators (see Simulation.run). """
+    if outputs is None:
+        wires = sorted(sim.block.wirevector_subset(Output), key=lambda w: w.name)
+    else:
+        wires = [sim.block.get_wirevector_by_name(w.name if isinstance(w, WireVector) else w,
+                                                  strict=True) for w in outputs]
+    recorded = [(w, _TraceColumn(w.bitwidth)) for w in wires]
+    if isinstance(stimulus, collections.Mapping) and hasattr(sim, '_run_columns'):
+        # the simulators which run many cycles in one call get the whole columns
+        columns, nsteps = _stimulus_columns(sim._inputs_by_name, stimulus, nsteps)
+        if nsteps:
+            value_lists = sim._run_columns({w.name: values for w, values in columns.items()},
+                                           nsteps, [w.name for w in wires])
+            for w, column in recorded:
+                column.extend(value_lists[w.name])
+        return {w.name: column for w, column in recorded}
+    for new_inputs in _stimulus_steps(sim._inputs_by_name, stimulus, nsteps):
+        sim._step_inputs(new_inputs)
+        for w, column in recorded:
+            column.append(sim.inspect(w))
+    return {w.name: column for w, column in recorded}
+
+
+def _multiple_inputs(block, provided_inputs, nsteps):
+    """ Check the inputs given to step_multiple.
+
+    :return: ({input name: list of values}, the number of cycles to run)
+    """
+    input_set = block.wirevector_subset(Input)
+    ins = {}
+    for i, values in provided_inputs.items():
+        name = i.name if isinstance(i, WireVector) else i
+        wire = block.get_wirevector_by_name(name)
+        if wire not in input_set:
+            raise PyrtlError(
+                'step_multiple provided a value for input for "%s" which is '
+                'not a known input ' % name)
+        if any(value > wire.bitmask or value < 0 for value in values):
+            raise PyrtlError("Wire {} has a value which cannot be represented"
+                             " using its bitwidth".format(wire))
+        ins[name] = values
+    for i in input_set:
+        if i.name not in ins:
+            raise PyrtlError('Input "%s" has no input value specified' % i.name)
+
+    lengths = set(len(values) for values in ins.values())
+    if nsteps is None:
+        if len(lengths) > 1:
+            raise PyrtlError('step_multiple requires the same number of values for '
+                             'every input when nsteps is not given')
+        nsteps = lengths.pop() if lengths else 0
+    elif lengths and min(lengths) < nsteps:
+        raise PyrtlError('step_multiple needs at least %d values for every input' % nsteps)
+    return ins, nsteps
+
+
+class _WireValues(collections.Mapping):
+    """ {key: value} view of the value stores of a simulation (see _wire_slots). """
+
+    def __init__(self, wire_index, stores):
+        self._wire_index = wire_index
+        self._stores = stores
+
+    def __getitem__(self, w):
+        store, i = self._wire_index[w]
+        return self._stores[store][i]
+
+    def __setitem__(self, w, value):
+        store, i = self._wire_index[w]
+        self._stores[store][i] = value
+
+    def __iter__(self):
+        return iter(self._wire_index)
+
+    def __len__(self):
+        return len(self._wire_index)
+
+    def copy(self):
+        """ Return a {key: value} dict of the current values, like dict.copy(). """
+        return dict(self.items())
+
 
-    def _edge_update(self, net, prior_value):
-        """Handle the posedge event for the simulation of the given net.
+class ParallelSimulation(object):
+    """A class for simulating many independent copies of a block at once.
 
-        Combinational logic should have no posedge behavior, but registers and
-        memory should.  This function, along with _execute, defined the
-        semantics of the primitive ops.  Function updates self.value and
-        self.memvalue accordingly (using prior_value)
+    Each copy (called a "lane") has its own inputs, registers, and memories, but
+    all of the lanes are evaluated together in a single pass over the block.
+    Values are stored "bit-sliced": every wire is held as a list of python
+    integers, one per bit of the wire, where bit k of each integer is the value
+    of that bit in lane k.  A single integer operation thus evaluates a gate for
+    every lane at once, which is particularly effective on synthesized blocks
+    (which are almost entirely single bit gates) but works for every op.
+    """
+
+    def __init__(
+            self, lanes, tracers=None, register_value_map=None, memory_value_map=None,
+            default_value=0, block=None):
+        """ Creates a new multi-lane circuit simulator
+
+        :param lanes: the number of independent copies of the block to simulate.
+        :param tracers: None, or a list of one SimulationTrace per lane.
+        :param register_value_map: is a map of {Register: value} applied to every lane.
+        :param memory_value_map: is a map of maps {Memory: {address: Value}} applied
+         to every lane.
+        :param default_value: is the value that all unspecified registers and memories will
+         default to.
+        :param block: the hardware block to be traced (which might be of type PostSynthesisBlock).
         """
-        if net.op in 'w~&|^n+-*<>=xcsm':
-            return  # stateless elements and memory-read
-        else:
-            if net.op == 'r':
-                # copy result from input to output of register
-                argval = prior_value[net.args[0]]
-                self.value[net.dests[0]] = self._sanitize(argval, net.dests[0])
-            elif net.op == '@':
-                memid = net.op_param[0]
-                write_addr = prior_value[net.args[0]]
-                write_val = prior_value[net.args[1]]
-                write_enable = prior_value[net.args[2]]
-                if write_enable:
-                    self.memvalue[memid][write_addr] = write_val
+        block = working_block(block)
+        block.sanity_check()  # check that this is a good hw block
+
+        if lanes < 1:
+            raise PyrtlError('error, ParallelSimulation requires at least one lane')
+        if tracers is not None and len(tracers) != lanes:
+            raise PyrtlError('error, expected one tracer per lane but got %d tracers for '
+                             '%d lanes' % (len(tracers), lanes))
+
+        self.lanes = lanes
+        self.lane_mask = (1 << lanes) - 1
+        self.value = {}  # map from signal->list of bit-sliced planes
+        self.memvalue = {}  # map from memid->[{address: value} for each lane]
+        self.block = block
+        self.default_value = default_value
+        self.tracers = tracers
+        self._initialize(register_value_map, memory_value_map)
+
+    def _initialize(self, register_value_map=None, memory_value_map=None):
+        default_value = self.default_value
+
+        for w in self.block.wirevector_set:
+            if isinstance(w, Const):
+                self.value[w] = self._pack_all(w.val, w.bitwidth)
+            elif isinstance(w, Register) and register_value_map is not None \
+                    and w in register_value_map:
+                self.value[w] = self._pack_all(register_value_map[w], w.bitwidth)
             else:
-                raise PyrtlInternalError
+                self.value[w] = self._pack_all(default_value, w.bitwidth)
 
-    def _print_values(self):
-        print(' '.join([str(v) for _, v in sorted(self.value.items())]))
+        if memory_value_map is None:
+            memory_value_map = {}
+        if isinstance(self.block, PostSynthBlock):
+            memory_value_map = {self.block.mem_map[mem]: mem_map  # pylint: disable=no-member
+                                for mem, mem_map in memory_value_map.items()}
+        initial_mems = {mem.id: mem_map for mem, mem_map in memory_value_map.items()}
+
+        for mem_net in self.block.logic_subset('m@'):
+            mem = mem_net.op_param[1]
+            if mem.id in self.memvalue:
+                continue
+            if isinstance(mem, RomBlock):
+                # ROMs are never written, so every lane can share the same contents,
+                # which are filled in as the lanes read them (see _execute)
+                self.memvalue[mem.id] = [{}] * self.lanes
+            else:
+                initial = initial_mems.get(mem.id, {})
+                self.memvalue[mem.id] = [dict(initial) for _ in range(self.lanes)]
+
+        self.ordered_nets = tuple(self.block)
+        self.edge_update_nets = tuple(self.block.logic_subset('r@'))
+        self.input_set = self.block.wirevector_subset(Input)
+
+    def _pack_all(self, val, bitwidth):
+        """ Return the planes for a value that is identical in every lane. """
+        return [self.lane_mask if (val >> i) & 1 else 0 for i in range(bitwidth)]
+
+    def _pack(self, lane_vals, bitwidth):
+        """ Return the planes encoding a sequence of per-lane values. """
+        planes = [0] * bitwidth
+        for lane, val in enumerate(lane_vals):
+            bit, lane_bit = 0, 1 << lane
+            while val:
+                if val & 1:
+                    planes[bit] |= lane_bit
+                val >>= 1
+                bit += 1
+        return planes
+
+    def _unpack(self, planes):
+        """ Return the list of per-lane values encoded in planes. """
+        return [sum(((p >> lane) & 1) << bit for bit, p in enumerate(planes))
+                for lane in range(self.lanes)]
+
+    def step(self, provided_inputs):
+        """ Take the simulation of every lane forward one cycle
+
+        :param provided_inputs: either a list of dictionaries (one per lane) mapping
+          inputs to their values for this step, or a single dictionary mapping each
+          input to a sequence of values (one per lane)
+        """
+        if isinstance(provided_inputs, dict):
+            columns = provided_inputs
+        else:
+            if len(provided_inputs) != self.lanes:
+                raise PyrtlError('step expected inputs for %d lanes but got %d'
+                                 % (self.lanes, len(provided_inputs)))
+            columns = {}
+            for lane_inputs in provided_inputs:
+                for i, val in lane_inputs.items():
+                    columns.setdefault(i, []).append(val)
+
+        # Check the inputs and convert them to planes before touching any state
+        new_inputs = {}
+        for i, lane_vals in columns.items():
+            name = i.name if isinstance(i, WireVector) else i
+            sim_wire = self.block.wirevector_by_name.get(name)
+            if sim_wire not in self.input_set:
+                raise PyrtlError(
+                    'step provided a value for input for "%s" which is '
+                    'not a known input ' % name)
+            if len(lane_vals) != self.lanes:
+                raise PyrtlError('step provided %d values for input "%s" but there are %d lanes'
+                                 % (len(lane_vals), name, self.lanes))
+            for val in lane_vals:
+                if not isinstance(val, numbers.Integral) or val < 0:
+                    raise PyrtlError(
+                        'step provided an input "%s" which is not a valid '
+                        'positive integer' % val)
+                if val > sim_wire.bitmask:
+                    raise PyrtlError(
+                        'the bitwidth for "%s" is %d, but the provided input '
+                        '%d requires %d bits to represent'
+                        % (name, sim_wire.bitwidth, val, len(bin(val))-2))
+            new_inputs[sim_wire] = self._pack(lane_vals, sim_wire.bitwidth)
+
+        if len(new_inputs) != len(self.input_set):
+            for i in self.input_set.difference(new_inputs):
+                raise PyrtlError('Input "%s" has no input value specified' % i.name)
+
+        # Do all of the clock-edge triggered operations based off of the priors
+        reg_updates = [self._edge_update(net) for net in self.edge_update_nets]
+        for net, planes in reg_updates:
+            if net is not None:
+                self.value[net.dests[0]] = planes
+        self.value.update(new_inputs)
+
+        for net in self.ordered_nets:
+            self._execute(net)
+
+        if self.tracers is not None:
+            for lane, tracer in enumerate(self.tracers):
+                tracer.add_step(_LaneValues(self, lane))
+
+        self._check_rtl_assertions()
+
+    def inspect(self, w):
+        """ Get the value of a wirevector in the current simulation cycle.
+
+        :param w: the wirevector to inspect
+        :return: list with the value of w in each lane
+
+        Will throw KeyError if w does not exist in the simulation.
+        """
+        return self._unpack(self.value[w])
+
+    def inspect_mem(self, mem):
+        """ Get the values in a memory during the current simulation cycle.
+
+        :param mem: the memory to inspect
+        :return: list with one {address: value} dictionary per lane
+
+        The entries of a ROM are read from it as the lanes first address them, so
+        only those appear here.
+        """
+        return self.memvalue[mem.id]
+
+    def _check_rtl_assertions(self):
+        for (w, exp) in self.block.rtl_assert_dict.items():
+            if w in self.value and self.value[w][0] != self.lane_mask:
+                raise exp
+
+    def _execute(self, net):
+        """Handle the combinational logic update rules for the given net."""
+        op = net.op
+        if op in 'r@':
+            return  # registers and memory write ports have no logic function
+
+        lm = self.lane_mask
+        args = [self.value[arg] for arg in net.args]
+        if op == 'w':
+            result = args[0]
+        elif op == '~':
+            result = [p ^ lm for p in args[0]]
+        elif op == '&':
+            result = [l & r for l, r in zip(*args)]
+        elif op == '|':
+            result = [l | r for l, r in zip(*args)]
+        elif op == '^':
+            result = [l ^ r for l, r in zip(*args)]
+        elif op == 'n':
+            result = [(l & r) ^ lm for l, r in zip(*args)]
+        elif op == '+':
+            result = self._add(args[0], args[1], 0)
+        elif op == '-':
+            # two's complement: a - b == a + ~b + 1, computed one bit wider
+            result = self._add(args[0] + [0], [p ^ lm for p in args[1]] + [lm], lm)
+        elif op == '*':
+            result = self._mul(*args)
+        elif op == '=':
+            diff = 0
+            for l, r in zip(*args):
+                diff |= l ^ r
+            result = [diff ^ lm]
+        elif op == '<':
+            result = [self._less_than(args[0], args[1])]
+        elif op == '>':
+            result = [self._less_than(args[1], args[0])]
+        elif op == 'x':
+            sel = args[0][0]
+            result = [f ^ ((f ^ t) & sel) for f, t in zip(args[1], args[2])]
+        elif op == 'c':
+            result = []
+            for planes in reversed(args):
+                result.extend(planes)
+        elif op == 's':
+            result = [args[0][b] for b in net.op_param]
+        elif op == 'm':
+            # memories act async for reads, and each lane reads its own address
+            lane_mems = self.memvalue[net.op_param[0]]
+            read_addrs = self._unpack(args[0])
+            rom = net.op_param[1]
+            if isinstance(rom, RomBlock):
+                contents = lane_mems[0]
+                for addr in read_addrs:
+                    if addr not in contents:
+                        contents[addr] = rom._get_read_data(addr)
+            result = self._pack(
+                [mem.get(addr, self.default_value) for mem, addr in zip(lane_mems, read_addrs)],
+                len(net.dests[0]))
+        else:
+            raise PyrtlInternalError('error, unknown op type')
+
+        self.value[net.dests[0]] = result[:len(net.dests[0])]
+
+    def _edge_update(self, net):
+        """Handle the posedge event for the given net.
+
+        Memory writes are performed immediately, while the new value for a
+        register is returned as a (net, planes) tuple so that it can be applied
+        after every register has read its prior input.
+        """
+        if net.op == 'r':
+            return net, self.value[net.args[0]][:len(net.dests[0])]
+        elif net.op == '@':
+            addr_planes, data_planes, we_planes = (self.value[arg] for arg in net.args)
+            enabled = we_planes[0]
+            if enabled:
+                lane_mems = self.memvalue[net.op_param[0]]
+                addrs, data = self._unpack(addr_planes), self._unpack(data_planes)
+                for lane in range(self.lanes):
+                    if (enabled >> lane) & 1:
+                        lane_mems[lane][addrs[lane]] = data[lane]
+            return None, None
+        else:
+            raise PyrtlInternalError
+
+    @staticmethod
+    def _add(a, b, carry):
+        """ Ripple-carry add two lists of planes, returning len(a)+1 planes. """
+        result = []
+        for x, y in zip(a, b):
+            t = x ^ y
+            result.append(t ^ carry)
+            carry = (x & y) | (carry & t)
+        result.append(carry)
+        return result
+
+    def _mul(self, a, b):
+        """ Shift-and-add multiply two lists of planes, returning 2*len(a) planes. """
+        n = len(a)
+        result = [0] * (n + len(b))
+        for i, bit in enumerate(b):
+            partial = [x & bit for x in a]
+            result[i:i + n + 1] = self._add(result[i:i + n], partial, 0)
+        return result
+
+    def _less_than(self, a, b):
+        """ Return the single plane for unsigned a < b. """
+        lt, eq = 0, self.lane_mask
+        for x, y in zip(reversed(a), reversed(b)):
+            lt |= eq & ~x & y
+            eq &= ~(x ^ y)
+        return lt
+
+
+class _LaneValues(collections.Mapping):
+    """ Read-only {wirevector: value} view of a single lane of a ParallelSimulation. """
+
+    def __init__(self, sim, lane):
+        self._sim = sim
+        self._lane = lane
+
+    def __getitem__(self, w):
+        planes = self._sim.value[w]
+        return sum(((p >> self._lane) & 1) << bit for bit, p in enumerate(planes))
+
+    def __iter__(self):
+        return iter(self._sim.value)
+
+    def __len__(self):
+        return len(self._sim.value)
 
 
 # ----------------------------------------------------------------
@@ -309,9 +1099,10 @@ class FastSimulation(object):
         self.default_value = default_value
         self.tracer = tracer
         self.sim_func = None
+        self._multi_funcs = {}  # {names of the wires traced: sim_multi function}
         self.code_file = code_file
         self.mems = {}
-        self.regs = {}
+        self.cycle = 0  # the number of steps taken so far
         self.internal_names = PythonSanitizer('_fastsim_tmp_')
         self._initialize(register_value_map, memory_value_map)
 
@@ -321,28 +1112,61 @@ class FastSimulation(object):
         if register_value_map is None:
             register_value_map = {}
 
-        for wire in self.block.wirevector_set:
+        # sorted so that the internal names (and thus the generated code) are reproducible
+        for wire in sorted(self.block.wirevector_set, key=lambda w: w.name):
             self.internal_names.make_valid_string(wire.name)
 
-        # set registers to their values
-        reg_set = self.block.wirevector_subset(Register)
-        for r in reg_set:
-            if r in register_value_map:
-                self.regs[self._varname(r)] = register_value_map[r]
-            else:
-                self.regs[self._varname(r)] = default_value
+        # only the wires that can be inspected get a slot in the value stores
+        visible = self.block.wirevector_subset((Input, Register, Output))
+        if self.tracer is not None:
+            visible.update(self.block.wirevector_by_name[name] for name in self.tracer.trace)
+        self._wire_index, self._stores = _wire_slots(visible)
+        self._name_slots = {w.name: slot for w, slot in self._wire_index.items()}
+        for w, (store, i) in self._wire_index.items():
+            if isinstance(w, Const):
+                self._stores[store][i] = w.val
+        self._inputs_by_name = {w.name: w for w in self.block.wirevector_subset(Input)}
+
+        # set registers to their values; the generated code returns the values of the
+        # registers for the next cycle in this (name) order
+        regs = sorted(self.block.wirevector_subset(Register), key=lambda w: w.name)
+        self._regs = tuple(regs)
+        self._reg_slots = tuple(self._wire_index[r] for r in regs)
+        self._next_regs = tuple(register_value_map.get(r, default_value) & r.bitmask
+                                for r in regs)
 
         self._initialize_mems(memory_value_map)
+        self.sim_func = self._load_function('sim_func', self.compiled)
 
-        s = self.compiled()
-        if self.code_file is not None:
-            with open(self.code_file, 'w') as file:
-                file.write(s)
+    def _load_function(self, func_name, generate, traced=None):
+        """ Return the generated function func_name, from the code cache if possible.
+
+        :param func_name: the name of the function defined by the generated code
+        :param generate: function returning the python source defining func_name
+        :param traced: the names of the wires the code traces, if not those of the tracer
+        """
+        cache = _fastsim_code_cache() if self.code_file is None else None
+        code = None
+        if cache is not None:
+            # the code also depends on the layout of the value stores, which is set by
+            # the wires of the tracer even when it traces others
+            layout = sorted(self._name_slots.items())
+            key = _block_fingerprint(self.block, func_name, traced, layout,
+                                     self.default_value)
+            code = cache.get_code(key)
+
+        if code is None:
+            s = generate()
+            if self.code_file is not None and func_name == 'sim_func':
+                with open(self.code_file, 'w') as file:
+                    file.write(s)
+            code = compile(s, '<string>', 'exec')
+            if cache is not None:
+                cache.put_code(key, code)
 
         context = {}
-        logic_creator = compile(s, '<string>', 'exec')
-        exec(logic_creator, context)
-        self.sim_func = context['sim_func']
+        exec(code, context)
+        return context[func_name]
 
     def _initialize_mems(self, memory_value_map):
         if memory_value_map is not None:
@@ -363,27 +1187,95 @@ class FastSimulation(object):
             if value > wire.bitmask or value < 0:
                 raise PyrtlError("Wire {} has value {} which cannot be represented"
                                  " using its bitwidth".format(wire, value))
+        if len(provided_inputs) != len(self._inputs_by_name):
+            for i in self.block.wirevector_subset(Input).difference(provided_inputs):
+                raise PyrtlError('Input "%s" has no input value specified' % i.name)
+
+        self._step_inputs(provided_inputs)
 
-        # building the simulation data
-        ins = {self._to_name(wire): value for wire, value in provided_inputs.items()}
-        ins.update(self.regs)
-        ins.update(self.mems)
+    def run(self, stimulus, outputs=None, nsteps=None):
+        """ Simulate a whole stimulus, recording the values of the outputs in every cycle.
+
+        See Simulation.run.
+        """
+        return _run_stimulus(self, stimulus, outputs, nsteps)
+
+    def _step_inputs(self, provided_inputs):
+        """ Take the simulation forward one cycle with the checked {Input: value} map. """
+        # the registers take on the values computed in the last cycle
+        stores = self._stores
+        for (store, i), value in zip(self._reg_slots, self._next_regs):
+            stores[store][i] = value
+        for wire, value in provided_inputs.items():
+            store, i = self._name_slots[wire.name]
+            stores[store][i] = value
 
         # propagate through logic
-        self.regs, self.outs, mem_writes = self.sim_func(ins)
+        self._next_regs, mem_writes, asserts_hold = self.sim_func(
+            stores[0], stores[1], self.mems)
 
         for mem, addr, value in mem_writes:
             self.mems[mem][addr] = value
+        self.cycle += 1
 
         # for tracer compatibility
-        self.context = self.outs.copy()
-        self.context.update(self.regs)
-        self.context.update(ins)
+        self.context = _WireValues(self._name_slots, stores)
         if self.tracer is not None:
             self.tracer.add_fast_step(self)
 
-        # check the rtl assertions
-        check_rtl_assertions(self)
+        # the generated code checks all of the rtl assertions at once; only when one
+        # of them fails do we need to look for the exception to raise
+        if not asserts_hold:
+            check_rtl_assertions(self)
+
+    def step_multiple(self, provided_inputs, nsteps=None):
+        """ Take the simulation forward many cycles in a single call
+
+        :param provided_inputs: a dictionary mapping each input (wirevector or name)
+          to a list of its values, one per cycle
+        :param nsteps: the number of cycles to run (defaults to the length of the
+          lists in provided_inputs, which must then all be the same)
+
+        All of the cycles are run inside of one generated python function, which
+        avoids the per-cycle overhead of step.  The results are the same as
+        calling step once for each cycle: if an rtl_assert fails, that cycle is
+        traced and counted and then its exception is raised, without running the
+        cycles after it.
+        """
+        ins, nsteps = _multiple_inputs(self.block, provided_inputs, nsteps)
+        if nsteps:
+            self._run_columns(ins, nsteps, ())
+
+    def _run_columns(self, ins, nsteps, names):
+        """ Run nsteps cycles in one call, with the {input name: values} in ins.
+
+        :return: {name: [value for each cycle run]} for (at least) each of names
+        """
+        traced = set(names)
+        if self.tracer is not None:
+            traced.update(self.tracer.trace)
+        traced = tuple(sorted(traced))
+        sim_multi = self._multi_funcs.get(traced)
+        if sim_multi is None:
+            sim_multi = self._multi_funcs[traced] = self._load_function(
+                'sim_multi', lambda: self.compiled_multiple(traced), traced)
+
+        traces = {name: [0] * nsteps for name in traced}
+        stores = self._stores
+        cycles_run, self._next_regs, asserts_hold = sim_multi(
+            stores[0], stores[1], self.mems, self._next_regs, ins, nsteps, traces)
+        self.cycle += cycles_run
+        if cycles_run < nsteps:
+            traces = {name: values[:cycles_run] for name, values in traces.items()}
+
+        self.context = _WireValues(self._name_slots, stores)
+        if self.tracer is not None:
+            self.tracer.add_fast_steps(traces)
+
+        # the generated code stops after the first cycle with a failing assertion
+        if not asserts_hold:
+            check_rtl_assertions(self)
+        return traces
 
     def inspect(self, w):
         """ Get the value of a wirevector in the current simulation cycle.
@@ -394,10 +1286,11 @@ class FastSimulation(object):
         Will throw KeyError if w does not exist in the simulation.
         """
         try:
-            return self.context[self._to_name(w)]
+            context = self.context
         except AttributeError:
             raise PyrtlError("No context available. Please run a simulation step in "
                              "order to populate values for wires")
+        return context[w.name if isinstance(w, WireVector) else w]
         # except KeyError:
         #     raise PyrtlError("Wire {} is not in the simulation trace. Please probe it"
         #                      "and measure the probe value to measure this wire's value"
@@ -416,11 +1309,36 @@ class FastSimulation(object):
             raise PyrtlError("ROM blocks are not stored in the simulation object")
         return self.mems[self._mem_varname(mem)]
 
-    def _to_name(self, name):
-        """ Converts Wires to strings, changes strings to internal string names """
-        if isinstance(name, WireVector):
-            name = name.name
-        return self.internal_names[name]
+    def save_state(self, path):
+        """ Save the registers, memories and cycle count of the simulation to a file.
+
+        :param path: the file to write the checkpoint to
+
+        See Simulation.save_state; the checkpoints of the two simulators are
+        interchangeable.
+        """
+        regs = {r.name: value for r, value in zip(self._regs, self._next_regs)}
+        mems = {mem: self.mems[self._mem_varname(mem)]
+                for mem in _state_memories(self.block)}
+        _write_state(path, self.cycle, regs, mems)
+
+    def load_state(self, path):
+        """ Restore the registers, memories and cycle count from a save_state file.
+
+        :param path: the checkpoint file to read
+
+        See Simulation.load_state.
+        """
+        cycle, regs, mems = _read_state(path)
+        self._next_regs = tuple(
+            _check_state_value(r, regs[r.name]) if r.name in regs else value
+            for r, value in zip(self._regs, self._next_regs))
+        for mem in _state_memories(self.block):
+            if mem.name in mems:
+                contents = self.mems[self._mem_varname(mem)]
+                contents.clear()
+                contents.update(_check_state_memory(mem, mems[mem.name]).items())
+        self.cycle = cycle
 
     def _varname(self, val):
         """ Converts WireVectors to internal names """
@@ -429,12 +1347,24 @@ class FastSimulation(object):
     def _mem_varname(self, val):
         return 'fs_mem' + str(val.id)
 
+    def _next_varname(self, reg):
+        """ Variable holding the value a register takes on the next cycle """
+        return '_fs_next_' + self._varname(reg)
+
+    def _input_varname(self, wire):
+        """ Variable holding the list of per-cycle values for an Input """
+        return '_fs_in_' + self._varname(wire)
+
+    def _slot_varname(self, wire):
+        """ Expression for the slot holding the value of wire in the value stores """
+        return '_fs_v%d[%d]' % self._wire_index[wire]
+
     def _arg_varname(self, wire):
         """
         Input, Const, and Registers have special input values
         """
         if isinstance(wire, (Input, Register)):
-            return 'd["' + wire.name + '"]'  # passed in
+            return self._slot_varname(wire)  # passed in
         elif isinstance(wire, Const):
             return str(wire.val)  # hardcoded
         else:
@@ -442,9 +1372,9 @@ class FastSimulation(object):
 
     def _dest_varname(self, wire):
         if isinstance(wire, Output):
-            return 'outs["' + wire.name + '"]'
+            return self._slot_varname(wire)
         elif isinstance(wire, Register):
-            return 'regs["' + wire.name + '"]'
+            return self._next_varname(wire)
         else:
             return self._varname(wire)
 
@@ -457,7 +1387,7 @@ class FastSimulation(object):
         '^': lambda net: len(net.args[0]),
         'n': lambda net: -1,  # bitflips always need masking
         '+': lambda net: len(net.args[0]) + 1,
-        '-': lambda net: len(net.args[0]) + 1,
+        '-': lambda net: -1,  # negative differences always need masking
         '*': lambda net: len(net.args[0]) + len(net.args[1]),
         '<': lambda net: 1,
         '>': lambda net: 1,
@@ -470,15 +1400,126 @@ class FastSimulation(object):
 
     # Yeah, triple quotes don't respect indentation (aka the 4 spaces on the
     # start of each line is part of the string)
-    _prog_start = """def sim_func(d):
-    regs = {}
-    outs = {}
+    _prog_start = """def sim_func(_fs_v0, _fs_v1, mems):
     mem_ws = []"""
 
     def compiled(self):
         """Return a string of the self.block compiled to python. """
         prog = [self._prog_start]
 
+        def mem_write(net, write_enable, write_addr, write_val):
+            mem = self._mem_varname(net.op_param[1])
+            return ['if {}:'.format(write_enable),
+                    '    mem_ws.append(("{}", {}, {}))'.format(mem, write_addr, write_val)]
+
+        for line in self._compiled_nets(
+                self._arg_varname, self._dest_varname,
+                lambda mem: 'mems["%s"]' % self._mem_varname(mem), mem_write):
+            prog.append('    ' + line)
+
+        # store the traced wires
+        if self.tracer is not None:
+            for wire_name in sorted(self.tracer.trace):
+                wire = self.block.wirevector_by_name[wire_name]
+                if not isinstance(wire, (Input, Const, Register, Output)):
+                    prog.append('    %s = %s' % (self._slot_varname(wire),
+                                                 self._varname(wire)))
+
+        # all of the assertions are combined into the single value that is returned
+        asserts = sorted((w for w in self.block.rtl_assert_dict if w in self._wire_index),
+                         key=lambda w: w.name)
+        asserts_hold = ' & '.join(self._slot_varname(w) for w in asserts) or '1'
+        regs = sorted(self.block.wirevector_subset(Register), key=lambda w: w.name)
+        prog.append('    return (%s), mem_ws, %s' % (
+            ''.join(self._next_varname(r) + ', ' for r in regs), asserts_hold))
+        return '\n'.join(prog)
+
+    def compiled_multiple(self, traced=None):
+        """Return a string of the self.block compiled to a python loop over many cycles.
+
+        The resulting function "sim_multi(_fs_v0, _fs_v1, mems, regs, ins, nsteps,
+        traces)" keeps all register state in local variables for the duration of the
+        call, reads the inputs for each cycle from the lists in ins, and writes the
+        value of every traced wire straight into the preallocated lists in traces.
+        It stops after the first cycle in which an rtl_assert fails, which is run in
+        full like any other.  It returns the number of cycles run, the register values
+        for the next cycle, and whether all of the assertions held, and leaves the
+        values of the wires in the last cycle in the value stores.  The wires traced
+        are those named in traced, by default those of the tracer.
+        """
+        inputs = sorted(self.block.wirevector_subset(Input), key=lambda w: w.name)
+        regs = sorted(self.block.wirevector_subset(Register), key=lambda w: w.name)
+        mems = {net.op_param[1] for net in self.block.logic_subset('m@')}
+        if traced is None:
+            traced = [] if self.tracer is None else sorted(self.tracer.trace)
+
+        def arg_varname(wire):
+            if isinstance(wire, Const):
+                return str(wire.val)  # hardcoded
+            return self._varname(wire)
+
+        def dest_varname(wire):
+            if isinstance(wire, Register):
+                return self._next_varname(wire)
+            return self._varname(wire)
+
+        mem_writes = []
+
+        def mem_write(net, write_enable, write_addr, write_val):
+            # writes are delayed until the end of the cycle so reads see the old value
+            mem = self._mem_varname(net.op_param[1])
+            mem_writes.extend(['if {}:'.format(write_enable),
+                               '    {}[{}] = {}'.format(mem, write_addr, write_val)])
+            return []
+
+        prog = ['def sim_multi(_fs_v0, _fs_v1, mems, regs, ins, nsteps, traces):']
+        if regs:
+            prog.append('    %s= regs' % ''.join(self._next_varname(r) + ', ' for r in regs))
+        for mem in sorted(mems, key=lambda m: m.id):
+            prog.append('    {0} = mems["{0}"]'.format(self._mem_varname(mem)))
+        for wire in inputs:
+            prog.append('    %s = ins["%s"]' % (self._input_varname(wire), wire.name))
+        for i, name in enumerate(traced):
+            prog.append('    _fs_trace%d = traces["%s"]' % (i, name))
+        prog.append('    _fs_asserts_hold = True')
+        prog.append('    for _fs_cycle in range(nsteps):')
+        for reg in regs:
+            prog.append('        %s = %s' % (self._varname(reg), self._next_varname(reg)))
+        for wire in inputs:
+            prog.append('        %s = %s[_fs_cycle]' % (self._varname(wire),
+                                                        self._input_varname(wire)))
+        for line in self._compiled_nets(arg_varname, dest_varname, self._mem_varname, mem_write):
+            prog.append('        ' + line)
+        for line in mem_writes:
+            prog.append('        ' + line)
+        for i, name in enumerate(traced):
+            wire = self.block.wirevector_by_name[name]
+            prog.append('        _fs_trace%d[_fs_cycle] = %s' % (i, arg_varname(wire)))
+
+        asserts = sorted(self.block.rtl_assert_dict, key=lambda w: w.name)
+        if asserts:
+            prog.append('        if not (%s):' % ' & '.join(self._varname(w) for w in asserts))
+            prog.append('            _fs_asserts_hold = False')
+            prog.append('            break')
+
+        for wire in sorted(self._wire_index, key=lambda w: w.name):
+            if not isinstance(wire, Const):
+                prog.append('    %s = %s' % (self._slot_varname(wire), arg_varname(wire)))
+        prog.append('    return _fs_cycle + 1, (%s), _fs_asserts_hold' % ''.join(
+            self._next_varname(r) + ', ' for r in regs))
+        return '\n'.join(prog)
+
+    def _compiled_nets(self, arg_varname, dest_varname, mem_varname, mem_write):
+        """Return a list of lines of python (without indentation) for each net in self.block.
+
+        :param arg_varname: function from a WireVector to the expression for its value
+        :param dest_varname: function from a WireVector to the variable that it is assigned to
+        :param mem_varname: function from a memory to the expression holding its contents
+        :param mem_write: function (net, write_enable, write_addr, write_val) -> lines
+          generating the code for a memory write port
+        """
+        prog = []
+
         simple_func = {  # OPS
             'w': lambda x: x,
             'r': lambda x: x,
@@ -513,17 +1554,17 @@ class FastSimulation(object):
 
         for net in self.block:
             if net.op in simple_func:
-                argvals = (self._arg_varname(arg) for arg in net.args)
+                argvals = (arg_varname(arg) for arg in net.args)
                 expr = simple_func[net.op](*argvals)
             elif net.op == 'c':
                 expr = ''
                 for i in range(len(net.args)):
-                    if expr is not '':
+                    if expr != '':
                         expr += ' | '
                     shiftby = sum(len(j) for j in net.args[i+1:])
-                    expr += shift(self._arg_varname(net.args[i]), '<<', shiftby)
+                    expr += shift(arg_varname(net.args[i]), '<<', shiftby)
             elif net.op == 's':
-                source = self._arg_varname(net.args[0])
+                source = arg_varname(net.args[0])
                 expr = ''
                 split_length = 0
                 split_start_bit = -2
@@ -541,43 +1582,1227 @@ class FastSimulation(object):
                         split_length += 1
                 expr += make_split()
             elif net.op == 'm':
-                read_addr = self._arg_varname(net.args[0])
+                read_addr = arg_varname(net.args[0])
                 mem = net.op_param[1]
                 if isinstance(net.op_param[1], RomBlock):
-                    expr = 'd["%s"]._get_read_data(%s)' % (self._mem_varname(mem), read_addr)
+                    expr = '%s._get_read_data(%s)' % (mem_varname(mem), read_addr)
                 else:  # memories act async for reads
-                    expr = 'd["%s"].get(%s, %s)' % (self._mem_varname(mem),
-                                                    read_addr, self.default_value)
+                    expr = '%s.get(%s, %s)' % (mem_varname(mem), read_addr, self.default_value)
             elif net.op == '@':
-                mem = self._mem_varname(net.op_param[1])
-                write_addr = self._arg_varname(net.args[0])
-                write_val = self._arg_varname(net.args[1])
-                write_enable = self._arg_varname(net.args[2])
-                prog.append('    if {}:'.format(write_enable))
-                prog.append('        mem_ws.append(("{}", {}, {}))'
-                            .format(mem, write_addr, write_val))
+                write_addr = arg_varname(net.args[0])
+                write_val = arg_varname(net.args[1])
+                write_enable = arg_varname(net.args[2])
+                prog.extend(mem_write(net, write_enable, write_addr, write_val))
                 continue  # memwrites are special
             else:
                 raise PyrtlError('FastSimulation cannot handle primitive "%s"' % net.op)
 
-            # prog.append('    #  ' + str(net))
-            result = self._dest_varname(net.dests[0])
+            # prog.append('#  ' + str(net))
+            result = dest_varname(net.dests[0])
             if len(net.dests[0]) == self._expected_bitwidth[net.op](net):
-                prog.append("    %s = %s" % (result, expr))
+                prog.append("%s = %s" % (result, expr))
             else:
                 mask = str(net.dests[0].bitmask)
-                prog.append('    %s = %s & %s' % (result, mask, expr))
+                prog.append('%s = %s & %s' % (result, mask, expr))
+
+        return prog
+
+
+# ----------------------------------------------------------------
+#     __   __         __          ___  __      __
+#    /  ` /  \  |\/| |__) | |    |__  |  \    /__` |  |\/|
+#    \__, \__/  |  | |    | |___ |___ |__/    .__/ |  |  |
+#
+
+_WORD_MASK = (1 << 64) - 1
+
+
+def _words(bitwidth):
+    """ The number of uint64_t words holding a value of the given bitwidth. """
+    return (bitwidth + 63) // 64
+
+
+class CompiledSimulation(object):
+    """A class for running blocks compiled to C.
+
+    The block is translated into a C function that runs any number of cycles,
+    which is built into a shared library with the system C compiler (the
+    command in $CC, or "cc") and called through ctypes.  Wires of up to 64 bits
+    are held in a uint64_t and wider wires in arrays of them.  The interface is
+    the same as FastSimulation, including which wires can be inspected (the
+    inputs, registers, outputs, and traced wires).  If the FastSimulation code
+    cache is enabled (see set_fastsim_code_cache), built libraries are kept in
+    it, so a design is only compiled once.
+    """
+
+    # memories are stored densely, which is only sensible up to a certain size
+    _max_mem_addrwidth = 24
+
+    def __init__(
+            self, register_value_map=None, memory_value_map=None,
+            default_value=0, tracer=None, block=None, code_file=None):
+        """
+        :param code_file: The file in which to store a copy of the generated
+        C code
+        """
+
+        block = working_block(block)
+        block.sanity_check()  # check that this is a good hw block
+
+        self.block = block
+        self.default_value = default_value
+        self.tracer = tracer
+        self.code_file = code_file
+        self.cycle = 0  # the number of steps taken so far
+        self._initialize(register_value_map, memory_value_map)
+
+    def _initialize(self, register_value_map=None, memory_value_map=None):
+        if register_value_map is None:
+            register_value_map = {}
+        if memory_value_map is None:
+            memory_value_map = {}
+
+        # every wire is known to the generated code by its index in name order
+        self._wire_ids = {w: i for i, w in enumerate(
+            sorted(self.block.wirevector_set, key=lambda w: w.name))}
+
+        # The state buffer holds word 0 (set when an rtl_assert fails), the wires that
+        # can be inspected, the register values for the next cycle, and the memories.
+        # All other wires are local variables of the generated code.
+        traced = self.tracer.trace if self.tracer is not None else ()
+        visible = self.block.wirevector_subset((Input, Register, Output))
+        visible.update(self.block.rtl_assert_dict)
+        visible.update(self.block.wirevector_by_name[name] for name in traced)
+        size = 1
+        self._offsets = {}
+        for w in sorted(visible, key=lambda w: w.name):
+            self._offsets[w] = size
+            size += _words(w.bitwidth)
+        self._names = {w.name: w for w in self._offsets}
+        # when asked to, the generated code copies every wire that can be inspected to
+        # a trace buffer in each cycle, which serves both the tracer and run
+        self._traced = sorted(set(traced).union(
+            name for name, w in self._names.items() if not isinstance(w, Const)))
+        self._regs = sorted(self.block.wirevector_subset(Register), key=lambda w: w.name)
+        self._next_offsets = {}
+        for r in self._regs:
+            self._next_offsets[r] = size
+            size += _words(r.bitwidth)
+
+        # each memory also has a byte per entry in the valid buffer, marking the entries
+        # that have been written (and so are reported by inspect_mem)
+        mems = {net.op_param[1].id: net.op_param[1] for net in self.block.logic_subset('m@')}
+        self._mems = {}
+        valid_size = 0
+        for memid, mem in sorted(mems.items()):
+            if mem.addrwidth > self._max_mem_addrwidth:
+                raise PyrtlError('CompiledSimulation cannot simulate memory "%s" with %d '
+                                 'address bits' % (mem.name, mem.addrwidth))
+            self._mems[memid] = (mem, size, valid_size)
+            size += _words(mem.bitwidth) << mem.addrwidth
+            valid_size += 1 << mem.addrwidth
+
+        self._state = (ctypes.c_uint64 * size)()
+        self._valid = (ctypes.c_uint8 * max(valid_size, 1))()
+
+        for w, offset in self._offsets.items():
+            if isinstance(w, Const):
+                self._write(offset, w.bitwidth, w.val)
+        for r in self._regs:
+            value = register_value_map.get(r, self.default_value) & r.bitmask
+            self._write(self._next_offsets[r], r.bitwidth, value)
+        self._initialize_mems(memory_value_map)
+
+        self._inputs = []  # (name, bitwidth, position in the words of a cycle)
+        pos = 0
+        for w in sorted(self.block.wirevector_subset(Input), key=lambda w: w.name):
+            self._inputs.append((w.name, w.bitwidth, pos))
+            pos += _words(w.bitwidth)
+        self._input_words = pos
+        self._inputs_by_name = {w.name: w for w in self.block.wirevector_subset(Input)}
+        self._trace_pos = {}  # {name: position in the words of a cycle of the trace}
+        pos = 0
+        for name in self._traced:
+            self._trace_pos[name] = pos
+            pos += _words(self._names[name].bitwidth)
+        self._trace_words = pos
+
+        self._sim_run = self._load_function()
+
+    def _initialize_mems(self, memory_value_map):
+        for mem, offset, valid in self._mems.values():
+            entries = 1 << mem.addrwidth
+            mask = (1 << mem.bitwidth) - 1
+            if isinstance(mem, RomBlock):
+                self._fill_mem(mem, [mem._get_read_data(addr) & mask for addr in range(entries)])
+            elif self.default_value & mask:
+                self._fill_mem(mem, [self.default_value & mask] * entries)
+
+        for mem, mem_map in memory_value_map.items():
+            if mem.id not in self._mems:
+                continue  # the memory is not used by the block
+            if isinstance(mem, RomBlock):
+                raise PyrtlError("ROM blocks are not stored in the simulation object")
+            _, offset, valid = self._mems[mem.id]
+            mask = (1 << mem.bitwidth) - 1
+            for addr, value in mem_map.items():
+                if not 0 <= addr < (1 << mem.addrwidth):
+                    raise PyrtlError('address %s is not valid for memory "%s"'
+                                     % (addr, mem.name))
+                self._write(offset + addr * _words(mem.bitwidth), mem.bitwidth, value & mask)
+                self._valid[valid + addr] = 1
+
+    def _fill_mem(self, mem, values):
+        """ Set every entry of a memory, given a list of 2**addrwidth values. """
+        _, offset, valid = self._mems[mem.id]
+        words = _words(mem.bitwidth)
+        end = offset + (words << mem.addrwidth)
+        for k in range(words):
+            self._state[offset + k:end:words] = [(v >> (64 * k)) & _WORD_MASK for v in values]
+
+    def _load_function(self):
+        """ Return the sim_run function of the compiled block, from the code cache if possible. """
+        cc = shlex.split(os.environ.get('CC', 'cc'))
+        suffix = '.dll' if os.name == 'nt' else '.so'
+        cache = _fastsim_code_cache() if self.code_file is None else None
+        data = None
+        if cache is not None:
+            key = _block_fingerprint(self.block, 'sim_run', self._traced, cc)
+            data = cache.get(key, suffix)
+
+        tmpdir = tempfile.mkdtemp(prefix='pyrtl')
+        try:
+            if data is None:
+                source = self.compiled()
+                if self.code_file is not None:
+                    with open(self.code_file, 'w') as file:
+                        file.write(source)
+                data = self._compile(cc, source, tmpdir, suffix)
+                if cache is not None:
+                    cache.put(key, suffix, data)
+            # always load a private copy, as the cached one may be evicted at any time
+            filename = os.path.join(tmpdir, 'pyrtlsim' + suffix)
+            with open(filename, 'wb') as f:
+                f.write(data)
+            self._library = ctypes.CDLL(filename)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        sim_run = self._library.sim_run
+        sim_run.restype = ctypes.c_int64
+        sim_run.argtypes = [ctypes.POINTER(ctypes.c_uint64), ctypes.POINTER(ctypes.c_uint8),
+                            ctypes.POINTER(ctypes.c_uint64), ctypes.c_int64,
+                            ctypes.POINTER(ctypes.c_uint64)]
+        return sim_run
+
+    @staticmethod
+    def _compile(cc, source, tmpdir, suffix):
+        """ Build the C source into a shared library and return its contents. """
+        source_file = os.path.join(tmpdir, 'sim.c')
+        library_file = os.path.join(tmpdir, 'sim' + suffix)
+        with open(source_file, 'w') as f:
+            f.write(source)
+        command = cc + ['-O2', '-shared', '-fPIC', '-o', library_file, source_file]
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT)
+            output = process.communicate()[0]
+        except OSError as e:
+            raise PyrtlError('CompiledSimulation could not run the C compiler "%s": %s'
+                             % (' '.join(cc), e))
+        if process.returncode != 0:
+            raise PyrtlError('CompiledSimulation failed to compile the generated code:\n'
+                             + output.decode('utf-8', 'replace'))
+        with open(library_file, 'rb') as f:
+            return f.read()
+
+    def step(self, provided_inputs):
+        # validate_inputs
+        for wire, value in provided_inputs.items():
+            if value > wire.bitmask or value < 0:
+                raise PyrtlError("Wire {} has value {} which cannot be represented"
+                                 " using its bitwidth".format(wire, value))
+        if len(provided_inputs) != len(self._inputs_by_name):
+            for i in self.block.wirevector_subset(Input).difference(provided_inputs):
+                raise PyrtlError('Input "%s" has no input value specified' % i.name)
+
+        self._step_inputs(provided_inputs)
+
+    def run(self, stimulus, outputs=None, nsteps=None):
+        """ Simulate a whole stimulus, recording the values of the outputs in every cycle.
+
+        See Simulation.run.
+        """
+        return _run_stimulus(self, stimulus, outputs, nsteps)
+
+    def _step_inputs(self, provided_inputs):
+        """ Take the simulation forward one cycle with the checked {Input: value} map. """
+        ins = self._pack_inputs({wire.name: (value,) for wire, value in provided_inputs.items()},
+                                1)
+        self._run(ins, 1, None)
 
-        # add traced wires to dict
         if self.tracer is not None:
-            for wire_name in self.tracer.trace:
-                wire = self.block.wirevector_by_name[wire_name]
-                v_wire_name = self._varname(wire)
-                if not isinstance(wire, (Input, Const, Register, Output)):
-                    prog.append('    outs["%s"] = %s' % (wire_name, v_wire_name))
+            self.tracer.add_fast_step(self)
+        if self._state[0]:
+            check_rtl_assertions(self)
+
+    def step_multiple(self, provided_inputs, nsteps=None):
+        """ Take the simulation forward many cycles in a single call
+
+        :param provided_inputs: a dictionary mapping each input (wirevector or name)
+          to a list of its values, one per cycle
+        :param nsteps: the number of cycles to run (defaults to the length of the
+          lists in provided_inputs, which must then all be the same)
+
+        All of the cycles are run by a single call of the compiled code, with the
+        values of the traced wires collected in a buffer along the way.  The results
+        are the same as calling step once for each cycle: if an rtl_assert fails, that
+        cycle is traced and counted and then its exception is raised, without running
+        the cycles after it.
+        """
+        ins, nsteps = _multiple_inputs(self.block, provided_inputs, nsteps)
+        if nsteps:
+            self._run_columns(ins, nsteps, ())
 
-        prog.append("    return regs, outs, mem_ws")
-        return '\n'.join(prog)
+    def _run_columns(self, ins, nsteps, names):
+        """ Run nsteps cycles in one call, with the {input name: values} in ins.
+
+        :return: {name: [value for each cycle run]} for (at least) each of names
+        """
+        for name in names:
+            if name not in self._trace_pos:
+                raise KeyError(name)  # as from inspect, which only knows the same wires
+        names = set(names)
+        if self.tracer is not None:
+            names.update(self.tracer.trace)
+
+        trace = None
+        if names:
+            trace = (ctypes.c_uint64 * (nsteps * self._trace_words))()
+        cycles_run = self._run(self._pack_inputs(ins, nsteps), nsteps, trace)
+        value_lists = self._unpack_trace(trace, cycles_run, names)
+
+        if self.tracer is not None:
+            self.tracer.add_fast_steps(value_lists)
+
+        # the compiled code stops after the first cycle with a failing assertion
+        if self._state[0]:
+            check_rtl_assertions(self)
+        return value_lists
+
+    def _run(self, ins, nsteps, trace):
+        """ Run the compiled code for nsteps cycles and return the number actually run. """
+        cycles_run = self._sim_run(self._state, self._valid, ins, nsteps, trace)
+        self.cycle += cycles_run
+        self.context = _CompiledValues(self)
+        return cycles_run
+
+    def _pack_inputs(self, ins, nsteps):
+        """ Lay out {name: values} as the words of each cycle, one cycle after another. """
+        if not self._input_words:
+            return None
+        stride = self._input_words
+        buf = (ctypes.c_uint64 * (nsteps * stride))()
+        for name, bitwidth, pos in self._inputs:
+            values = ins[name]
+            if len(values) != nsteps:
+                values = values[:nsteps]
+            if bitwidth <= 64:
+                buf[pos::stride] = values
+            else:
+                for k in range(_words(bitwidth)):
+                    buf[pos + k::stride] = [(v >> (64 * k)) & _WORD_MASK for v in values]
+        return buf
+
+    def _unpack_trace(self, trace, cycles_run, names):
+        """ Return the {name: [value for each cycle]} of names recorded in the trace buffer. """
+        value_lists = {}
+        stride = self._trace_words
+        for name in names:
+            pos = self._trace_pos[name]
+            words = _words(self._names[name].bitwidth)
+            columns = [trace[pos + k:cycles_run * stride:stride] for k in range(words)]
+            if words == 1:
+                value_lists[name] = columns[0]
+            else:
+                value_lists[name] = [sum(word << (64 * k) for k, word in enumerate(values))
+                                     for values in zip(*columns)]
+        return value_lists
+
+    def _read(self, offset, bitwidth):
+        if bitwidth <= 64:
+            return self._state[offset]
+        return sum(self._state[offset + k] << (64 * k) for k in range(_words(bitwidth)))
+
+    def _write(self, offset, bitwidth, value):
+        for k in range(_words(bitwidth)):
+            self._state[offset + k] = (value >> (64 * k)) & _WORD_MASK
+
+    def inspect(self, w):
+        """ Get the value of a wirevector in the current simulation cycle.
+
+        :param w: the wirevector to inspect
+        :return: value of w in the current step of simulation
+
+        Will throw KeyError if w is not an input, register, output, or traced wire.
+        """
+        try:
+            context = self.context
+        except AttributeError:
+            raise PyrtlError("No context available. Please run a simulation step in "
+                             "order to populate values for wires")
+        return context[w.name if isinstance(w, WireVector) else w]
+
+    def inspect_mem(self, mem):
+        """ Get the values in a map during the current simulation cycle.
+
+        :param mem: the memory to inspect
+        :return: {address: value}
+
+        Unlike FastSimulation, this returns a copy of the written entries of the
+        memory, so modifying the dictionary does not change the simulation.
+        """
+        if isinstance(mem, RomBlock):
+            raise PyrtlError("ROM blocks are not stored in the simulation object")
+        _, offset, valid = self._mems[mem.id]
+        entries = 1 << mem.addrwidth
+        words = _words(mem.bitwidth)
+        return {addr: self._read(offset + addr * words, mem.bitwidth)
+                for addr, written in enumerate(self._valid[valid:valid + entries]) if written}
+
+    def save_state(self, path):
+        """ Save the registers, memories and cycle count of the simulation to a file.
+
+        :param path: the file to write the checkpoint to
+
+        See Simulation.save_state; the checkpoints of the simulators are
+        interchangeable.
+        """
+        regs = {r.name: self._read(self._next_offsets[r], r.bitwidth) for r in self._regs}
+        mems = {mem: self.inspect_mem(mem) if mem.id in self._mems else {}
+                for mem in _state_memories(self.block)}
+        _write_state(path, self.cycle, regs, mems)
+
+    def load_state(self, path):
+        """ Restore the registers, memories and cycle count from a save_state file.
+
+        :param path: the checkpoint file to read
+
+        See Simulation.load_state.
+        """
+        cycle, regs, mems = _read_state(path)
+        for r in self._regs:
+            if r.name in regs:
+                value = _check_state_value(r, regs[r.name])
+                self._write(self._next_offsets[r], r.bitwidth, value)
+        for mem in _state_memories(self.block):
+            if mem.name in mems and mem.id in self._mems:
+                contents = _check_state_memory(mem, mems[mem.name])
+                _, offset, valid = self._mems[mem.id]
+                entries = 1 << mem.addrwidth
+                default = self.default_value & ((1 << mem.bitwidth) - 1)
+                values, present = [default] * entries, [0] * entries
+                for addr, value in contents.items():
+                    values[addr], present[addr] = value, 1
+                self._fill_mem(mem, values)
+                self._valid[valid:valid + entries] = present
+        self.cycle = cycle
+
+    # Helpers shared by the generated code.  W(a, n, i) is word i of the n word
+    # value a (zero extended), and the functions with a "bits" argument mask the
+    # top word of their destination down to that many bits.
+    _c_prelude = r"""#include <stddef.h>
+#include <stdint.h>
+
+#ifdef _WIN32
+#define SIM_EXPORT __declspec(dllexport)
+#else
+#define SIM_EXPORT
+#endif
+
+#define W(a, n, i) ((i) < (n) ? (a)[i] : 0)
+#define WORDS(bits) (((bits) + 63) / 64)
+
+static void w_mask(uint64_t *d, int bits)
+{
+    if (bits & 63)
+        d[WORDS(bits) - 1] &= (UINT64_C(1) << (bits & 63)) - 1;
+}
+
+static void w_zero(uint64_t *d, int bits)
+{
+    int i;
+    for (i = 0; i < WORDS(bits); i++)
+        d[i] = 0;
+}
+
+static void w_copy(uint64_t *d, int bits, const uint64_t *a, int an)
+{
+    int i;
+    for (i = 0; i < WORDS(bits); i++)
+        d[i] = W(a, an, i);
+    w_mask(d, bits);
+}
+
+static void w_not(uint64_t *d, int bits, const uint64_t *a, int an)
+{
+    int i;
+    for (i = 0; i < WORDS(bits); i++)
+        d[i] = ~W(a, an, i);
+    w_mask(d, bits);
+}
+
+#define W_BITOP(name, expr) \
+static void name(uint64_t *d, int bits, const uint64_t *a, int an, const uint64_t *b, int bn) \
+{ \
+    int i; \
+    for (i = 0; i < WORDS(bits); i++) { \
+        uint64_t x = W(a, an, i), y = W(b, bn, i); \
+        d[i] = expr; \
+    } \
+    w_mask(d, bits); \
+}
+W_BITOP(w_and, x & y)
+W_BITOP(w_or, x | y)
+W_BITOP(w_xor, x ^ y)
+W_BITOP(w_nand, ~(x & y))
+
+static void w_add(uint64_t *d, int bits, const uint64_t *a, int an, const uint64_t *b, int bn)
+{
+    int i;
+    uint64_t carry = 0;
+    for (i = 0; i < WORDS(bits); i++) {
+        uint64_t t = W(a, an, i) + carry;
+        uint64_t c = t < carry;
+        uint64_t y = W(b, bn, i);
+        d[i] = t + y;
+        carry = c | (d[i] < y);
+    }
+    w_mask(d, bits);
+}
+
+static void w_sub(uint64_t *d, int bits, const uint64_t *a, int an, const uint64_t *b, int bn)
+{
+    int i;
+    uint64_t borrow = 0;
+    for (i = 0; i < WORDS(bits); i++) {
+        uint64_t x = W(a, an, i), y = W(b, bn, i);
+        uint64_t t = x - y;
+        uint64_t c = x < y;
+        d[i] = t - borrow;
+        borrow = c | (t < borrow);
+    }
+    w_mask(d, bits);
+}
+
+/* the full 128 bit product of two words, as lo + (*hi << 64) */
+static uint64_t mul64(uint64_t a, uint64_t b, uint64_t *hi)
+{
+    uint64_t al = a & 0xffffffffu, ah = a >> 32, bl = b & 0xffffffffu, bh = b >> 32;
+    uint64_t ll = al * bl, lh = al * bh, hl = ah * bl, hh = ah * bh;
+    uint64_t mid = (ll >> 32) + (lh & 0xffffffffu) + (hl & 0xffffffffu);
+    *hi = hh + (lh >> 32) + (hl >> 32) + (mid >> 32);
+    return (mid << 32) | (ll & 0xffffffffu);
+}
+
+static void w_mul(uint64_t *d, int bits, const uint64_t *a, int an, const uint64_t *b, int bn)
+{
+    int i, j, n = WORDS(bits);
+    w_zero(d, bits);
+    for (i = 0; i < an && i < n; i++) {
+        uint64_t carry = 0;
+        for (j = 0; j < bn && i + j < n; j++) {
+            uint64_t hi, lo = mul64(a[i], b[j], &hi);
+            lo += carry;
+            hi += lo < carry;
+            d[i + j] += lo;
+            hi += d[i + j] < lo;
+            carry = hi;
+        }
+        if (i + j < n)
+            d[i + j] = carry;
+    }
+    w_mask(d, bits);
+}
+
+/* -1, 0, or 1 as a is less than, equal to, or greater than b */
+static int w_cmp(const uint64_t *a, int an, const uint64_t *b, int bn)
+{
+    int i;
+    for (i = (an > bn ? an : bn) - 1; i >= 0; i--) {
+        uint64_t x = W(a, an, i), y = W(b, bn, i);
+        if (x != y)
+            return x < y ? -1 : 1;
+    }
+    return 0;
+}
+
+/* or len bits of a, starting at bit apos, into d starting at bit dpos */
+static void w_put(uint64_t *d, int dpos, const uint64_t *a, int an, int apos, int len)
+{
+    while (len > 0) {
+        int n = len < 64 ? len : 64;
+        int i = apos >> 6, sh = apos & 63;
+        uint64_t v = W(a, an, i) >> sh;
+        if (sh)
+            v |= W(a, an, i + 1) << (64 - sh);
+        if (n < 64)
+            v &= (UINT64_C(1) << n) - 1;
+        i = dpos >> 6;
+        sh = dpos & 63;
+        d[i] |= v << sh;
+        if (sh && sh + n > 64)
+            d[i + 1] |= v >> (64 - sh);
+        dpos += n;
+        apos += n;
+        len -= n;
+    }
+}
+"""
+
+    _c_ops = {  # expressions for the ops on values of at most 64 bits
+        'w': '{0}',
+        'r': '{0}',
+        '~': '~{0}',
+        '&': '{0} & {1}',
+        '|': '{0} | {1}',
+        '^': '{0} ^ {1}',
+        'n': '~({0} & {1})',
+        '+': '{0} + {1}',
+        '-': '{0} - {1}',
+        '*': '{0} * {1}',
+        '<': '{0} < {1}',
+        '>': '{0} > {1}',
+        '=': '{0} == {1}',
+        'x': '{0} ? {2} : {1}',
+    }
+
+    _c_wide_ops = {  # helpers for the ops on wider values
+        'w': 'w_copy',
+        'r': 'w_copy',
+        '~': 'w_not',
+        '&': 'w_and',
+        '|': 'w_or',
+        '^': 'w_xor',
+        'n': 'w_nand',
+        '+': 'w_add',
+        '-': 'w_sub',
+        '*': 'w_mul',
+    }
+
+    _c_compare = {'<': '< 0', '>': '> 0', '=': '== 0'}
+
+    def compiled(self):
+        """Return a string of the self.block compiled to C.
+
+        The resulting function "sim_run(s, valid, in, n, trace)" runs n cycles of the
+        block on the state buffer s and valid buffer (see _initialize), reading the
+        words of the inputs for each cycle from in and, if trace is not NULL, writing
+        the words of the traced wires of each cycle to it.  It returns the number of
+        cycles run, stopping after the first one in which an rtl_assert fails.
+        """
+        consts = []  # file level arrays for the constants used by the wide ops
+        const_names = {}
+        decls = []  # locals for the wires which are not kept in the state buffer
+        prog = []
+        mem_writes = []  # delayed until the end of the cycle so reads see the old value
+
+        def hexval(value):
+            return 'UINT64_C(0x%x)' % value
+
+        def val(wire):
+            """ Expression for the value of a wire of at most 64 bits """
+            if isinstance(wire, Const):
+                return hexval(wire.val)
+            elif wire in self._offsets:
+                return 's[%d]' % self._offsets[wire]
+            return 'v%d' % self._wire_ids[wire]
+
+        def ptr(wire):
+            """ Expression for a pointer to the words of a wire """
+            if isinstance(wire, Const):
+                if wire not in const_names:
+                    const_names[wire] = 'k%d' % self._wire_ids[wire]
+                    words = _words(wire.bitwidth)
+                    consts.append('static const uint64_t %s[%d] = {%s};' % (
+                        const_names[wire], words, ', '.join(
+                            hexval((wire.val >> (64 * k)) & _WORD_MASK) for k in range(words))))
+                return const_names[wire]
+            elif wire in self._offsets:
+                return '(s + %d)' % self._offsets[wire]
+            elif wire.bitwidth <= 64:
+                return '&v%d' % self._wire_ids[wire]
+            return 'v%d' % self._wire_ids[wire]
+
+        def arg(wire):
+            """ The pointer and word count arguments of the helpers for a wire """
+            return '%s, %d' % (ptr(wire), _words(wire.bitwidth))
+
+        for net in self.block:
+            if net.op not in 'wr~&|^n+-*<>=xcsm@':
+                raise PyrtlError('CompiledSimulation cannot handle primitive "%s"' % net.op)
+            if net.op == '@':
+                mem, offset, valid = self._mems[net.op_param[1].id]
+                addr, data, enable = net.args
+                if mem.bitwidth <= 64:
+                    write = 's[%d + %s] = %s;' % (offset, val(addr), val(data))
+                else:
+                    write = 'w_copy(s + %d + %d * %s, %d, %s);' % (
+                        offset, _words(mem.bitwidth), val(addr), mem.bitwidth, arg(data))
+                mem_writes.append('if (%s) {' % val(enable))
+                mem_writes.append('    ' + write)
+                mem_writes.append('    valid[%d + %s] = 1;' % (valid, val(addr)))
+                mem_writes.append('}')
+                continue
+
+            dest = net.dests[0]
+            if net.op == 'r':
+                dest_val = 's[%d]' % self._next_offsets[dest]
+                dest_ptr = '(s + %d)' % self._next_offsets[dest]
+            else:
+                dest_val, dest_ptr = val(dest), ptr(dest)
+                if dest not in self._offsets:
+                    if dest.bitwidth <= 64:
+                        decls.append('uint64_t %s;' % dest_val)
+                    else:
+                        decls.append('uint64_t %s[%d];' % (dest_val, _words(dest.bitwidth)))
+
+            if all(w.bitwidth <= 64 for w in net.args + net.dests):
+                prog.append(self._compiled_narrow_net(net, val, dest_val, hexval))
+            else:
+                prog.extend(self._compiled_wide_net(net, val, arg, dest_val, dest_ptr))
+
+        lines = [self._c_prelude]
+        lines.extend(consts)
+        lines.append('')
+        lines.append('SIM_EXPORT int64_t sim_run(uint64_t *s, uint8_t *valid, '
+                     'const uint64_t *in, int64_t n, uint64_t *trace)')
+        lines.append('{')
+        lines.append('    int64_t c;')
+        lines.append('    s[0] = 0;')
+        lines.append('    for (c = 0; c < n; c++) {')
+        body = list(decls)
+        for r in self._regs:  # the registers take on the values computed in the last cycle
+            for k in range(_words(r.bitwidth)):
+                body.append('s[%d] = s[%d];' % (self._offsets[r] + k, self._next_offsets[r] + k))
+        for name, bitwidth, pos in self._inputs:
+            for k in range(_words(bitwidth)):
+                body.append('s[%d] = in[c * %d + %d];' % (
+                    self._offsets[self._names[name]] + k, self._input_words, pos + k))
+        body.extend(prog)
+        body.extend(mem_writes)
+        if self._traced:
+            body.append('if (trace != NULL) {')
+            body.append('    uint64_t *t = trace + c * %d;' % self._trace_words)
+            pos = 0
+            for name in self._traced:
+                wire = self._names[name]
+                for k in range(_words(wire.bitwidth)):
+                    body.append('    t[%d] = s[%d];' % (pos, self._offsets[wire] + k))
+                    pos += 1
+            body.append('}')
+        asserts = sorted(self.block.rtl_assert_dict, key=lambda w: w.name)
+        if asserts:
+            body.append('if (!(%s)) {' % ' & '.join(val(w) for w in asserts))
+            body.append('    s[0] = 1;')
+            body.append('    return c + 1;')
+            body.append('}')
+        lines.extend('        ' + line for line in body)
+        lines.append('    }')
+        lines.append('    return n;')
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def _compiled_narrow_net(self, net, val, dest_val, hexval):
+        """ The line of C for a net whose wires all fit in a single word. """
+        dest = net.dests[0]
+        if net.op in self._c_ops:
+            expr = self._c_ops[net.op].format(*[val(w) for w in net.args])
+        elif net.op == 'c':
+            parts = []
+            shift = dest.bitwidth
+            for w in net.args:
+                shift -= w.bitwidth
+                parts.append('(%s << %d)' % (val(w), shift) if shift else val(w))
+            expr = ' | '.join(parts)
+        elif net.op == 's':
+            parts = []
+            for start, res_start, length in self._select_runs(net.op_param):
+                part = '((%s >> %d) & %s)' % (val(net.args[0]), start, hexval((1 << length) - 1))
+                parts.append('(%s << %d)' % (part, res_start) if res_start else part)
+            expr = ' | '.join(parts)
+        else:  # 'm'
+            mem, offset, valid = self._mems[net.op_param[1].id]
+            expr = 's[%d + %s]' % (offset, val(net.args[0]))
+
+        if dest.bitwidth == FastSimulation._expected_bitwidth[net.op](net):
+            return '%s = %s;' % (dest_val, expr)
+        return '%s = (%s) & %s;' % (dest_val, expr, hexval(dest.bitmask))
+
+    def _compiled_wide_net(self, net, val, arg, dest_val, dest_ptr):
+        """ The lines of C for a net with a wire of more than 64 bits. """
+        dest = net.dests[0]
+        if net.op in self._c_wide_ops:
+            return ['%s(%s, %d, %s);' % (self._c_wide_ops[net.op], dest_ptr, dest.bitwidth,
+                                         ', '.join(arg(w) for w in net.args))]
+        elif net.op in self._c_compare:
+            return ['%s = w_cmp(%s, %s) %s;' % (dest_val, arg(net.args[0]), arg(net.args[1]),
+                                                self._c_compare[net.op])]
+        elif net.op == 'x':
+            sel, f, t = net.args
+            return ['if (%s)' % val(sel),
+                    '    w_copy(%s, %d, %s);' % (dest_ptr, dest.bitwidth, arg(t)),
+                    'else',
+                    '    w_copy(%s, %d, %s);' % (dest_ptr, dest.bitwidth, arg(f))]
+        elif net.op == 'c':
+            prog = ['w_zero(%s, %d);' % (dest_ptr, dest.bitwidth)]
+            shift = dest.bitwidth
+            for w in net.args:
+                shift -= w.bitwidth
+                prog.append('w_put(%s, %d, %s, 0, %d);' % (dest_ptr, shift, arg(w), w.bitwidth))
+            return prog
+        elif net.op == 's':
+            prog = ['w_zero(%s, %d);' % (dest_ptr, dest.bitwidth)]
+            for start, res_start, length in self._select_runs(net.op_param):
+                prog.append('w_put(%s, %d, %s, %d, %d);' % (
+                    dest_ptr, res_start, arg(net.args[0]), start, length))
+            return prog
+        else:  # 'm'
+            mem, offset, valid = self._mems[net.op_param[1].id]
+            words = _words(mem.bitwidth)
+            return ['w_copy(%s, %d, s + %d + %d * %s, %d);' % (
+                dest_ptr, dest.bitwidth, offset, words, val(net.args[0]), words)]
+
+    @staticmethod
+    def _select_runs(selected):
+        """ Group the bits of a select into (source start, result start, length) runs. """
+        runs = []
+        for i, b in enumerate(selected):
+            if runs and b == runs[-1][0] + runs[-1][2]:
+                runs[-1][2] += 1
+            else:
+                runs.append([b, i, 1])
+        return runs
+
+
+class _CompiledValues(collections.Mapping):
+    """ {name: value} view of the inspectable wires of a CompiledSimulation. """
+
+    def __init__(self, sim):
+        self._sim = sim
+
+    def __getitem__(self, name):
+        w = self._sim._names[name]
+        return self._sim._read(self._sim._offsets[w], w.bitwidth)
+
+    def __iter__(self):
+        return iter(self._sim._names)
+
+    def __len__(self):
+        return len(self._sim._names)
+
+
+_code_cache_settings = {
+    'enabled': False,
+    'directory': os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+        'pyrtl'),
+    'max_bytes': 256 * 1024 * 1024,
+}
+
+
+def set_fastsim_code_cache(enabled=True, directory=None, max_bytes=None):
+    """ Configure the on-disk cache of code generated by FastSimulation.
+
+    :param enabled: if False (the default until this is called), FastSimulation
+        always generates and compiles its code
+    :param directory: where to store the cache (default "~/.cache/pyrtl")
+    :param max_bytes: the size the cache is trimmed to (least recently used first)
+
+    Generated code is keyed by a hash of the structure of the block, the set of
+    traced wires, and the default value, so a later simulation of the same design
+    (even in another process) can skip code generation and compilation entirely.
+    Nothing is written to disk unless the cache has been enabled with this function.
+    """
+    _code_cache_settings['enabled'] = enabled
+    if directory is not None:
+        _code_cache_settings['directory'] = directory
+    if max_bytes is not None:
+        _code_cache_settings['max_bytes'] = max_bytes
+
+
+def _fastsim_code_cache():
+    """ Return the configured _CodeCache, or None if caching is disabled. """
+    if not _code_cache_settings['enabled']:
+        return None
+    return _CodeCache(_code_cache_settings['directory'], _code_cache_settings['max_bytes'])
+
+
+class _CodeCache(object):
+    """ Content-addressed on-disk store with size-bounded LRU eviction.
+
+    Every entry is a single file named by its key.  Reading an entry updates its
+    modification time, and whenever an entry is added the least recently used
+    files are removed until the directory is no larger than max_bytes.  Any
+    problem with the file system simply results in a cache miss.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key, suffix):
+        """ Return the bytes stored under key, or None. """
+        filename = self.path(key, suffix)
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            os.utime(filename, None)
+        except (IOError, OSError):
+            return None
+        return data
+
+    def put(self, key, suffix, data):
+        """ Atomically store the bytes under key and trim the cache. """
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmpname = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmpname, self.path(key, suffix))
+        except (IOError, OSError):
+            return
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache fits in max_bytes. """
+        try:
+            entries = []
+            for name in os.listdir(self.directory):
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_mtime, st.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                os.remove(os.path.join(self.directory, name))
+                total -= size
+        except (IOError, OSError):
+            pass
+
+    def get_code(self, key):
+        """ Return the code object stored under key, or None. """
+        data = self.get(key, '.pyc')
+        if data is None:
+            return None
+        try:
+            return marshal.loads(data)
+        except (ValueError, EOFError, TypeError):
+            return None
+
+    def put_code(self, key, code):
+        self.put(key, '.pyc', marshal.dumps(code))
+
+
+_generator_signature = []
+
+
+def _block_fingerprint(block, *extra):
+    """ Return a hex digest identifying the structure of block (and any extra values).
+
+    The digest covers every net, wire, and rtl_assert of the block along with the
+    python version and the source of this module, and it does not depend on the
+    (arbitrary) order in which the nets of the block are stored.
+    """
+    if not _generator_signature:
+        try:
+            with open(os.path.splitext(__file__)[0] + '.py', 'rb') as f:
+                _generator_signature.append(hashlib.sha1(f.read()).hexdigest())
+        except (IOError, OSError):
+            _generator_signature.append('unknown')
+
+    def wire_desc(w):
+        val = str(w.val) if isinstance(w, Const) else ''
+        return '%s/%d%s%s' % (w.name, w.bitwidth, w._code, val)
+
+    def param_desc(net):
+        if net.op in 'm@':
+            memid, mem = net.op_param
+            return '%d:%d:%s:%d:%d' % (memid, mem.id, type(mem).__name__,
+                                       mem.bitwidth, mem.addrwidth)
+        return repr(net.op_param)
+
+    lines = sorted(' '.join([net.op, param_desc(net), ','.join(wire_desc(w) for w in net.args),
+                             ','.join(wire_desc(w) for w in net.dests)])
+                   for net in block.logic)
+    lines.extend(sorted(wire_desc(w) for w in block.wirevector_set))
+    lines.extend(sorted('assert ' + w.name for w in block.rtl_assert_dict))
+    lines.extend(repr(x) for x in extra)
+    lines.extend([sys.version, _generator_signature[0]])
+    return hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+def run_parallel(block, stimuli, workers=None, register_value_map=None,
+                 memory_value_map=None, default_value=0, wirevector_subset=None):
+    """ Simulate many independent stimulus sequences on one block using a process pool.
+
+    :param block: the hardware block to simulate
+    :param stimuli: a list of stimulus sequences.  Each sequence is either a list of
+      {input: value} dicts (one per cycle) or a dict mapping each input to a list of
+      its values (as for step_multiple).  Inputs can be wirevectors or names.
+    :param workers: the number of processes to use (defaults to the number of cpus)
+    :param register_value_map: is a map of {Register: value} used for every sequence.
+    :param memory_value_map: is a map of maps {Memory: {address: Value}} used (copied)
+      for every sequence.
+    :param default_value: the value of all unspecified registers and memories
+    :param wirevector_subset: the wires to trace, as for SimulationTrace
+    :return: a list with one SimulationTrace per sequence, in the order of stimuli
+
+    The block is pickled once and unpickled once in each worker process, where every
+    sequence runs on its own FastSimulation from the same initial state.  With a
+    single worker (or a single sequence) everything runs in this process instead.
+    """
+    block = working_block(block)
+    block.sanity_check()
+    trace_names = list(SimulationTrace(wirevector_subset, block=block).trace)
+    setup = (block, register_value_map, memory_value_map, default_value, trace_names)
+    sequences = [_stimulus_by_name(stimulus) for stimulus in stimuli]
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(sequences))
+    if workers <= 1:
+        results = [_run_sequence(setup, sequence) for sequence in sequences]
+    else:
+        try:
+            payload = pickle.dumps(setup, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            raise PyrtlError('run_parallel could not pickle the block (%s); '
+                             'use workers=1 to simulate it in this process' % e)
+        pool = multiprocessing.Pool(workers, _run_parallel_init, (payload,))
+        try:
+            results = pool.map(_run_parallel_sequence, sequences)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    traces = []
+    for values in results:
+        trace = SimulationTrace([block.wirevector_by_name[name] for name in trace_names],
+                                block=block)
+        trace.add_fast_steps(values)
+        traces.append(trace)
+    return traces
+
+
+def _stimulus_by_name(stimulus):
+    """ Convert a stimulus sequence to a {input name: [values]} dict. """
+    def name(i):
+        return i.name if isinstance(i, WireVector) else i
+
+    if isinstance(stimulus, collections.Mapping):
+        return {name(i): list(values) for i, values in stimulus.items()}
+    by_name = None
+    for inputs in stimulus:
+        inputs = {name(i): value for i, value in inputs.items()}
+        if by_name is None:
+            by_name = {i: [] for i in inputs}
+        if len(inputs) != len(by_name) or any(i not in by_name for i in inputs):
+            raise PyrtlError('every cycle of a stimulus sequence must give a value '
+                             'for the same inputs')
+        for i, value in inputs.items():
+            by_name[i].append(value)
+    return by_name if by_name is not None else {}
+
+
+def _run_sequence(setup, sequence):
+    """ Run one stimulus sequence and return its trace as {name: [values]}. """
+    block, register_value_map, memory_value_map, default_value, trace_names = setup
+    if memory_value_map is not None:
+        memory_value_map = {mem: dict(values) for mem, values in memory_value_map.items()}
+    tracer = SimulationTrace([block.wirevector_by_name[name] for name in trace_names],
+                             block=block)
+    sim = FastSimulation(register_value_map=register_value_map,
+                         memory_value_map=memory_value_map, default_value=default_value,
+                         tracer=tracer, block=block)
+    sim.step_multiple(sequence)
+    return {name: list(values) for name, values in tracer.trace.items()}
+
+
+_run_parallel_setup = None  # the unpickled setup of run_parallel in a worker process
+
+
+def _run_parallel_init(payload):
+    global _run_parallel_setup
+    _run_parallel_setup = pickle.loads(payload)
+
+
+def _run_parallel_sequence(sequence):
+    return _run_sequence(_run_parallel_setup, sequence)
+
+
+# Checkpoint files (see Simulation.save_state) are a header followed by a record
+# for each register and memory.  All integers in the header and record headers are
+# little endian; register values and memory entries are big endian and just wide
+# enough for the bitwidth of the wire or memory.
+_STATE_MAGIC = b'PYRTLSIM'
+_STATE_VERSION = 1
+_STATE_HEADER = struct.Struct('<8sIQII')  # magic, version, cycle, #registers, #memories
+_STATE_REG = struct.Struct('<HI')  # name length, value length
+_STATE_MEM = struct.Struct('<HIIQ')  # name length, bitwidth, addrwidth, #entries
+
+
+def _state_memories(block):
+    """ The memories of block which hold state (i.e. not ROMs). """
+    mems = set(net.op_param[1] for net in block.logic_subset('m@'))
+    return sorted((m for m in mems if not isinstance(m, RomBlock)), key=lambda m: m.name)
+
+
+def _nbytes(bitwidth):
+    return (bitwidth + 7) // 8
+
+
+def _int_to_bytes(value, nbytes):
+    return binascii.unhexlify('%0*x' % (2 * nbytes, value)) if nbytes else b''
+
+
+def _int_from_bytes(data):
+    return int(binascii.hexlify(data), 16) if data else 0
+
+
+def _write_state(path, cycle, regs, mems):
+    """ Write a checkpoint of {register name: value} and {memory: {addr: value}}. """
+    with open(path, 'wb') as f:
+        f.write(_STATE_HEADER.pack(_STATE_MAGIC, _STATE_VERSION, cycle, len(regs), len(mems)))
+        for name, value in sorted(regs.items()):
+            name = name.encode('utf-8')
+            data = _int_to_bytes(value, _nbytes(value.bit_length()))
+            f.write(_STATE_REG.pack(len(name), len(data)))
+            f.write(name)
+            f.write(data)
+        for mem, contents in sorted(mems.items(), key=lambda item: item[0].name):
+            name = mem.name.encode('utf-8')
+            addr_bytes, value_bytes = _nbytes(mem.addrwidth), _nbytes(mem.bitwidth)
+            f.write(_STATE_MEM.pack(len(name), mem.bitwidth, mem.addrwidth, len(contents)))
+            f.write(name)
+            f.write(b''.join(_int_to_bytes(addr, addr_bytes) + _int_to_bytes(value, value_bytes)
+                             for addr, value in sorted(contents.items())))
+
+
+class _StateMemory(collections.Mapping):
+    """ {address: value} view of a memory in a checkpoint, decoded on access.
+
+    The entries are fixed size (address, value) records sorted by address, so a
+    lookup is a binary search of the mapped file and only the records used are
+    ever decoded.  The view keeps the mapping open for as long as it is alive.
+    """
+
+    def __init__(self, data, offset, nentries, addr_bytes, value_bytes):
+        self._data = data
+        self._offset = offset
+        self._len = nentries
+        self._addr_bytes = addr_bytes
+        self._entry_bytes = addr_bytes + value_bytes
+
+    def _addr(self, i):
+        start = self._offset + i * self._entry_bytes
+        return _int_from_bytes(self._data[start:start + self._addr_bytes])
+
+    def _value(self, i):
+        start = self._offset + i * self._entry_bytes
+        return _int_from_bytes(self._data[start + self._addr_bytes:start + self._entry_bytes])
+
+    def __getitem__(self, addr):
+        lo, hi = 0, self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._addr(mid) < addr:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self._len or self._addr(lo) != addr:
+            raise KeyError(addr)
+        return self._value(lo)
+
+    def __iter__(self):
+        return (self._addr(i) for i in range(self._len))
+
+    def __len__(self):
+        return self._len
+
+    def items(self):
+        """ Return an iterator over the (address, value) records, in address order. """
+        return ((self._addr(i), self._value(i)) for i in range(self._len))
+
+
+def _read_state(path):
+    """ Read a checkpoint written by _write_state.
+
+    :return: (cycle, {register name: value}, {memory name: (bitwidth, addrwidth, contents)})
+
+    The file is memory mapped and the contents of each memory are a _StateMemory
+    view of it, so memories are only decoded as they are used; those that the
+    design being restored does not have are never decoded at all.
+    """
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # an empty file cannot be mapped
+            raise PyrtlError('"%s" is not a simulation checkpoint' % path)
+    try:
+        if len(data) < _STATE_HEADER.size:
+            raise PyrtlError('"%s" is not a simulation checkpoint' % path)
+        magic, version, cycle, nregs, nmems = _STATE_HEADER.unpack_from(data, 0)
+        if magic != _STATE_MAGIC or version != _STATE_VERSION:
+            raise PyrtlError('"%s" is not a version %d simulation checkpoint'
+                             % (path, _STATE_VERSION))
+        offset = _STATE_HEADER.size
+        regs = {}
+        for _ in range(nregs):
+            name_len, value_len = _STATE_REG.unpack_from(data, offset)
+            offset += _STATE_REG.size
+            name = data[offset:offset + name_len].decode('utf-8')
+            offset += name_len
+            regs[name] = _int_from_bytes(data[offset:offset + value_len])
+            offset += value_len
+        mems = {}
+        for _ in range(nmems):
+            name_len, bitwidth, addrwidth, nentries = _STATE_MEM.unpack_from(data, offset)
+            offset += _STATE_MEM.size
+            name = data[offset:offset + name_len].decode('utf-8')
+            offset += name_len
+            addr_bytes, value_bytes = _nbytes(addrwidth), _nbytes(bitwidth)
+            contents = _StateMemory(data, offset, nentries, addr_bytes, value_bytes)
+            offset += nentries * (addr_bytes + value_bytes)
+            mems[name] = (bitwidth, addrwidth, contents)
+        if offset != len(data):
+            raise PyrtlError('"%s" is a truncated or corrupt simulation checkpoint' % path)
+    except struct.error:
+        data.close()
+        raise PyrtlError('"%s" is a truncated or corrupt simulation checkpoint' % path)
+    except PyrtlError:
+        data.close()
+        raise
+    return cycle, regs, mems
+
+
+def _check_state_value(reg, value):
+    if value > reg.bitmask:
+        raise PyrtlError('the checkpoint value %d of register "%s" does not fit in %d bits'
+                         % (value, reg.name, reg.bitwidth))
+    return value
+
+
+def _check_state_memory(mem, state):
+    bitwidth, addrwidth, contents = state
+    if (bitwidth, addrwidth) != (mem.bitwidth, mem.addrwidth):
+        raise PyrtlError('memory "%s" is %dx%d bits but the checkpoint has %dx%d bits'
+                         % (mem.name, 2**mem.addrwidth, mem.bitwidth, 2**addrwidth, bitwidth))
+    return contents
 
 
 # ----------------------------------------------------------------
@@ -674,11 +2899,72 @@ def _trace_sort_key(w):
     return [tryint(c) for c in re.split('([0-9]+)', w)]
 
 
+# the unsigned array typecodes, from smallest to largest item size
+_TRACE_TYPECODES = sorted(((8 * array.array(code).itemsize, code)
+                           for code in set(['B', 'H', 'I', 'L', _NARROW_TYPECODE])))
+
+
+class _TraceColumn(collections.Sequence):
+    """ The traced values of one wire, stored as compactly as its bitwidth allows.
+
+    Wires which fit in a machine word are kept in an array of the smallest unsigned
+    type that can hold them; wider wires fall back to a list of python ints.  Columns
+    compare equal to lists (and tuples) holding the same values, and slicing one
+    returns a list.
+    """
+    __slots__ = ('_values',)
+
+    def __init__(self, bitwidth):
+        for bits, code in _TRACE_TYPECODES:
+            if bitwidth <= bits:
+                self._values = array.array(code)
+                break
+        else:
+            self._values = []
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self._values[index])
+        return self._values[index]
+
+    def append(self, value):
+        self._values.append(value)
+
+    def extend(self, values):
+        self._values.extend(values)
+
+    def trim(self, length):
+        """ Drop all but the last length values. """
+        if len(self._values) > length:
+            del self._values[:len(self._values) - length]
+
+    def __eq__(self, other):
+        if isinstance(other, (_TraceColumn, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self._values))
+
+
 class TraceStorage(collections.Mapping):
-    __slots__ = ('__data',)
+    __slots__ = ('__data', 'limit')
 
     def __init__(self, wvs):
-        self.__data = {wv.name: [] for wv in wvs}
+        self.__data = {wv.name: _TraceColumn(wv.bitwidth) for wv in wvs}
+        self.limit = None  # if set, only the last limit cycles are kept
 
     def __len__(self):
         return len(self.__data)
@@ -693,13 +2979,48 @@ class TraceStorage(collections.Mapping):
                 'Access to trace by WireVector instead of name is deprecated.',
                 DeprecationWarning)
             key = key.name
-        return self.__data[key]
+        column = self.__data[key]
+        if self.limit is not None:
+            column.trim(self.limit)
+        return column
+
+    def columns(self):
+        """ The (name, column) pairs, without trimming them to the limit. """
+        return self.__data.items()
+
+    def trim(self, length):
+        """ Drop all but the last length cycles of every column. """
+        for column in self.__data.values():
+            column.trim(length)
 
 
 class SimulationTrace(object):
-    """ Storage and presentation of simulation waveforms. """
+    """ Storage and presentation of simulation waveforms.
+
+    By default every cycle is kept.  Like a logic analyzer, the trace can instead
+    keep only a window of the simulation: with depth alone it is a ring buffer of the
+    last depth cycles, and with a trigger it keeps the depth cycles before the cycle
+    where the trigger fires, that cycle, and then up to post_trigger more cycles (or
+    until the stop condition holds).  Triggers and stop conditions are either a dict
+    {name: value} which holds when every named wire has its value, or a function
+    called with a {name: value} map of the traced wires that returns a bool.  The
+    wires a dict names must be traced.  print_trace, print_vcd and render_trace all
+    work on the captured window; start_cycle is the simulation cycle it starts at and
+    trigger_cycle the cycle where the trigger fired (or None).
+    """
 
-    def __init__(self, wirevector_subset=None, block=None):
+    def __init__(self, wirevector_subset=None, block=None, depth=None, trigger=None,
+                 post_trigger=None, stop=None):
+        """
+        :param wirevector_subset: the wires to trace (default all named wires, or 'all')
+        :param block: the hardware block being traced
+        :param depth: the number of cycles kept before the trigger (or, without a
+          trigger, in total); None keeps everything without a trigger and nothing
+          before the trigger otherwise
+        :param trigger: the condition that starts the capture
+        :param post_trigger: the number of cycles captured after the trigger cycle
+        :param stop: the condition that ends the capture (after the trigger, if any)
+        """
         block = working_block(block)
 
         def is_internal_name(name):
@@ -715,6 +3036,29 @@ class SimulationTrace(object):
         self.trace = TraceStorage(wirevector_subset)
         self._wires = {wv.name: wv for wv in wirevector_subset}
 
+        for condition in (trigger, stop):
+            if isinstance(condition, collections.Mapping):
+                for name in condition:
+                    if getattr(name, 'name', name) not in self._wires:
+                        raise PyrtlError('trigger wire "%s" is not traced' % name)
+        if depth is not None and depth < 0 or post_trigger is not None and post_trigger < 0:
+            raise PyrtlError('trace depth and post_trigger must not be negative')
+        self._depth = depth
+        self._trigger = trigger
+        self._post_trigger = post_trigger
+        self._stop = stop
+        self._windowed = trigger is not None or stop is not None
+        self._state = 'armed' if trigger is not None else 'capturing'
+        self._remaining = None
+        self._added = 0  # the number of cycles added, including those dropped since
+        self.trigger_cycle = None
+        self._columns = [(name, self._wires[name], column)
+                         for name, column in self.trace.columns()]
+        if trigger is not None:
+            self.trace.limit = depth or 0
+        elif depth is not None:
+            self.trace.limit = depth
+
     def __len__(self):
         """ Return the current length of the trace in cycles. """
         if len(self.trace) == 0:
@@ -729,15 +3073,81 @@ class SimulationTrace(object):
             raise PyrtlError('error, simulation trace needs at least 1 signal to track '
                              '(by default, unnamed signals are not traced -- try either passing '
                              'a name to a WireVector or setting a "wirevector_subset" option)')
-        for wire in self.trace:
-            tracelist = self.trace[wire]
-            wirevec = self._wires[wire]
-            tracelist.append(value_map[wirevec])
+        if self._state == 'done':
+            return
+        for name, wirevec, column in self._columns:
+            column.append(value_map[wirevec])
+        self._added_cycle(value_map, self._wires)
 
     def add_fast_step(self, fastsim):
         """ Add the fastsim context to the trace. """
-        for wire_name in self.trace:
-            self.trace[wire_name].append(fastsim.context[wire_name])
+        if self._state == 'done':
+            return
+        context = fastsim.context
+        for name, wirevec, column in self._columns:
+            column.append(context[name])
+        self._added_cycle(context)
+
+    def add_fast_steps(self, value_lists):
+        """ Add many cycles at once from a map of {name: [value for each cycle]}. """
+        if self._windowed:
+            names = [name for name, wirevec, column in self._columns]
+            for values in zip(*[value_lists[name] for name in names]):
+                if self._state == 'done':
+                    return
+                for (name, wirevec, column), value in zip(self._columns, values):
+                    column.append(value)
+                self._added_cycle(dict(zip(names, values)))
+            return
+        for name, wirevec, column in self._columns:
+            column.extend(value_lists[name])
+        if self._columns:
+            self._added += len(value_lists[self._columns[0][0]])
+            if self.trace.limit is not None:
+                self.trace.trim(self.trace.limit)
+
+    @property
+    def start_cycle(self):
+        """ The simulation cycle of the first cycle in the trace. """
+        return self._added - len(self) if self._columns else 0
+
+    def _added_cycle(self, values, wires=None):
+        """ Update the capture window after a cycle has been added.
+
+        :param values: the values of the cycle, keyed by wire (if wires is given,
+          a map from the traced names to those wires) or by name
+        """
+        self._added += 1
+        limit = self.trace.limit
+        # the ring buffer grows to twice its size between trims so appends stay cheap
+        if limit is not None and self._columns and len(self._columns[0][2]) > 2 * limit + 64:
+            self.trace.trim(limit)
+        if not self._windowed:
+            return
+
+        by_name = values if wires is None else {n: values[w] for n, w in wires.items()}
+        if self._state == 'armed':
+            if not self._holds(self._trigger, by_name):
+                return
+            self.trigger_cycle = self._added - 1
+            self.trace.trim((self._depth or 0) + 1)
+            self.trace.limit = None
+            self._state = 'capturing'
+            self._remaining = self._post_trigger
+        elif self._stop is not None and self._holds(self._stop, by_name):
+            self._state = 'done'
+            return
+        elif self._remaining is not None:
+            self._remaining -= 1
+        if self._remaining == 0:
+            self._state = 'done'
+
+    @staticmethod
+    def _holds(condition, by_name):
+        if isinstance(condition, collections.Mapping):
+            return all(by_name[getattr(name, 'name', name)] == value
+                       for name, value in condition.items())
+        return condition(by_name)
 
     def print_trace(self, file=sys.stdout):
         if len(self.trace) == 0:
@@ -755,13 +3165,14 @@ class SimulationTrace(object):
         # print >>file, " ".join(["$date", file_timestamp, "$end"])
         print(' '.join(['$timescale', '1ns', '$end']), file=file)
         print(' '.join(['$scope', 'module logic', '$end']), file=file)
+        sorted_names = sorted(self.trace, key=_trace_sort_key)
+        columns = [(w, self.trace[w]) for w in sorted_names]
 
         def print_trace_strs(time):
-            for w in sorted(self.trace, key=_trace_sort_key):
-                print(' '.join([str(bin(self.trace[w][time]))[1:], w]), file=file)
+            file.write(''.join('b{:b} {}\n'.format(column[time], w) for w, column in columns))
 
         # dump variables
-        for w in sorted(self.trace, key=_trace_sort_key):
+        for w in sorted_names:
             print(' '.join(['$var', 'wire', str(self._wires[w].bitwidth), w, w, '$end']), file=file)
         print(' '.join(['$upscope', '$end']), file=file)
         print(' '.join(['$enddefinitions', '$end']), file=file)
@@ -770,7 +3181,7 @@ class SimulationTrace(object):
         print(' '.join(['$end']), file=file)
 
         # dump values
-        endtime = max([len(self.trace[w]) for w in self.trace])
+        endtime = max([len(column) for w, column in columns])
         for timestamp in range(endtime):
             print(''.join(['#', str(timestamp)]), file=file)
             print_trace_strs(timestamp)
@@ -855,3 +3266,121 @@ class SimulationTrace(object):
             print(formatted_trace_line(w, self.trace[w]), file=file)
         if extra_line:
             print(file=file)
+
+
+class StreamingVCDTrace(object):
+    """ A tracer which writes the simulation straight to a VCD file as it runs.
+
+    Use it in place of a SimulationTrace (e.g. Simulation(tracer=StreamingVCDTrace(f)))
+    when the whole trace would not fit in memory.  A value is only written in the
+    cycles where it changes, and each wire is identified by a short code, so the
+    files are much smaller than those of SimulationTrace.print_vcd.  Call close
+    (or use the tracer as a context manager) when the simulation is done.
+    """
+
+    def __init__(self, file, wirevector_subset=None, block=None, buffer_size=1 << 20):
+        """
+        :param file: the file object, or path of the file, to write the VCD to
+        :param wirevector_subset: the wires to trace, as for SimulationTrace
+        :param block: the hardware block being traced
+        :param buffer_size: the size of the write buffer when file is a path
+        """
+        names = sorted(SimulationTrace(wirevector_subset, block).trace, key=_trace_sort_key)
+        if not names:
+            raise PyrtlError('error, streaming VCD trace needs at least 1 signal to track')
+        block = working_block(block)
+        self._wires = [block.wirevector_by_name[name] for name in names]
+        self._names = names
+        self._last = [None] * len(names)
+        self.trace = _LatestValues(names, self._last)
+        self._time = 0
+
+        if isinstance(file, six.string_types):
+            self._file = io.open(file, 'w', buffering=buffer_size, encoding='utf-8')
+            self._owns_file = True
+        else:
+            self._file = file
+            self._owns_file = False
+
+        self._formats = []
+        lines = ['$timescale 1ns $end', '$scope module logic $end']
+        for i, w in enumerate(self._wires):
+            code = self._code(i)
+            lines.append('$var wire %d %s %s $end' % (w.bitwidth, code, w.name))
+            self._formats.append(('{:d}' + code) if w.bitwidth == 1 else ('b{:b} ' + code))
+        lines.extend(['$upscope $end', '$enddefinitions $end', ''])
+        self._file.write('\n'.join(lines))
+
+    @staticmethod
+    def _code(i):
+        """ The i-th VCD identifier code (made of the printable ASCII characters). """
+        code = chr(33 + i % 94)
+        while i >= 94:
+            i = i // 94 - 1
+            code += chr(33 + i % 94)
+        return code
+
+    def __len__(self):
+        """ Return the number of cycles written so far. """
+        return self._time
+
+    def _write_step(self, values):
+        last = self._last
+        changes = []
+        for i, value in enumerate(values):
+            if value != last[i]:
+                last[i] = value
+                changes.append(self._formats[i].format(value))
+        if self._time == 0:
+            self._file.write('#0\n$dumpvars\n%s\n$end\n' % '\n'.join(changes))
+        elif changes:
+            self._file.write('#%d\n%s\n' % (self._time, '\n'.join(changes)))
+        self._time += 1
+
+    def add_step(self, value_map):
+        """ Write the values of the traced wires in value_map as the next cycle. """
+        self._write_step([value_map[w] for w in self._wires])
+
+    def add_fast_step(self, fastsim):
+        """ Write the fastsim context as the next cycle. """
+        context = fastsim.context
+        self._write_step([context[name] for name in self._names])
+
+    def add_fast_steps(self, value_lists):
+        """ Write many cycles at once from a map of {name: [value for each cycle]}. """
+        for values in zip(*[value_lists[name] for name in self._names]):
+            self._write_step(values)
+
+    def close(self):
+        """ Finish the VCD file (and close it if it was opened from a path). """
+        if self._file is None:
+            return
+        self._file.write('#%d\n' % self._time)
+        if self._owns_file:
+            self._file.close()
+        else:
+            self._file.flush()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _LatestValues(collections.Mapping):
+    """ {name: value} of the traced wires in the last cycle written by a StreamingVCDTrace. """
+
+    def __init__(self, names, values):
+        self._index = {name: i for i, name in enumerate(names)}
+        self._values = values
+
+    def __getitem__(self, name):
+        return self._values[self._index[name]]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
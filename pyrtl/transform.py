@@ -13,7 +13,7 @@ def net_transform(transform_func, block=None):
         for net in block.logic.copy():
             keep_orig_net = transform_func(net)
             if not keep_orig_net:
-                block.logic.remove(net)
+                block.remove_net(net)
 
 
 def wire_transform(transform_func, select_types=WireVector,
@@ -49,7 +49,7 @@ def replace_wire(orig_wire, new_src, new_dst, block=None):
                         op=net.op, op_param=net.op_param, args=net.args,
                         dests=tuple(new_src if w is orig_wire else w for w in net.dests))
                     block.add_net(new_net)
-                    block.logic.remove(net)
+                    block.remove_net(net)
                     break
 
     if new_dst is not orig_wire:
@@ -60,7 +60,7 @@ def replace_wire(orig_wire, new_src, new_dst, block=None):
                         op=net.op, op_param=net.op_param, dests=net.dests,
                         args=tuple(new_src if w is orig_wire else w for w in net.args))
                     block.add_net(new_net)
-                    block.logic.remove(net)
+                    block.remove_net(net)
 
     if new_dst is not orig_wire and new_src is not orig_wire:
         block.remove_wirevector(orig_wire)
@@ -87,7 +87,7 @@ def replace_wire_fast(orig_wire, new_src, new_dst, src_nets, dst_nets, block=Non
                 del dst_nets[arg]
         if len(net_.dests) == 1:
             del src_nets[net_.dests[0]]
-        block.logic.remove(net_)
+        block.remove_net(net_)
 
     def add_net(net_):
         for arg in set(net_.args):
@@ -42,6 +42,12 @@ class WireVector(object):
     # Each class inheriting from WireVector should overload accordingly
     _code = 'W'
 
+    # synthesis creates a wire for every bit, so wires keep their attributes in slots.
+    # A __dict__ is only made for the wires which are given custom attributes by the
+    # user.  Each class inheriting from WireVector should declare its attributes too.
+    __slots__ = ('_name', '_block', 'bitwidth', 'init_call_stack', '_bitmask',
+                 '__dict__', '__weakref__')
+
     def __init__(self, bitwidth=None, name=None, block=None):
         """ Construct a generic WireVector
 
@@ -145,6 +151,9 @@ class WireVector(object):
         elif op in ['<', '>', '=']:
             resultlen = 1
 
+        existing = working_block()._existing_result(op, None, (a, b))
+        if existing is not None:
+            return existing
         s = WireVector(bitwidth=resultlen)
         net = LogicNet(
             op=op,
@@ -295,6 +304,9 @@ class WireVector(object):
         Creates LogicNets that inverts a wire
         :return Wirevector: a result wire for the operation
         """
+        existing = working_block()._existing_result('~', None, (self,))
+        if existing is not None:
+            return existing
         outwire = WireVector(bitwidth=len(self))
         net = LogicNet(
             op='~',
@@ -318,6 +330,9 @@ class WireVector(object):
             selectednums = tuple(allindex[item])
         if not selectednums:
             raise PyrtlError('selection %s must have at least select one wire' % str(item))
+        existing = working_block()._existing_result('s', selectednums, (self,))
+        if existing is not None:
+            return existing
         outwire = WireVector(bitwidth=len(selectednums))
         net = LogicNet(
             op='s',
@@ -370,9 +385,11 @@ class WireVector(object):
     @property
     def bitmask(self):
         """ Return an integer appropriate as a bitmask for this wirevector. """
-        if "_bitmask" not in self.__dict__:
+        try:
+            return self._bitmask
+        except AttributeError:
             self._bitmask = (1 << len(self)) - 1
-        return self._bitmask
+            return self._bitmask
 
     def sign_extended(self, bitwidth):
         """ Return a sign extended wirevector derived from self """
@@ -413,6 +430,7 @@ class WireVector(object):
 class Input(WireVector):
     """ A WireVector type denoting inputs to a block (no writers) """
     _code = 'I'
+    __slots__ = ()
 
     def __init__(self, bitwidth=None, name=None, block=None):
         super(Input, self).__init__(bitwidth=bitwidth, name=name, block=block)
@@ -440,6 +458,7 @@ class Output(WireVector):
     them will throw an error.
     """
     _code = 'O'
+    __slots__ = ()
 
     def __init__(self, bitwidth=None, name=None, block=None):
         super(Output, self).__init__(bitwidth, name, block)
@@ -456,6 +475,7 @@ class Const(WireVector):
     to a two's complement representation of the specified bitwidth."""
 
     _code = 'C'
+    __slots__ = ('val',)
 
     def __init__(self, val, bitwidth=None, block=None):
         """ Construct a constant implementation at initialization
@@ -579,6 +599,7 @@ class Register(WireVector):
     to specify a counter it would look like: "a.next <<= a + 1"
     """
     _code = 'R'
+    __slots__ = ('reg_in',)
 
     # When the register is called as such:  r.next <<= foo
     # the sequence of actions that happens is:
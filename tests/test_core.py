@@ -95,6 +95,229 @@ class TestBlock(unittest.TestCase):
         for net in block.logic:
             print(net)
 
+    def test_iteration_order_cached_until_change(self):
+        a = pyrtl.Input(bitwidth=2, name='a')
+        b = pyrtl.Output(bitwidth=2, name='b')
+        b <<= ~a
+        block = pyrtl.working_block()
+        order = list(block)
+        cached = block._cache['topological_order']
+        self.assertEqual(list(block), order)
+        self.assertIs(block._cache['topological_order'], cached)
+
+        c = pyrtl.Output(bitwidth=2, name='c')
+        c <<= a
+        new_order = list(block)
+        self.assertEqual(len(new_order), len(order) + 1)
+        self.assertIn(pyrtl.LogicNet('w', None, (a,), (c,)), new_order)
+
+        block.remove_net(pyrtl.LogicNet('w', None, (a,), (c,)))
+        self.assertEqual(set(block), set(order))
+
+    def test_replacing_logic_invalidates_cache(self):
+        a = pyrtl.Input(bitwidth=2, name='a')
+        b = pyrtl.Output(bitwidth=2, name='b')
+        b <<= ~a
+        block = pyrtl.working_block()
+        self.assertEqual(len(list(block)), 2)
+        block.logic = set(net for net in block.logic if net.op == '~')
+        self.assertEqual([net.op for net in block], ['~'])
+
+    def test_subsets_follow_changes(self):
+        a = pyrtl.Input(bitwidth=2, name='a')
+        r = pyrtl.Register(bitwidth=2, name='r')
+        o = pyrtl.Output(bitwidth=2, name='o')
+        r.next <<= a
+        o <<= r & a
+        block = pyrtl.working_block()
+        self.assertEqual(block.wirevector_subset(pyrtl.Input), {a})
+        self.assertEqual(block.wirevector_subset((pyrtl.Input, pyrtl.Output)), {a, o})
+        self.assertEqual(block.wirevector_subset(exclude=pyrtl.Input),
+                         block.wirevector_set - {a})
+        self.assertEqual(len(block.logic_subset('r&')), 2)
+        inputs = block.wirevector_subset(pyrtl.Input)
+        inputs.add(o)
+        self.assertEqual(block.wirevector_subset(pyrtl.Input), {a})
+        ands = block.logic_subset('&')
+        ands.pop()
+        self.assertEqual(len(block.logic_subset('&')), 1)
+        self.assertIs(block.logic_subset(), block.logic)
+
+        b = pyrtl.Input(bitwidth=2, name='b')
+        self.assertEqual(block.wirevector_subset(pyrtl.Input), {a, b})
+        block.remove_wirevector(b)
+        self.assertEqual(block.wirevector_subset(pyrtl.Input), {a})
+
+        and_net = next(iter(block.logic_subset('&')))
+        block.remove_net(and_net)
+        self.assertEqual(block.logic_subset('&'), set())
+        block.logic = set(block.logic) | {and_net}
+        self.assertEqual(block.logic_subset('&'), {and_net})
+
+    def test_in_place_changes_of_the_same_size(self):
+        a = pyrtl.Input(bitwidth=2, name='a')
+        o = pyrtl.Output(bitwidth=2, name='o')
+        o <<= ~a
+        block = pyrtl.working_block()
+        not_net = next(iter(block.logic_subset('~')))
+        self.assertEqual(block.logic_subset('&'), set())
+        and_net = pyrtl.LogicNet('&', None, (a, a), not_net.dests)
+        block.logic.remove(not_net)
+        block.logic.add(and_net)
+        self.assertEqual(block.logic_subset('~'), set())
+        self.assertEqual(block.logic_subset('&'), {and_net})
+        self.assertEqual(block.net_connections()[0][not_net.dests[0]], and_net)
+
+        b = pyrtl.Input(bitwidth=2, name='b')
+        self.assertEqual(block.wirevector_subset(pyrtl.Input), {a, b})
+        block.wirevector_set -= {b}
+        block.wirevector_set |= {pyrtl.Const(1, bitwidth=2, block=pyrtl.Block())}
+        self.assertEqual(block.wirevector_subset(pyrtl.Input), {a})
+
+        # copies are not part of the block
+        nets = block.logic.copy()
+        nets -= {and_net}
+        nets = block.logic - {and_net}
+        nets.add(not_net)
+        self.assertEqual(block.logic_subset('&'), {and_net})
+        self.assertEqual(block.logic_subset('~'), set())
+
+    def test_net_connections_returns_copies(self):
+        a = pyrtl.Input(bitwidth=2, name='a')
+        b = pyrtl.Output(bitwidth=2, name='b')
+        b <<= ~a
+        block = pyrtl.working_block()
+        src, dst = block.net_connections()
+        del src[b]
+        dst[a].append(None)
+        src, dst = block.net_connections()
+        self.assertIn(b, src)
+        self.assertEqual(len(dst[a]), 1)
+
+
+class TestCompactBlock(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.block = pyrtl.CompactBlock()
+        with pyrtl.set_working_block(self.block):
+            a = pyrtl.Input(bitwidth=3, name='a')
+            r = pyrtl.Register(bitwidth=3, name='r')
+            o = pyrtl.Output(bitwidth=4, name='o')
+            r.next <<= a & r
+            o <<= pyrtl.concat(a[0], r)
+
+    def test_logic_acts_as_set(self):
+        nets = set(self.block.logic)
+        self.assertEqual(len(self.block.logic), len(nets))
+        for net in nets:
+            self.assertIn(net, self.block.logic)
+            self.assertIsInstance(net, pyrtl.LogicNet)
+        self.assertEqual(self.block.logic, nets)
+        self.assertEqual(self.block.logic.copy(), nets)
+        self.assertEqual(self.block.logic - nets, set())
+
+    def test_add_and_remove_nets(self):
+        net, = self.block.logic_subset('&')
+        self.block.add_net(net)  # adding it again changes nothing
+        self.assertEqual(len(self.block.logic_subset('&')), 1)
+        self.block.remove_net(net)
+        self.assertNotIn(net, self.block.logic)
+        self.assertEqual(len(self.block.logic_subset('&')), 0)
+        self.block.add_net(net)
+        self.assertIn(net, self.block.logic)
+        self.block.sanity_check()
+
+    def test_replace_logic(self):
+        nets = set(self.block.logic)
+        self.block.logic = set()
+        self.assertEqual(len(self.block.logic), 0)
+        self.block.logic = nets
+        self.assertEqual(self.block.logic, nets)
+        self.block.sanity_check()
+
+    def test_many_removals(self):
+        a = self.block.get_wirevector_by_name('a')
+        nets = [pyrtl.LogicNet('~', None, (a,), (pyrtl.WireVector(3, block=self.block),))
+                for i in range(3000)]
+        for net in nets:
+            self.block.add_net(net)
+        for net in nets[:2000]:
+            self.block.remove_net(net)
+        self.assertEqual(set(nets[2000:]) <= self.block.logic, True)
+        self.assertEqual(len(self.block.logic), 1000 + 5)
+        # the wires of the removed nets no longer hold a number
+        self.assertLess(len(self.block.logic._wires), 2000)
+        for net in nets[2000:]:
+            self.block.remove_net(net)
+        self.assertEqual(len(self.block.logic), 5)
+        self.assertEqual(len(self.block.logic_subset('~')), 0)
+
+    def test_iteration_order(self):
+        block = pyrtl.Block()
+        block.logic = set(self.block.logic)
+        block.wirevector_set = set(self.block.wirevector_set)
+        order = list(self.block)
+        self.assertEqual(set(order), set(block))
+        seen = set(self.block.wirevector_subset((pyrtl.Input, pyrtl.Const, pyrtl.Register)))
+        for net in order:
+            self.assertTrue(all(arg in seen for arg in net.args))
+            seen.update(net.dests)
+        # the nets are built once and reused until the block changes
+        self.assertTrue(all(a is b for a, b in zip(order, self.block)))
+        self.block.keep_built_nets = False
+        self.assertEqual(list(self.block), order)
+
+    def test_simulation(self):
+        sim_trace = pyrtl.SimulationTrace(block=self.block)
+        sim = pyrtl.Simulation(tracer=sim_trace, block=self.block)
+        sim.step_multiple({'a': [7, 5, 3]})
+        self.assertEqual(sim_trace.trace['o'], [8, 8, 8])
+        self.assertEqual(sim_trace.trace['r'], [0, 0, 0])
+
+
+class TestStructuralHashing(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.block = pyrtl.working_block()
+        self.a = pyrtl.Input(bitwidth=4, name='a')
+        self.b = pyrtl.Input(bitwidth=4, name='b')
+
+    def test_off_by_default(self):
+        self.assertIsNot(self.a & self.b, self.a & self.b)
+
+    def test_identical_nets_reused(self):
+        self.block.structural_hashing = True
+        a, b = self.a, self.b
+        self.assertIs(a & b, a & b)
+        self.assertIs(a + b, b + a)
+        self.assertIsNot(a - b, b - a)
+        self.assertIs(~a, ~a)
+        self.assertIs(a[1:3], a[1:3])
+        self.assertIsNot(a[1:3], a[0:2])
+        self.assertIs(pyrtl.concat(a, b), pyrtl.concat(a, b))
+        self.assertIsNot(pyrtl.concat(a, b), pyrtl.concat(b, a))
+        self.assertIs(pyrtl.select(a[0], a, b), pyrtl.select(a[0], a, b))
+        self.assertEqual(len(self.block.logic), 11)
+        self.block.sanity_check()
+
+    def test_removed_net_not_reused(self):
+        self.block.structural_hashing = True
+        c = self.a ^ self.b
+        net, = self.block.logic_subset('^')
+        self.block.remove_net(net)
+        self.block.remove_wirevector(c)
+        self.assertIsNot(self.a ^ self.b, c)
+
+    def test_simulation_unchanged(self):
+        from pyrtl.rtllib import multipliers
+        self.block.structural_hashing = True
+        o = pyrtl.Output(bitwidth=8, name='o')
+        o <<= multipliers.tree_multiplier(self.a, self.b)
+        sim_trace = pyrtl.SimulationTrace()
+        sim = pyrtl.Simulation(tracer=sim_trace)
+        sim.step_multiple({'a': [3, 15, 7], 'b': [5, 15, 0]})
+        self.assertEqual(sim_trace.trace['o'], [15, 225, 0])
+
 
 class TestSetWorkingBlock(unittest.TestCase):
     def setUp(self):
@@ -273,7 +496,62 @@ class TestAsGraph(unittest.TestCase):
 
 class TestSanityCheck(unittest.TestCase):
     # TODO: We need to test all of sanity check
-    pass
+    def setUp(self):
+        pyrtl.reset_working_block()
+        a = pyrtl.Input(bitwidth=3, name='a')
+        b = pyrtl.Output(bitwidth=3, name='b')
+        b <<= a + 1
+        self.block = pyrtl.working_block()
+        self.block.sanity_check()
+
+    def test_incremental_check_passes(self):
+        c = pyrtl.Output(bitwidth=4, name='c')
+        c <<= self.block.get_wirevector_by_name('a') * 2
+        self.block.sanity_check()
+        self.block.sanity_check(full=True)
+
+    def test_incremental_check_finds_undriven_wire(self):
+        w = pyrtl.WireVector(bitwidth=3, name='w')
+        c = pyrtl.Output(bitwidth=3, name='c')
+        c <<= w
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.block.sanity_check()
+
+    def test_incremental_check_finds_unconnected_wire(self):
+        pyrtl.WireVector(bitwidth=3, name='w')
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.block.sanity_check()
+
+    def test_incremental_check_finds_multiple_drivers(self):
+        b = self.block.get_wirevector_by_name('b')
+        a = self.block.get_wirevector_by_name('a')
+        self.block.add_net(pyrtl.LogicNet('w', None, (a,), (b,)))
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.block.sanity_check()
+
+    def test_incremental_check_finds_duplicate_names(self):
+        a = self.block.get_wirevector_by_name('a')
+        dup = pyrtl.Output(bitwidth=3, name='dup')
+        dup <<= a
+        dup.name = 'b'
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.block.sanity_check()
+
+    def test_incremental_check_after_removal(self):
+        b = self.block.get_wirevector_by_name('b')
+        net, = self.block.logic_subset('w')
+        self.block.remove_net(net)
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.block.sanity_check()
+        self.block.remove_wirevector(b)
+        self.block.sanity_check(full=True)
+
+    def test_untracked_change_gets_full_check(self):
+        b = self.block.get_wirevector_by_name('b')
+        a = self.block.get_wirevector_by_name('a')
+        self.block.logic = self.block.logic | {pyrtl.LogicNet('w', None, (a,), (b,))}
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.block.sanity_check()
 
 
 class TestLogicNets(unittest.TestCase):
@@ -16,8 +16,8 @@ class TestSynthesis(unittest.TestCase):
         self.output = pyrtl.Output(bitwidth=self.bitwidth, name='r')
         self.output <<= self.r
 
-    def check_trace(self, correct_string):
-        pyrtl.synthesize()
+    def check_trace(self, correct_string, compact=False):
+        pyrtl.synthesize(compact=compact)
         sim_trace = pyrtl.SimulationTrace()
         sim = pyrtl.Simulation(tracer=sim_trace)
         for i in range(8):
@@ -64,6 +64,11 @@ class TestSynthesis(unittest.TestCase):
         self.r.next <<= pyrtl.mux(self.r, 4, 3, 1, 7, 2, 6, 0, 5)
         self.check_trace('r 04213756\n')
 
+    def test_compact_synthesis(self):
+        self.r.next <<= self.r + pyrtl.Const(2, bitwidth=self.bitwidth)
+        self.check_trace('r 02460246\n', compact=True)
+        self.assertIsInstance(pyrtl.working_block(), pyrtl.CompactPostSynthBlock)
+
 
 class TestMultiplierSynthesis(unittest.TestCase):
     def setUp(self):
@@ -170,6 +175,173 @@ class TestOptimization(NetWireNumTestCases):
         self.assert_num_wires(6, block)
 
 
+class TestDuplicateNetRemoval(NetWireNumTestCases):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(bitwidth=1, name='a')
+        self.b = pyrtl.Input(bitwidth=1, name='b')
+        self.o1 = pyrtl.Output(bitwidth=1, name='o1')
+        self.o2 = pyrtl.Output(bitwidth=1, name='o2')
+
+    def check_outputs(self):
+        sim_trace = pyrtl.SimulationTrace()
+        sim = pyrtl.Simulation(tracer=sim_trace)
+        sim.step_multiple({'a': [0, 0, 1, 1], 'b': [0, 1, 0, 1]})
+        return sim_trace.trace['o1'], sim_trace.trace['o2']
+
+    def test_commutative_duplicate(self):
+        self.o1 <<= self.a & self.b
+        self.o2 <<= self.b & self.a
+        removed = pyrtl.passes._remove_duplicate_nets(pyrtl.working_block())
+        self.assertEqual(removed, 1)
+        self.num_net_of_type('&', 1)
+        pyrtl.working_block().sanity_check()
+        self.assertEqual(self.check_outputs(), ([0, 0, 0, 1], [0, 0, 0, 1]))
+
+    def test_non_commutative_kept(self):
+        self.o1 <<= self.a < self.b
+        self.o2 <<= self.b < self.a
+        self.assertEqual(pyrtl.passes._remove_duplicate_nets(pyrtl.working_block()), 0)
+        self.num_net_of_type('<', 2)
+
+    def test_duplicates_found_after_merging(self):
+        self.o1 <<= ~(self.a ^ self.b)
+        self.o2 <<= ~(self.a ^ self.b)
+        self.assertEqual(pyrtl.passes._remove_duplicate_nets(pyrtl.working_block()), 2)
+        self.num_net_of_type('^', 1)
+        self.num_net_of_type('~', 1)
+        self.assertEqual(self.check_outputs(), ([1, 0, 0, 1], [1, 0, 0, 1]))
+
+    def test_equal_consts_merged(self):
+        self.o1 <<= self.a | pyrtl.Const(1)
+        self.o2 <<= self.a | pyrtl.Const(1)
+        self.assertEqual(pyrtl.passes._remove_duplicate_nets(pyrtl.working_block()), 1)
+        self.num_wire_of_type(Const, 1)
+        pyrtl.working_block().sanity_check()
+
+    def test_optimize_flag(self):
+        self.o1 <<= (self.a & self.b) | self.a
+        self.o2 <<= (self.b & self.a) | self.a
+        pyrtl.synthesize()
+        pyrtl.optimize()
+        nets = len(pyrtl.working_block().logic)
+        pyrtl.reset_working_block()
+        self.setUp()
+        self.o1 <<= (self.a & self.b) | self.a
+        self.o2 <<= (self.b & self.a) | self.a
+        pyrtl.synthesize()
+        pyrtl.optimize(remove_duplicate_nets=True)
+        self.assert_num_net(nets - 2)
+        self.assertEqual(self.check_outputs(), ([0, 0, 1, 1], [0, 0, 1, 1]))
+
+
+class TestSimplify(NetWireNumTestCases):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(bitwidth=4, name='a')
+        self.b = pyrtl.Input(bitwidth=4, name='b')
+        self.o = pyrtl.Output(name='o')
+
+    def check_same_results(self, inputs):
+        results = []
+        for block in (pyrtl.working_block(), pyrtl.simplify(update_working_block=False)):
+            sim_trace = pyrtl.SimulationTrace(block=block)
+            sim = pyrtl.Simulation(tracer=sim_trace, block=block)
+            sim.step_multiple(inputs)
+            results.append(sim_trace.trace['o'])
+        self.assertEqual(results[0], results[1])
+        return pyrtl.working_block()
+
+    def test_constants_folded(self):
+        self.o <<= (pyrtl.Const(3) + pyrtl.Const(4)) * pyrtl.Const(2)
+        self.check_same_results({'a': [0], 'b': [0]})
+        self.assert_num_net(1)
+        self.num_net_of_type('w', 1)
+
+    def test_multiply_by_power_of_two(self):
+        self.o <<= self.a * 4
+        block = self.check_same_results({'a': list(range(16)), 'b': [0] * 16})
+        self.num_net_of_type('*', 0, block)
+
+    def test_add_of_zero(self):
+        self.o <<= (self.a + 0) ^ self.b
+        block = self.check_same_results({'a': [1, 7, 15], 'b': [2, 3, 15]})
+        self.num_net_of_type('+', 0, block)
+
+    def test_logic_identities(self):
+        self.o <<= ((self.a & 15) | 0) ^ ~~self.b ^ (self.b & self.b)
+        block = self.check_same_results({'a': [1, 7, 15], 'b': [2, 3, 15]})
+        self.num_net_of_type('&', 0, block)
+        self.num_net_of_type('|', 0, block)
+        self.num_net_of_type('~', 0, block)
+
+    def test_readers_simplified_after_their_args(self):
+        self.o <<= ~(self.a ^ pyrtl.Const(15, bitwidth=4))
+        block = self.check_same_results({'a': list(range(16)), 'b': [0] * 16})
+        self.num_net_of_type('~', 0, block)
+        self.num_net_of_type('^', 0, block)
+
+    def test_mux_with_constant_select(self):
+        self.o <<= pyrtl.select(pyrtl.Const(1), self.a, self.b) + 1
+        block = self.check_same_results({'a': [1, 7, 15], 'b': [2, 3, 15]})
+        self.num_net_of_type('x', 0, block)
+
+    def test_selects_of_concats(self):
+        c = pyrtl.concat(pyrtl.Const(5, bitwidth=3), self.a, pyrtl.Const(1, bitwidth=1))
+        self.o <<= pyrtl.concat(c[5:8], c[1:5][1:3])
+        block = self.check_same_results({'a': list(range(16)), 'b': [0] * 16})
+        self.assertEqual(len(block.logic_subset('s')), 1)
+
+    def test_registers_and_memories_kept(self):
+        r = pyrtl.Register(bitwidth=4, name='r')
+        mem = pyrtl.MemBlock(bitwidth=4, addrwidth=2)
+        r.next <<= r + (self.a * 0)
+        mem[self.b[0:2]] <<= r | self.a
+        self.o <<= mem[r[0:2]]
+        block = self.check_same_results({'a': [1, 2, 3, 4, 5], 'b': [0, 1, 2, 3, 0]})
+        self.num_net_of_type('r', 1, block)
+        self.num_net_of_type('m', 1, block)
+        self.num_net_of_type('@', 1, block)
+        block.sanity_check()
+
+
+class TestDeadLogicRemoval(NetWireNumTestCases):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(bitwidth=1, name='a')
+        self.o = pyrtl.Output(bitwidth=1, name='o')
+        self.counter = pyrtl.Register(bitwidth=1, name='counter')
+        self.counter.next <<= ~self.counter ^ self.a  # never observed
+        shift = pyrtl.Register(bitwidth=1, name='shift')
+        shift.next <<= self.a
+        self.o <<= shift & self.a
+        unused = pyrtl.WireVector(bitwidth=1, name='unused')
+        unused <<= self.a | shift
+
+    def test_registers_kept(self):
+        pyrtl.optimize(remove_unobserved_registers=False)
+        self.num_net_of_type('r', 2)
+        self.num_net_of_type('|', 0)
+        self.assertIn('counter', [w.name for w in pyrtl.working_block().wirevector_set])
+
+    def test_unobserved_registers_removed(self):
+        pyrtl.optimize()
+        self.num_net_of_type('r', 1)
+        self.num_net_of_type('~', 0)
+        self.num_net_of_type('^', 0)
+        self.num_net_of_type('|', 0)
+        names = [w.name for w in pyrtl.working_block().wirevector_set]
+        self.assertNotIn('counter', names)
+        self.assertIn('shift', names)
+
+    def test_assertions_kept(self):
+        check = pyrtl.WireVector(bitwidth=1, name='check')
+        check <<= self.a | ~self.a
+        pyrtl.rtl_assert(check, Exception('failed'))
+        pyrtl.optimize(remove_unobserved_registers=True)
+        self.num_net_of_type('|', 1)
+
+
 class TestConstFolding(NetWireNumTestCases):
 
     def test_basic_one_var_op_1(self):
@@ -187,6 +359,21 @@ class TestConstFolding(NetWireNumTestCases):
         self.assertEqual(len(block.wirevector_set), 2)
         self.num_wire_of_type(Const, 1, block)
 
+    def test_long_chain_folded(self):
+        ins = [pyrtl.Input(bitwidth=1) for i in range(8)]
+        outwire = pyrtl.Output()
+        x = pyrtl.Const(0, 1)
+        for i in range(50):
+            x = (x & ins[i % 8]) | (ins[(i + 3) % 8] & x)
+        outwire <<= x
+        pyrtl.synthesize()
+        pyrtl.optimize()
+
+        block = pyrtl.working_block()
+        self.num_net_of_type('w', 1, block)
+        self.assertEqual(len(block.logic), 1)
+        self.num_wire_of_type(Const, 1, block)
+
     def test_adv_one_var_op_1(self):
         constwire = pyrtl.Const(0, 1)
         outwire = pyrtl.Output()
@@ -50,11 +50,30 @@ class TraceWithBasicOpsBase(unittest.TestCase):
         self.r.next <<= self.r - pyrtl.Const(1, bitwidth=self.bitwidth)
         self.check_trace('r 07654321\n')
 
+    def test_negative_difference_simulation(self):
+        pyrtl.reset_working_block()
+        a, b = pyrtl.Input(3, 'a'), pyrtl.Input(3, 'b')
+        diff = pyrtl.Output(name='diff')
+        diff <<= a - b
+        sim = self.sim()
+        sim.step({a: 1, b: 2})
+        self.assertEqual(sim.inspect(diff), 15)
+
     def test_multiply_simulation(self):
         self.r.next <<= self.r * pyrtl.Const(2, bitwidth=self.bitwidth) + \
             pyrtl.Const(1, bitwidth=self.bitwidth)
         self.check_trace('r 01377777\n')
 
+    def test_reversed_select_simulation(self):
+        self.r.next <<= self.r[::-1] + 1
+        self.check_trace('r 01564237\n')
+
+    def test_register_swap_simulation(self):
+        s = pyrtl.Register(bitwidth=self.bitwidth, name='s')
+        self.r.next <<= s + 1
+        s.next <<= self.r
+        self.check_trace('r 01122334\ns 00112233\n')
+
     def test_const_nobitwidth_simulation(self):
         self.r.next <<= self.r - pyrtl.Const(1)
         self.check_trace('r 07654321\n')
@@ -156,6 +175,84 @@ class TraceWithAdderBase(unittest.TestCase):
         self.assertEqual(sim.inspect(self.r), 6)
 
 
+class TraceStorageBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+
+    def test_compact_columns(self):
+        a = pyrtl.Input(1, 'a')
+        b = pyrtl.Input(12, 'b')
+        wide = pyrtl.Register(100, 'wide')
+        wide.next <<= pyrtl.concat(wide[0:99], a)
+        sim_trace = pyrtl.SimulationTrace()
+        sim = self.sim(tracer=sim_trace)
+        for cycle in range(70):
+            sim.step({a: 1, b: cycle * 50})
+
+        trace = sim_trace.trace
+        self.assertEqual(trace['a']._values.itemsize, 1)
+        self.assertEqual(trace['b']._values.itemsize, 2)
+        self.assertIsInstance(trace['wide']._values, list)
+        self.assertEqual(trace['b'], [cycle * 50 for cycle in range(70)])
+        self.assertEqual(trace['b'][2:4], [100, 150])
+        self.assertNotEqual(trace['b'], [])
+        self.assertEqual(trace['wide'][-1], 2**69 - 1)
+        self.assertEqual(repr(trace['a']), repr([1] * 70))
+
+
+class TraceWindowBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.go = pyrtl.Input(1, 'go')
+        self.count = pyrtl.Register(16, 'count')
+        self.count.next <<= self.count + self.go
+
+    def run_trace(self, cycles, multiple=False, **kwargs):
+        sim_trace = pyrtl.SimulationTrace(**kwargs)
+        sim = self.sim(tracer=sim_trace)
+        if multiple:
+            sim.step_multiple({self.go: [1] * cycles})
+        else:
+            for cycle in range(cycles):
+                sim.step({self.go: 1})
+        return sim_trace
+
+    def test_ring_buffer(self):
+        for multiple in (False, True):
+            sim_trace = self.run_trace(300, multiple, depth=5)
+            self.assertEqual(sim_trace.trace['count'], [295, 296, 297, 298, 299])
+            self.assertEqual(len(sim_trace), 5)
+            self.assertEqual(sim_trace.start_cycle, 295)
+            self.assertIsNone(sim_trace.trigger_cycle)
+
+    def test_trigger_with_pre_and_post_depth(self):
+        for multiple in (False, True):
+            sim_trace = self.run_trace(300, multiple, depth=3, post_trigger=2,
+                                       trigger={'count': 100})
+            self.assertEqual(sim_trace.trace['count'], [97, 98, 99, 100, 101, 102])
+            self.assertEqual(sim_trace.trigger_cycle, 100)
+            self.assertEqual(sim_trace.start_cycle, 97)
+
+    def test_trigger_and_stop(self):
+        for multiple in (False, True):
+            sim_trace = self.run_trace(50, multiple, trigger=lambda v: v['count'] == 10,
+                                       stop={'count': 13})
+            self.assertEqual(sim_trace.trace['count'], [10, 11, 12, 13])
+            self.assertEqual(sim_trace.trace['go'], [1, 1, 1, 1])
+            output = io.StringIO()
+            sim_trace.print_vcd(output)
+            self.assertIn('#0\nb1010 count\nb1 go\n', output.getvalue())
+
+    def test_trigger_never_fires(self):
+        sim_trace = self.run_trace(20, depth=4, trigger={'count': 1000})
+        self.assertEqual(sim_trace.trace['count'], [16, 17, 18, 19])  # still armed
+        self.assertIsNone(sim_trace.trigger_cycle)
+
+    def test_trigger_on_untraced_wire(self):
+        with self.assertRaises(pyrtl.PyrtlError):
+            pyrtl.SimulationTrace(wirevector_subset=[self.go], trigger={'count': 1})
+
+
 class SimulationVCDWithAdderBase(unittest.TestCase):
     def setUp(self):
         pyrtl.reset_working_block()
@@ -220,6 +317,68 @@ b110 r
         self.assertEqual(self.VCD_OUTPUT, test_output.getvalue())
 
 
+class StreamingVCDBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.en = pyrtl.Input(1, 'en')
+        self.r = pyrtl.Register(bitwidth=3, name='r')
+        self.r.next <<= pyrtl.mux(self.en, self.r, self.r + 1)
+
+    VCD_OUTPUT = """$timescale 1ns $end
+$scope module logic $end
+$var wire 1 ! en $end
+$var wire 3 " r $end
+$upscope $end
+$enddefinitions $end
+#0
+$dumpvars
+1!
+b0 "
+$end
+#1
+b1 "
+#2
+0!
+b10 "
+#4
+1!
+#5
+b11 "
+#6
+"""
+
+    def test_streaming_vcd_output(self):
+        enables = [1, 1, 0, 0, 1, 1]
+        for multiple in (False, True):
+            output = io.StringIO()
+            with pyrtl.StreamingVCDTrace(output) as tracer:
+                sim = self.sim(tracer=tracer)
+                if multiple:
+                    if not hasattr(sim, 'step_multiple'):
+                        continue
+                    sim.step_multiple({self.en: enables})
+                else:
+                    for en in enables:
+                        sim.step({self.en: en})
+                self.assertEqual(len(tracer), 6)
+                self.assertEqual(tracer.trace['r'], 3)
+            self.assertEqual(output.getvalue(), self.VCD_OUTPUT)
+
+    def test_streaming_vcd_to_path(self):
+        import os
+        import tempfile
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        tracer = pyrtl.StreamingVCDTrace(path)
+        sim = self.sim(tracer=tracer)
+        for en in [1, 1, 0, 0, 1, 1]:
+            sim.step({self.en: en})
+        tracer.close()
+        with io.open(path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), self.VCD_OUTPUT)
+
+
 class SimTraceWithMuxBase(unittest.TestCase):
     def setUp(self):
         pyrtl.reset_working_block()
@@ -460,6 +619,21 @@ class InspectBase(unittest.TestCase):
         # self.assertEqual(sim.inspect('a'), 28)
         self.assertEqual(sim.inspect(b), 28)
 
+    def test_value_copy(self):
+        if self.sim is not pyrtl.Simulation:
+            self.skipTest("only Simulation exposes its values as sim.value")
+        a = pyrtl.Input(8, 'a')
+        b = pyrtl.Output(8, 'b')
+        b <<= a + 1
+        sim = self.sim()
+        sim.step({a: 3})
+        values = sim.value.copy()
+        sim.step({a: 5})
+        self.assertEqual(values[b], 4)
+        self.assertEqual(sim.value[b], 6)
+        values[b] = 0
+        self.assertEqual(sim.value[b], 6)
+
     def test_inspect_mem(self):
         a = pyrtl.Input(8, 'a')
         b = pyrtl.Input(8, 'b')
@@ -474,6 +648,686 @@ class InspectBase(unittest.TestCase):
         else:
             self.assertEqual(sim.inspect_mem(mem), {23: 3})
 
+    def test_inspect_wide_wires(self):
+        a = pyrtl.Input(100, 'a')
+        r = pyrtl.Register(100, 'r')
+        r.next <<= r + a
+        o = pyrtl.Output(100, 'o')
+        o <<= r ^ a
+        low = pyrtl.Output(8, 'low')
+        low <<= a[0:8]
+        big = 2**99 + 0x1ff
+        for multiple in (False, True):
+            sim = self.sim(tracer=pyrtl.SimulationTrace())
+            if multiple:
+                sim.step_multiple({a: [big, 3]})
+            else:
+                sim.step({a: big})
+                sim.step({a: 3})
+            self.assertEqual(sim.inspect(a), 3)
+            self.assertEqual(sim.inspect(r), big)
+            self.assertEqual(sim.inspect(o), big ^ 3)
+            self.assertEqual(sim.inspect(low), 3)
+            self.assertEqual(sim.tracer.trace['o'], [big, big ^ 3])
+
+
+class RtlAssertBase(unittest.TestCase):
+    class FirstException(Exception):
+        pass
+
+    class SecondException(Exception):
+        pass
+
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(4, 'a')
+        pyrtl.rtl_assert(self.a < 10, self.FirstException())
+        pyrtl.rtl_assert(self.a != 3, self.SecondException())
+
+    def test_failing_assertion_is_identified(self):
+        sim = self.sim()
+        sim.step({self.a: 5})
+        with self.assertRaises(self.SecondException):
+            sim.step({self.a: 3})
+        with self.assertRaises(self.FirstException):
+            sim.step({self.a: 12})
+        if hasattr(sim, 'step_multiple'):
+            with self.assertRaises(self.SecondException):
+                sim.step_multiple({self.a: [1, 2, 3, 4]})
+
+    def test_failing_cycle_is_traced_and_counted(self):
+        r = pyrtl.Register(4, 'r')
+        r.next <<= r + 1
+        for multiple in (False, True):
+            sim_trace = pyrtl.SimulationTrace()
+            sim = self.sim(tracer=sim_trace)
+            with self.assertRaises(self.SecondException):
+                if multiple:
+                    sim.step_multiple({self.a: [1, 2, 3, 4, 5]})
+                else:
+                    for value in [1, 2, 3, 4, 5]:
+                        sim.step({self.a: value})
+            self.assertEqual(sim.cycle, 3)
+            self.assertEqual(list(sim_trace.trace['a']), [1, 2, 3])
+            self.assertEqual(list(sim_trace.trace['r']), [0, 1, 2])
+            # the register update of the failing cycle is not lost
+            sim.step({self.a: 4})
+            self.assertEqual(sim.inspect(r), 3)
+
+    def test_passing_cycles_skip_slow_check(self):
+        if self.sim is not pyrtl.FastSimulation:
+            self.skipTest("Only FastSimulation compiles the assertion checks")
+        checks = []
+        original = pyrtl.simulation.check_rtl_assertions
+        pyrtl.simulation.check_rtl_assertions = checks.append
+        try:
+            sim = self.sim()
+            sim.step({self.a: 5})
+            sim.step_multiple({self.a: [1, 2, 4]})
+            self.assertEqual(checks, [])
+            sim.step({self.a: 3})
+            self.assertEqual(checks, [sim])
+        finally:
+            pyrtl.simulation.check_rtl_assertions = original
+
+
+class StepMultipleBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(3, 'a')
+        self.we = pyrtl.Input(1, 'we')
+        self.count = pyrtl.Register(4, 'count')
+        self.count.next <<= self.count + self.a
+        mem = pyrtl.MemBlock(bitwidth=4, addrwidth=3, name='mem')
+        mem[self.a] <<= pyrtl.MemBlock.EnabledWrite(self.count, self.we)
+        self.rd = pyrtl.Output(4, 'rd')
+        self.rd <<= mem[self.a]
+        self.mem = mem
+        self.stimulus = {'a': [1, 2, 3, 1, 2, 3, 7, 0], 'we': [1, 1, 0, 1, 0, 1, 1, 0]}
+
+    def run_with_step(self):
+        trace = pyrtl.SimulationTrace()
+        sim = self.sim(tracer=trace)
+        for cycle in range(8):
+            sim.step({self.a: self.stimulus['a'][cycle], self.we: self.stimulus['we'][cycle]})
+        return sim, trace
+
+    def test_step_multiple_matches_step(self):
+        ref_sim, ref_trace = self.run_with_step()
+        trace = pyrtl.SimulationTrace()
+        sim = self.sim(tracer=trace)
+        sim.step_multiple({self.a: self.stimulus['a'][:3], 'we': self.stimulus['we'][:3]})
+        sim.step_multiple({self.a: self.stimulus['a'][3:], 'we': self.stimulus['we'][3:]})
+        for name in ('a', 'we', 'count', 'rd'):
+            self.assertEqual(list(trace.trace[name]), list(ref_trace.trace[name]))
+        self.assertEqual(sim.inspect(self.count), ref_sim.inspect(self.count))
+        self.assertEqual(sim.inspect(self.rd), ref_sim.inspect(self.rd))
+        self.assertEqual(sim.inspect_mem(self.mem), ref_sim.inspect_mem(self.mem))
+
+    def test_step_multiple_nsteps(self):
+        sim = self.sim()
+        sim.step_multiple(self.stimulus, nsteps=2)
+        self.assertEqual(sim.inspect(self.count), 1)
+        with self.assertRaises(pyrtl.PyrtlError):
+            sim.step_multiple({'a': [1, 2], 'we': [1]})
+
+    def test_step_multiple_assertion(self):
+        class CountTooBig(Exception):
+            pass
+        pyrtl.rtl_assert(self.count < 5, CountTooBig())
+        sim = self.sim()
+        with self.assertRaises(CountTooBig):
+            sim.step_multiple(self.stimulus)
+        self.assertEqual(sim.inspect(self.count), 6)
+
+
+class RunBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(4, 'a')
+        self.b = pyrtl.Input(4, 'b')
+        self.r = pyrtl.Register(5, 'r')
+        self.r.next <<= self.a + self.b
+        self.sum = pyrtl.Output(5, 'sum')
+        self.sum <<= self.a + self.b
+        self.delayed = pyrtl.Output(5, 'delayed')
+        self.delayed <<= self.r
+
+    def test_columns(self):
+        sim = self.sim()
+        result = sim.run({'a': [1, 2, 15], self.b: [3, 4, 15]})
+        self.assertEqual(result, {'sum': [4, 6, 30], 'delayed': [0, 4, 6]})
+        self.assertEqual(sim.cycle, 3)
+
+    def test_array_columns(self):
+        import array
+        result = self.sim().run({'a': array.array('B', [1, 2]), 'b': array.array('B', [3, 4])})
+        self.assertEqual(result['sum'], [4, 6])
+
+    def test_numpy_columns(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("NumPy is not installed")
+        result = self.sim().run({'a': numpy.array([1, 2]), 'b': numpy.array([3, 4])})
+        self.assertEqual(result['sum'], [4, 6])
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.sim().run({'a': numpy.array([1, 16]), 'b': numpy.array([3, 4])})
+
+    def test_generator(self):
+        def stimulus():
+            n = 0
+            while True:
+                yield {'a': n % 16, self.b: 1}
+                n += 1
+        sim = self.sim()
+        result = sim.run(stimulus(), outputs=[self.delayed], nsteps=4)
+        self.assertEqual(result, {'delayed': [0, 1, 2, 3]})
+        self.assertEqual(sim.cycle, 4)
+
+    def test_matches_step(self):
+        sim_trace = pyrtl.SimulationTrace()
+        sim = self.sim(tracer=sim_trace)
+        sim.run({'a': [5, 7], 'b': [9, 1]})
+        output = io.StringIO()
+        sim_trace.print_trace(output)
+        self.assertEqual(output.getvalue(), '      a 57\n      b 91\ndelayed 014\n'
+                                            '      r 014\n    sum 148\n')
+
+    def test_columns_run_in_one_call(self):
+        if self.sim is pyrtl.Simulation:
+            self.skipTest("Simulation runs one cycle at a time")
+        sim_trace = pyrtl.SimulationTrace()
+        sim = self.sim(tracer=sim_trace)
+
+        def not_called(provided_inputs):
+            raise AssertionError('run should not step one cycle at a time')
+        sim._step_inputs = not_called
+        result = sim.run({'a': [1, 2, 3, 4], 'b': [3, 4, 5, 6]}, outputs=['sum', self.r],
+                         nsteps=3)
+        self.assertEqual(result, {'sum': [4, 6, 8], 'r': [0, 4, 6]})
+        self.assertEqual(sim.cycle, 3)
+        self.assertEqual(sim_trace.trace['delayed'], [0, 4, 6])
+        del sim._step_inputs
+        sim.step({self.a: 0, self.b: 0})
+        self.assertEqual(sim.inspect(self.delayed), 8)
+
+    def test_columns_checked_before_running(self):
+        bad_stimuli = [
+            {'a': [1, 16], 'b': [0, 0]},
+            {'a': [1, -1], 'b': [0, 0]},
+            {'a': [1, 'x'], 'b': [0, 0]},
+            {'a': [1, 2], 'b': [0]},
+            {'a': [1]},
+            {'a': [1], 'b': [2], 'sum': [3]},
+        ]
+        for stimulus in bad_stimuli:
+            sim = self.sim()
+            with self.assertRaises(pyrtl.PyrtlError):
+                sim.run(stimulus)
+            self.assertEqual(sim.cycle, 0)
+
+    def test_bad_generator_value(self):
+        sim = self.sim()
+        with self.assertRaises(pyrtl.PyrtlError):
+            sim.run(iter([{'a': 1, 'b': 1}, {'a': 1, 'b': 16}]))
+        self.assertEqual(sim.cycle, 1)
+
+
+class CodeCacheBase(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        pyrtl.reset_working_block()
+        if self.sim not in (pyrtl.FastSimulation, pyrtl.CompiledSimulation):
+            self.skipTest("Only FastSimulation and CompiledSimulation generate code")
+        self.cache_dir = tempfile.mkdtemp()
+        self.old_settings = dict(pyrtl.simulation._code_cache_settings)
+        pyrtl.set_fastsim_code_cache(directory=self.cache_dir)
+        self.r = pyrtl.Register(bitwidth=4, name='r')
+        self.r.next <<= self.r + 3
+
+    def tearDown(self):
+        import shutil
+        if self.sim in (pyrtl.FastSimulation, pyrtl.CompiledSimulation):
+            pyrtl.simulation._code_cache_settings.update(self.old_settings)
+            shutil.rmtree(self.cache_dir)
+
+    def run_counter(self):
+        sim_trace = pyrtl.SimulationTrace()
+        sim = self.sim(tracer=sim_trace)
+        for cycle in range(5):
+            sim.step({})
+        output = io.StringIO()
+        sim_trace.print_trace(output)
+        self.assertEqual(output.getvalue(), 'r 036912\n')
+
+    def test_cache_off_by_default(self):
+        self.assertFalse(self.old_settings['enabled'])
+
+    def test_same_traced_wires_with_other_tracer(self):
+        if self.sim is not pyrtl.FastSimulation:
+            self.skipTest("CompiledSimulation can only record the wires it can inspect")
+        x = pyrtl.WireVector(bitwidth=4, name='x')
+        x <<= self.r + 1
+        o = pyrtl.Output(bitwidth=4, name='o')
+        o <<= self.r
+        # the same wires are traced by run, but x only has a slot in the first one
+        sim = self.sim(tracer=pyrtl.SimulationTrace([x, o]))
+        sim.step_multiple({}, nsteps=3)
+        sim = self.sim(tracer=None)
+        self.assertEqual(sim.run({}, outputs=['x', 'o'], nsteps=3),
+                         {'x': [1, 4, 7], 'o': [0, 3, 6]})
+
+    def test_second_run_skips_code_generation(self):
+        import os
+        self.run_counter()
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        def not_called(sim):
+            raise AssertionError('code should have been loaded from the cache')
+        original = self.sim.compiled
+        self.sim.compiled = not_called
+        try:
+            self.run_counter()
+        finally:
+            self.sim.compiled = original
+
+    def test_cache_disabled(self):
+        import os
+        pyrtl.set_fastsim_code_cache(enabled=False)
+        self.run_counter()
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_lru_eviction(self):
+        import os
+        pyrtl.set_fastsim_code_cache(max_bytes=1)
+        self.run_counter()
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+
+class WideOpsBase(unittest.TestCase):
+    """
+    Checks the ops on wires wider than a machine word
+    """
+
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(100, 'a')
+        self.b = pyrtl.Input(100, 'b')
+        self.values = [(0, 0), (1, (1 << 100) - 1), ((1 << 100) - 1, (1 << 100) - 1),
+                       (0x123456789abcdef0123456789, 0xfedcba9876543210fedcba987),
+                       ((1 << 64) - 1, 1), (1 << 64, 1 << 64)]
+
+    def check_outputs(self, funcs):
+        outs = {}
+        for name, (func, bitwidth) in funcs.items():
+            outs[name] = pyrtl.Output(bitwidth, name)
+            outs[name] <<= func(self.a, self.b)
+        sim_trace = pyrtl.SimulationTrace()
+        sim = self.sim(tracer=sim_trace)
+        sim.step_multiple({'a': [a for a, b in self.values], 'b': [b for a, b in self.values]})
+        for name, (func, bitwidth) in funcs.items():
+            expected = [func(a, b) & ((1 << bitwidth) - 1) for a, b in self.values]
+            self.assertEqual(list(sim_trace.trace[name]), expected, name)
+
+    def test_arithmetic(self):
+        self.check_outputs({
+            'sum': (lambda a, b: a + b, 101),
+            'difference': (lambda a, b: a - b, 100),
+            'product': (lambda a, b: a * b, 200),
+            'low_product': (lambda a, b: (a * b)[:70] if isinstance(a, pyrtl.WireVector)
+                            else a * b, 70),
+        })
+
+    def test_logic_and_comparisons(self):
+        self.check_outputs({
+            'and': (lambda a, b: a & b, 100),
+            'xor': (lambda a, b: a ^ b, 100),
+            'not': (lambda a, b: ~a, 100),
+            'less': (lambda a, b: int(a < b) if isinstance(a, int) else a < b, 1),
+            'equal': (lambda a, b: int(a == b) if isinstance(a, int) else a == b, 1),
+        })
+
+    def test_concat_and_select(self):
+        def concat(a, b):
+            return pyrtl.concat(a, b) if isinstance(a, pyrtl.WireVector) else (a << 100) | b
+
+        def middle(a, b):
+            return a[30:95] if isinstance(a, pyrtl.WireVector) else a >> 30
+
+        def reverse(a, b):
+            if isinstance(a, pyrtl.WireVector):
+                return a[::-1]
+            return int(bin(a)[2:].zfill(100)[::-1], 2)
+
+        self.check_outputs({
+            'concat': (concat, 200),
+            'middle': (middle, 65),
+            'reverse': (reverse, 100),
+        })
+
+    def test_wide_registers_and_memories(self):
+        mem = pyrtl.MemBlock(bitwidth=100, addrwidth=2, name='mem')
+        r = pyrtl.Register(100, 'r')
+        r.next <<= self.a ^ r
+        mem[self.b[:2]] <<= pyrtl.MemBlock.EnabledWrite(self.a, self.b[2])
+        out = pyrtl.Output(100, 'out')
+        out <<= mem[self.b[:2]]
+        sim = self.sim()
+        value = (1 << 99) | (1 << 64) | 5
+        sim.step({self.a: value, self.b: 6})
+        sim.step({self.a: 0, self.b: 2})
+        self.assertEqual(sim.inspect(r), value)
+        self.assertEqual(sim.inspect(out), value)
+        sim.step({self.a: 0, self.b: 2})
+        self.assertEqual(sim.inspect_mem(mem), {2: value})
+
+
+class ParallelSimulationBase(unittest.TestCase):
+    """
+    Checks each lane of a ParallelSimulation against the single lane simulator
+    """
+
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(4, 'a')
+        self.b = pyrtl.Input(4, 'b')
+        self.sel = pyrtl.Input(1, 'sel')
+        self.acc = pyrtl.Register(8, 'acc')
+        mem = pyrtl.MemBlock(bitwidth=4, addrwidth=2, name='mem')
+        mem[self.a[0:2]] <<= self.b
+        self.acc.next <<= pyrtl.mux(self.sel, self.acc + self.a, self.a * self.b)
+        outputs = {
+            'sum': self.a + self.b, 'diff': self.a - self.b, 'lt': self.a < self.b,
+            'gt': self.a > self.b, 'eq': self.a == self.b, 'nand': self.a.nand(self.b),
+            'xor': self.a ^ self.b, 'cat': pyrtl.concat(self.a[1:3], ~self.b),
+            'rd': mem[self.b[2:4]], 'acc_out': self.acc}
+        for name, wire in outputs.items():
+            out = pyrtl.Output(name=name)
+            out <<= wire
+        self.out_names = sorted(outputs)
+
+    def check_lanes(self, block):
+        import random
+        random.seed(8675309)
+        lanes = 7
+        stimulus = [[{'a': random.randrange(16), 'b': random.randrange(16),
+                      'sel': random.randrange(2)} for cycle in range(12)]
+                    for lane in range(lanes)]
+        traces = [pyrtl.SimulationTrace(block=block) for lane in range(lanes)]
+        psim = pyrtl.ParallelSimulation(lanes, tracers=traces, block=block)
+        for cycle in range(12):
+            psim.step([stimulus[lane][cycle] for lane in range(lanes)])
+
+        for lane in range(lanes):
+            ref_trace = pyrtl.SimulationTrace(block=block)
+            sim = self.sim(tracer=ref_trace, block=block)
+            for cycle in range(12):
+                sim.step({block.get_wirevector_by_name(n): v
+                          for n, v in stimulus[lane][cycle].items()})
+            for name in self.out_names:
+                self.assertEqual(list(traces[lane].trace[name]),
+                                 list(ref_trace.trace[name]))
+
+    def test_parallel_matches_single_lane(self):
+        self.check_lanes(pyrtl.working_block())
+
+    def test_parallel_matches_single_lane_synthesized(self):
+        self.check_lanes(pyrtl.synthesize())
+
+    def test_parallel_column_inputs(self):
+        psim = pyrtl.ParallelSimulation(3)
+        psim.step({self.a: [1, 2, 3], self.b: [4, 5, 6], self.sel: [0, 0, 0]})
+        self.assertEqual(psim.inspect(pyrtl.working_block().get_wirevector_by_name('sum')),
+                         [5, 7, 9])
+        with self.assertRaises(pyrtl.PyrtlError):
+            psim.step({self.a: [1, 2, 16], self.b: [4, 5, 6], self.sel: [0, 0, 0]})
+        with self.assertRaises(pyrtl.PyrtlError):
+            psim.step({self.a: [1, 2, 3], self.b: [4, 5, 6]})
+
+    def test_parallel_large_rom(self):
+        pyrtl.reset_working_block()
+        addr = pyrtl.Input(32, 'addr')
+        rom = pyrtl.RomBlock(bitwidth=32, addrwidth=32, romdata=lambda a: a ^ 0x5a5a5a5a)
+        out = pyrtl.Output(32, 'out')
+        out <<= rom[addr]
+        addrs = [0, 7, 2**32 - 1]
+        psim = pyrtl.ParallelSimulation(3)
+        psim.step({addr: addrs})
+        self.assertEqual(psim.inspect(out), [a ^ 0x5a5a5a5a for a in addrs])
+        self.assertEqual(sorted(psim.inspect_mem(rom)[1]), addrs)
+
+
+class EventDrivenBase(unittest.TestCase):
+    """
+    Checks that the event-driven mode of Simulation matches full evaluation
+    """
+
+    def setUp(self):
+        if self.sim is not pyrtl.Simulation:
+            self.skipTest("Only Simulation has an event-driven mode")
+        pyrtl.reset_working_block()
+        self.en = pyrtl.Input(1, 'en')
+        self.a = pyrtl.Input(4, 'a')
+        count = pyrtl.Register(6, 'counter')
+        count.next <<= pyrtl.mux(self.en, count, count + self.a)
+        mem = pyrtl.MemBlock(bitwidth=6, addrwidth=2, name='mem')
+        mem[self.a[0:2]] <<= pyrtl.MemBlock.EnabledWrite(count, self.en)
+        outputs = {'count': count, 'double': count + count, 'rd': mem[2],
+                   'mixed': (count * self.a) ^ mem[self.a[2:4]]}
+        for name, wire in outputs.items():
+            out = pyrtl.Output(name=name)
+            out <<= wire
+        self.out_names = sorted(outputs)
+
+    def run_both(self, stimulus, block=None):
+        full_trace = pyrtl.SimulationTrace(block=block)
+        event_trace = pyrtl.SimulationTrace(block=block)
+        full = self.sim(tracer=full_trace, block=block)
+        event = self.sim(tracer=event_trace, block=block, event_driven=True)
+        for inputs in stimulus:
+            full.step(inputs)
+            event.step(inputs)
+        for name in self.out_names:
+            self.assertEqual(list(event_trace.trace[name]), list(full_trace.trace[name]))
+        return event.activity_stats()
+
+    def test_event_driven_matches_full(self):
+        import random
+        random.seed(1234)
+        stimulus = [{'en': random.randrange(2), 'a': random.randrange(16)}
+                    for cycle in range(40)]
+        self.run_both(stimulus)
+        self.run_both(stimulus, pyrtl.synthesize())
+
+    def test_idle_cycles_are_skipped(self):
+        stimulus = [{'en': 1, 'a': 2}] * 3 + [{'en': 0, 'a': 2}] * 20
+        stats = self.run_both(stimulus)
+        self.assertEqual(stats['cycles'], 23)
+        self.assertLess(stats['activity'], 0.2)
+
+    def test_net_with_two_changed_args_is_evaluated_once(self):
+        pyrtl.reset_working_block()
+        a, b = pyrtl.Input(4, 'a'), pyrtl.Input(4, 'b')
+        total = pyrtl.Output(5, 'total')
+        total <<= a + b
+        self.out_names = ['total']
+        stats = self.run_both([{'a': 1, 'b': 2}, {'a': 3, 'b': 4}])
+        # the first cycle evaluates every net, the second only the adder (and the
+        # net driving the output from it), even though both of its args changed
+        self.assertEqual(stats['evaluations'], stats['nets'] + 2)
+
+    def test_stats_require_event_mode(self):
+        sim = self.sim()
+        with self.assertRaises(pyrtl.PyrtlError):
+            sim.activity_stats()
+
+
+class RunParallelBase(unittest.TestCase):
+    """
+    Checks that run_parallel gives the same traces as running each sequence alone
+    """
+
+    def setUp(self):
+        if self.sim is not pyrtl.FastSimulation:
+            self.skipTest("run_parallel always uses FastSimulation")
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(4, 'a')
+        self.acc = pyrtl.Register(8, 'acc')
+        self.acc.next <<= self.acc + self.a
+        mem = pyrtl.MemBlock(bitwidth=8, addrwidth=2, name='mem')
+        self.mem = mem
+        mem[self.a[0:2]] <<= self.acc
+        out = pyrtl.Output(8, 'out')
+        out <<= mem[self.a[2:4]] ^ self.acc
+
+    def expected(self, stimulus):
+        trace = pyrtl.SimulationTrace()
+        sim = self.sim(tracer=trace, register_value_map={self.acc: 5},
+                       memory_value_map={self.mem: {1: 7}})
+        for inputs in stimulus:
+            sim.step({self.a: inputs['a']})
+        return trace
+
+    def check(self, workers):
+        import random
+        random.seed(42)
+        stimuli = [[{'a': random.randrange(16)} for cycle in range(random.randrange(1, 20))]
+                   for seq in range(5)]
+        stimuli.append({self.a: [3, 2, 1]})
+        traces = pyrtl.run_parallel(pyrtl.working_block(), stimuli, workers=workers,
+                                    register_value_map={self.acc: 5},
+                                    memory_value_map={self.mem: {1: 7}})
+        stimuli[-1] = [{'a': 3}, {'a': 2}, {'a': 1}]
+        self.assertEqual(len(traces), len(stimuli))
+        for stimulus, trace in zip(stimuli, traces):
+            expected = self.expected(stimulus)
+            self.assertEqual(sorted(trace.trace), sorted(expected.trace))
+            for name in expected.trace:
+                self.assertEqual(list(trace.trace[name]), list(expected.trace[name]))
+
+    def test_run_parallel(self):
+        self.check(workers=3)
+
+    def test_run_parallel_in_process(self):
+        self.check(workers=1)
+
+    def test_run_parallel_inconsistent_stimulus(self):
+        with self.assertRaises(pyrtl.PyrtlError):
+            pyrtl.run_parallel(None, [[{'a': 1}, {}]], workers=1)
+
+
+class SaveStateBase(unittest.TestCase):
+    """
+    Checks that a simulation restored from a checkpoint continues where it left off
+    """
+
+    def setUp(self):
+        import tempfile
+        import shutil
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = self.dir + '/state'
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(4, 'a')
+        self.acc = pyrtl.Register(70, 'acc')
+        self.acc.next <<= pyrtl.concat(self.acc[0:67], self.a[0:3]) + self.a
+        self.mem = pyrtl.MemBlock(bitwidth=12, addrwidth=3, name='mem')
+        self.mem[self.a[0:3]] <<= self.acc[0:12]
+        out = pyrtl.Output(12, 'out')
+        out <<= self.mem[self.a[1:4]] ^ self.acc[0:12]
+        self.inputs = [{self.a: (i * 7 + 3) % 16} for i in range(20)]
+
+    def run_trace(self, sim, inputs):
+        for values in inputs:
+            sim.step(values)
+        return [list(sim.tracer.trace[name])[-len(inputs):] for name in ('acc', 'out')]
+
+    def check_restore(self, restore_sim):
+        sim = self.sim(tracer=pyrtl.SimulationTrace())
+        self.run_trace(sim, self.inputs[:10])
+        sim.save_state(self.path)
+        self.assertEqual(sim.cycle, 10)
+        expected = self.run_trace(sim, self.inputs[10:])
+
+        restored = restore_sim(tracer=pyrtl.SimulationTrace())
+        restored.load_state(self.path)
+        self.assertEqual(restored.cycle, 10)
+        self.assertEqual(self.run_trace(restored, self.inputs[10:]), expected)
+        self.assertEqual(restored.cycle, 20)
+        if restore_sim is self.sim:  # the simulators apply memory writes at different times
+            self.assertEqual(restored.inspect_mem(self.mem), sim.inspect_mem(self.mem))
+
+    def test_save_and_load(self):
+        self.check_restore(self.sim)
+
+    def test_load_in_other_simulator(self):
+        for other in sims:
+            self.check_restore(other)
+
+    def test_save_right_after_load(self):
+        sim = self.sim(tracer=pyrtl.SimulationTrace())
+        self.run_trace(sim, self.inputs[:10])
+        sim.save_state(self.path)
+        restored = self.sim(tracer=pyrtl.SimulationTrace())
+        restored.load_state(self.path)
+        restored.save_state(self.path + '2')
+        with open(self.path, 'rb') as f, open(self.path + '2', 'rb') as f2:
+            self.assertEqual(f.read(), f2.read())
+
+    def test_load_mismatched_memory(self):
+        self.sim().save_state(self.path)
+        pyrtl.reset_working_block()
+        a = pyrtl.Input(4, 'a')
+        mem = pyrtl.MemBlock(bitwidth=8, addrwidth=3, name='mem')
+        mem[a[0:3]] <<= a
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.sim().load_state(self.path)
+
+    def test_memory_missing_from_checkpoint_keeps_last_write(self):
+        self.sim().save_state(self.path)
+        other = pyrtl.MemBlock(bitwidth=4, addrwidth=2, name='other')
+        other[self.a[0:2]] <<= self.a
+        sim = self.sim()
+        sim.step({self.a: 6})
+        sim.load_state(self.path)
+        sim.step({self.a: 0})
+        self.assertEqual(sim.inspect_mem(other)[2], 6)
+
+    def test_checkpoint_memory_view(self):
+        from pyrtl.simulation import _read_state
+        sim = self.sim(memory_value_map={self.mem: {0: 0, 1: 10, 4: 40, 6: 60}})
+        sim.save_state(self.path)
+        _, _, mems = _read_state(self.path)
+        bitwidth, addrwidth, contents = mems['mem']
+        self.assertEqual((bitwidth, addrwidth), (12, 3))
+        self.assertEqual(dict(contents.items()), {0: 0, 1: 10, 4: 40, 6: 60})
+        self.assertEqual(list(contents), [0, 1, 4, 6])
+        self.assertEqual([contents.get(addr) for addr in range(8)],
+                         [0, 10, None, None, 40, None, 60, None])
+
+    def test_load_checkpoint_with_other_memories(self):
+        big = pyrtl.MemBlock(bitwidth=32, addrwidth=24, name='big')
+        big[self.a] <<= self.acc[0:32]
+        sim = self.sim(memory_value_map={big: {i * 1000: i for i in range(1000)}})
+        sim.step({self.a: 2})
+        sim.save_state(self.path)
+        path = self.path
+        self.setUp()
+        restored = self.sim()
+        restored.load_state(path)
+        self.assertEqual(restored.cycle, 1)
+
+    def test_load_corrupt_file(self):
+        self.sim().save_state(self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for bad in (b'', data[:-1], b'X' + data[1:]):
+            with open(self.path, 'wb') as f:
+                f.write(bad)
+            with self.assertRaises(pyrtl.PyrtlError):
+                self.sim().load_state(self.path)
+
 
 def make_unittests():
     """
@@ -498,7 +1352,18 @@ def make_unittests():
     g.update(unittests)
 
 
+def c_compiler_available():
+    pyrtl.reset_working_block()
+    try:
+        pyrtl.CompiledSimulation()
+    except pyrtl.PyrtlError:
+        return False
+    return True
+
+
 sims = (pyrtl.Simulation, pyrtl.FastSimulation)
+if c_compiler_available():
+    sims += (pyrtl.CompiledSimulation,)
 make_unittests()
 
 
@@ -48,6 +48,22 @@ class TestWireVector(unittest.TestCase):
         self.assertIn("testJohn", block.wirevector_by_name)
         self.assertIn(w, block.wirevector_set)
 
+    def test_attributes_kept_in_slots(self):
+        r = pyrtl.Register(3, 'r')
+        r.next <<= r
+        wires = [pyrtl.WireVector(1), pyrtl.Input(2), pyrtl.Output(2), pyrtl.Const(5), r]
+        for w in wires:
+            self.assertEqual(w.bitmask, (1 << w.bitwidth) - 1)
+            self.assertEqual(vars(w), {})
+        self.assertEqual(wires[3].val, 5)
+        self.assertIs(r.reg_in, r)
+
+    def test_custom_attributes(self):
+        x = pyrtl.WireVector(1, 'x')
+        x.my_custom_property_name = 'metadata'
+        self.assertEqual(x.my_custom_property_name, 'metadata')
+        self.assertEqual(x.name, 'x')
+
 
 class TestWireVectorFail(unittest.TestCase):
     def setUp(self):